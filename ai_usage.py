@@ -0,0 +1,95 @@
+"""Учёт запросов к AI: токены и время по местам вызова и по чатам, по дням.
+
+ai_usage:{дата}:site - хеш {место}:calls/errors/prompt/output/thinking/ms,
+ai_usage:{дата}:chat - хеш {chat_id}:calls/tokens/ms,
+ai_usage:{дата}:lat:{место} - гистограмма времени ответа: номер корзины -> число.
+Корзины геометрические (шаг LATENCY_STEP, ~12%), поэтому p50/p95 считаются
+по корзинам с такой же точностью без хранения отдельных замеров.
+Дата местная (UTC+TZ_HOURS), ключи живут KEEP_DAYS дней.
+"""
+
+import math
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+TZ_HOURS = 10  # как у логов бота
+KEEP_DAYS = 35
+LATENCY_STEP = 1.25
+TOKEN_FIELDS = ("prompt", "output", "thinking")
+
+
+def _date(days_ago: int = 0) -> str:
+    now = datetime.now(timezone(timedelta(hours=TZ_HOURS))) - timedelta(days=days_ago)
+    return now.strftime("%Y-%m-%d")
+
+
+def _bucket(seconds: float) -> int:
+    return max(0, math.ceil(math.log(max(seconds, 0.001) * 1000, LATENCY_STEP)))
+
+
+def _bucket_seconds(bucket: int) -> float:
+    return LATENCY_STEP ** bucket / 1000
+
+
+def tokens(usage) -> dict[str, int]:
+    """Токены запроса, ответа и размышлений из usage_metadata (None - нули)."""
+    return {
+        "prompt": (getattr(usage, "prompt_token_count", 0) or 0) if usage else 0,
+        "output": (getattr(usage, "candidates_token_count", 0) or 0) if usage else 0,
+        "thinking": (getattr(usage, "thoughts_token_count", 0) or 0) if usage else 0,
+    }
+
+
+async def record(r, site: str, chat_id: int | None, usage, elapsed: float, error: bool = False):
+    """Учитывает один запрос. usage - response.usage_metadata (у ошибки - None)."""
+    date = _date()
+    site_key, chat_key, lat_key = f"ai_usage:{date}:site", f"ai_usage:{date}:chat", f"ai_usage:{date}:lat:{site}"
+    counts = tokens(usage)
+    ms = int(elapsed * 1000)
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hincrby(site_key, f"{site}:calls", 1)
+        pipe.hincrby(site_key, f"{site}:ms", ms)
+        if error:
+            pipe.hincrby(site_key, f"{site}:errors", 1)
+        for field, value in counts.items():
+            if value:
+                pipe.hincrby(site_key, f"{site}:{field}", value)
+        pipe.hincrby(lat_key, _bucket(elapsed), 1)
+        if chat_id is not None:
+            pipe.hincrby(chat_key, f"{chat_id}:calls", 1)
+            pipe.hincrby(chat_key, f"{chat_id}:tokens", sum(counts.values()))
+            pipe.hincrby(chat_key, f"{chat_id}:ms", ms)
+        for key in (site_key, chat_key, lat_key):
+            pipe.expire(key, KEEP_DAYS * 86400)
+        await pipe.execute()
+
+
+def _percentile(histogram: Counter, p: float) -> float:
+    total = sum(histogram.values())
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= total * p:
+            return _bucket_seconds(bucket)
+    return 0.0
+
+
+async def summary(r, days: int = 1) -> tuple[dict, dict]:
+    """({место: счётчики + p50/p95}, {chat_id: счётчики}) за последние days дней (сегодня включительно)."""
+    sites, chats, latency = {}, {}, {}
+    for days_ago in range(days):
+        date = _date(days_ago)
+        for field, value in (await r.hgetall(f"ai_usage:{date}:site")).items():
+            site, name = field.rsplit(":", 1)
+            sites.setdefault(site, Counter())[name] += int(value)
+        for field, value in (await r.hgetall(f"ai_usage:{date}:chat")).items():
+            chat_id, name = field.rsplit(":", 1)
+            chats.setdefault(int(chat_id), Counter())[name] += int(value)
+        for site in sites:
+            histogram = latency.setdefault(site, Counter())
+            for bucket, count in (await r.hgetall(f"ai_usage:{date}:lat:{site}")).items():
+                histogram[int(bucket)] += int(count)
+    for site, counters in sites.items():
+        counters["p50"] = _percentile(latency.get(site, Counter()), 0.5)
+        counters["p95"] = _percentile(latency.get(site, Counter()), 0.95)
+    return sites, chats
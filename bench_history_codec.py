@@ -0,0 +1,74 @@
+#-------------------------------------------------------------------------------
+# Бенчмарк формата истории: старый JSON против компактного history_codec
+# Запуск: python bench_history_codec.py [число_сообщений]
+#-------------------------------------------------------------------------------
+
+import json
+import random
+import sys
+import time
+
+from history_codec import encode_message, decode_message
+
+WORDS = ("привет как дела велосипед колесо цепь сегодня погода ремонт дорога "
+         "горячая вода свет отключили опять кто знает где купить завтра").split()
+NAMES = [("karamba666", "Павел"), ("None", "Valery Gordienko"), ("AndzhelaA78", "Анджела Аргунова"),
+         ("dv_pod", "Дмитрий"), ("None", "Мария Иванова")]
+
+
+def make_messages(n: int) -> list[dict]:
+    """Синтетическая история: короткие реплики, ответы и редкие длинные пересылки."""
+    rnd = random.Random(42)
+    messages = []
+    for i in range(n):
+        user_name, full_name = rnd.choice(NAMES)
+        msg = {'id': 450000 + i}
+        if rnd.random() < 0.3:
+            msg['reply_to'] = 450000 + max(0, i - rnd.randint(1, 50))
+        msg['user_name'] = user_name
+        msg['full_name'] = full_name
+        if rnd.random() < 0.05:
+            text = "Переслано от Новости города\n" + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(150, 400)))
+        else:
+            text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 25)))
+        msg['text'] = text
+        messages.append(msg)
+    return messages
+
+
+def bench(name, encode, decode, messages):
+    encoded = [encode(m) for m in messages]
+    size = sum(len(e) for e in encoded)
+    t0 = time.perf_counter()
+    for e in encoded:
+        decode(e)
+    decode_us = (time.perf_counter() - t0) / len(encoded) * 1e6
+    print(f"{name:<10} {size / len(encoded):>8.1f} байт/сообщ. {decode_us:>8.2f} мкс/декод")
+    return size
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    messages = make_messages(n)
+
+    # Проверка обратимости
+    for m in messages:
+        assert decode_message(encode_message(m)) == m
+
+    # v2: вместо имён только user_id (имена в справочнике чата)
+    user_ids = {full_name: i + 1 for i, (_, full_name) in enumerate(NAMES)}
+    messages_v2 = []
+    for m in messages:
+        m2 = {k: v for k, v in m.items() if k not in ('user_name', 'full_name')}
+        m2['user_id'] = user_ids[m['full_name']]
+        messages_v2.append(m2)
+
+    print(f"Сообщений: {n}")
+    old = bench("json", lambda m: json.dumps(m).encode(), json.loads, messages)
+    new = bench("codec v1", encode_message, decode_message, messages)
+    new_v2 = bench("codec v2", encode_message, decode_message, messages_v2)
+    print(f"Экономия v1: {100 * (1 - new / old):.1f}%, v2: {100 * (1 - new_v2 / old):.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#-------------------------------------------------------------------------------
+# Бенчмарк приёма сообщений: сколько сообщений в секунду выдерживает save_group_message
+# Реальный обработчик из main.py, синтетические сообщения aiogram (текст, подписи,
+# ответы, пересылки, фото), Telegram API подменён заглушкой - сеть не нужна.
+#
+# Запуск: python bench_ingest.py [-n 10000] [--chats 5] [--concurrency 1]
+#                                [--buffer-ms 0] [--backend zset] [--api-ms 0]
+#                                [--redis redis://localhost:6379/15]
+# Без --redis используется fakeredis. С --redis указанная база ОЧИЩАЕТСЯ (FLUSHDB).
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from io import BytesIO
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCH")
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+os.environ.setdefault("ADMIN_ID", "1")  # без него проверка баянов не доходит до copy_message
+
+import redis.asyncio as redis
+from redis.asyncio.connection import Connection
+from PIL import Image
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetFile, CopyMessage
+from aiogram.types import Message, Chat, User, PhotoSize, File, MessageId
+
+import main
+import history_store
+from write_buffer import WriteBuffer
+from verification_cache import VerificationCache
+from bench_history_codec import WORDS
+
+
+class MockSession(BaseSession):
+    """Сессия Bot без сети: отвечает на методы API заготовками, файлы - синтетические картинки."""
+
+    def __init__(self, latency_ms: float = 0):
+        super().__init__()
+        self.latency = latency_ms / 1000
+        self.calls: dict[str, int] = {}
+
+    async def close(self):
+        pass
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=f"photos/{method.file_id}.png")
+        if isinstance(method, CopyMessage):
+            return MessageId(message_id=1)
+        if method.__returning__ is bool:
+            return True
+        # sendMessage, sendAnimation и т.п. - минимальное сообщение от бота
+        return Message(message_id=1, date=datetime.now(), chat=Chat(id=getattr(method, 'chat_id', 0), type="supergroup"))
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        # Одинаковый file_id - одинаковая картинка (так получаются баяны)
+        file_id = url.rsplit('/', 1)[-1].split('.')[0]
+        rnd = random.Random(file_id)
+        img = Image.new('L', (32, 32))
+        img.putdata([rnd.randrange(256) for _ in range(32 * 32)])
+        buf = BytesIO()
+        img.save(buf, format='PNG')
+        yield buf.getvalue()
+
+
+def make_messages(n: int, chats: int) -> list[Message]:
+    """Синтетический поток: текст, ответы, пересылки, фото с подписью и без, повторы фото."""
+    rnd = random.Random(42)
+    users = [User(id=1000 + i, is_bot=False, first_name=f"Участник{i}", username=f"user{i}") for i in range(50)]
+    chat_list = [Chat(id=-1001000000000 - i, type="supergroup", title=f"Чат {i}") for i in range(chats)]
+    channel = Chat(id=-1009999999999, type="channel", title="Новости города")
+    next_id = {chat.id: 1 for chat in chat_list}
+    photos: list[str] = []
+
+    messages = []
+    for _ in range(n):
+        chat = rnd.choice(chat_list)
+        mid = next_id[chat.id]
+        next_id[chat.id] += 1
+        kw = {}
+        kind = rnd.random()
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 25)))
+
+        if kind < 0.25 and mid > 1:
+            kw['reply_to_message'] = Message(message_id=rnd.randint(max(1, mid - 50), mid - 1),
+                                             date=datetime.now(), chat=chat, from_user=rnd.choice(users), text="...")
+        if kind > 0.95:
+            kw['forward_from_chat'] = channel
+            text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(150, 400)))
+        if 0.80 < kind <= 0.95:
+            # Каждое пятое фото - повтор уже виденного (проверка баянов с совпадением)
+            file_id = rnd.choice(photos) if photos and rnd.random() < 0.2 else f"photo{len(photos)}"
+            photos.append(file_id)
+            kw['photo'] = [PhotoSize(file_id=file_id, file_unique_id=file_id, width=32, height=32)]
+            if rnd.random() < 0.5:
+                kw['caption'] = text
+            text = None
+
+        msg = Message(message_id=mid, date=datetime.now(), chat=chat, from_user=rnd.choice(users), text=text, **kw)
+        messages.append(msg.as_(main.bot))
+    return messages
+
+
+class CommandCounter:
+    """Считает команды Redis и обращения к серверу (pipeline - одно обращение)."""
+
+    def __init__(self):
+        self.commands = 0
+        self.round_trips = 0
+        self._pack = Connection.pack_command
+        self._send = Connection.send_packed_command
+
+    def __enter__(self):
+        counter = self
+
+        def pack_command(conn, *args):
+            counter.commands += 1
+            return counter._pack(conn, *args)
+
+        async def send_packed_command(conn, command, check_health=True):
+            counter.round_trips += 1
+            return await counter._send(conn, command, check_health)
+
+        Connection.pack_command = pack_command
+        Connection.send_packed_command = send_packed_command
+        return self
+
+    def __exit__(self, *exc):
+        Connection.pack_command = self._pack
+        Connection.send_packed_command = self._send
+
+
+async def data_bytes(rb) -> int:
+    """Оценка объёма данных (ключи + значения) для fakeredis, где нет INFO memory."""
+    total = 0
+    async for key in rb.scan_iter():
+        total += len(key)
+        kind = await rb.type(key)
+        if kind == b'zset':
+            total += sum(len(m) + 8 for m, _ in await rb.zrange(key, 0, -1, withscores=True))
+        elif kind == b'hash':
+            total += sum(len(f) + len(v) for f, v in (await rb.hgetall(key)).items())
+        elif kind == b'stream':
+            total += sum(len(i) + sum(len(f) + len(v) for f, v in fields.items()) for i, fields in await rb.xrange(key))
+        elif kind == b'set':
+            total += sum(len(m) for m in await rb.smembers(key))
+        elif kind == b'string':
+            total += len(await rb.get(key))
+    return total
+
+
+async def memory_used(rb, real: bool) -> int:
+    if real:
+        return (await rb.info('memory'))['used_memory']
+    return await data_bytes(rb)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def run(args):
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.redis:
+        main.r = redis.Redis.from_url(args.redis, decode_responses=True)
+        main.rb = redis.Redis.from_url(args.redis, decode_responses=False)
+        await main.rb.flushdb()
+    else:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        main.r = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        main.rb = fakeredis.FakeAsyncRedis(server=server, decode_responses=False)
+
+    session = MockSession(args.api_ms)
+    main.bot.session = session
+    main.history = history_store.create(args.backend, main.rb)
+    main.verification_cache = VerificationCache(main.r)
+    listener = asyncio.create_task(main.verification_cache.listen())
+    while not main.verification_cache.ready:
+        await asyncio.sleep(0.01)
+    main.write_buffer = WriteBuffer(main.r, main.history, main.HISTORY_TRIM_LIMIT, args.buffer_ms) if args.buffer_ms else None
+
+    messages = make_messages(args.messages, args.chats)
+    queue = asyncio.Queue()
+    for m in messages:
+        queue.put_nowait(m)
+    latencies = []
+
+    async def worker():
+        while not queue.empty():
+            m = queue.get_nowait()
+            t0 = time.perf_counter()
+            await main.save_group_message(m)
+            latencies.append(time.perf_counter() - t0)
+
+    mem_before = await memory_used(main.rb, bool(args.redis))
+    with CommandCounter() as counter:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        if main.write_buffer:
+            await main.write_buffer.close()
+        elapsed = time.perf_counter() - t0
+    mem_after = await memory_used(main.rb, bool(args.redis))
+    listener.cancel()
+
+    n = len(messages)
+    latencies.sort()
+    print(f"Сообщений: {n}, чатов: {args.chats}, параллельно: {args.concurrency}, "
+          f"бэкенд: {args.backend}, буфер: {f'{args.buffer_ms} мс' if args.buffer_ms else 'нет'}, Redis: {args.redis or 'fakeredis'}")
+    print(f"Пропускная способность: {n / elapsed:,.0f} сообщ./с ({elapsed:.2f} с)")
+    print(f"Задержка обработчика: p50 {percentile(latencies, 0.5) * 1000:.3f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.3f} мс, max {latencies[-1] * 1000:.3f} мс")
+    print(f"Redis: {counter.commands / n:.2f} команд/сообщ., {counter.round_trips / n:.2f} обращений/сообщ.")
+    label = "used_memory" if args.redis else "данные (оценка)"
+    print(f"Память Redis, {label}: {(mem_after - mem_before) / n * 10000 / 1024:,.0f} КБ на 10k сообщений")
+    print("Вызовы Telegram API:", ", ".join(f"{k} {v}" for k, v in sorted(session.calls.items())) or "нет")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарк приёма сообщений save_group_message")
+    parser.add_argument("-n", "--messages", type=int, default=10000)
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1, help="сколько сообщений обрабатывается одновременно")
+    parser.add_argument("--buffer-ms", type=int, default=0, help="WRITE_BUFFER_MS (0 - без буфера)")
+    parser.add_argument("--backend", default="zset", choices=list(history_store.BACKENDS))
+    parser.add_argument("--api-ms", type=float, default=0, help="искусственная задержка Telegram API")
+    parser.add_argument("--redis", help="URL локального redis-server (база будет очищена)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main_cli()
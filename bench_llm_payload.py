@@ -0,0 +1,72 @@
+#-------------------------------------------------------------------------------
+# Сравнение объёма запроса к AI: старый JSON против компактного llm_payload
+# Запуск: python bench_llm_payload.py [число_сообщений] [--chat ID] [--api]
+#   --chat ID  взять реальные окна из chat:{ID}:last_sum:all в Redis (вместо синтетики)
+#   --api      посчитать токены через Gemini count_tokens (нужен GOOGLE_API_KEY в .env)
+# Без --api токены оцениваются локально по символам.
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+from os import getenv
+
+from dotenv import load_dotenv
+
+from llm_payload import build_payload, estimate_tokens
+from bench_history_codec import make_messages
+
+load_dotenv()
+GEMINI_MODEL = "gemini-2.5-flash"
+
+
+async def load_windows(chat_id: int) -> list[list[dict]]:
+    import redis.asyncio as redis
+    r = redis.Redis(host=getenv("REDIS_HOST", "127.0.0.1"), port=int(getenv("REDIS_PORT", 6379)), decode_responses=True)
+    entries = await r.lrange(f"chat:{chat_id}:last_sum:all", 0, -1)
+    await r.aclose()
+    return [json.loads(entry)[2] for entry in entries]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("messages", nargs="?", type=int, default=2000)
+    parser.add_argument("--chat", type=int)
+    parser.add_argument("--api", action="store_true")
+    args = parser.parse_args()
+
+    windows = await load_windows(args.chat) if args.chat else [make_messages(args.messages)]
+    if not windows:
+        print("В Redis нет сохранённых окон сводок для этого чата.")
+        return
+
+    client = None
+    if args.api:
+        from google import genai
+        client = genai.Client(api_key=getenv("GOOGLE_API_KEY"))
+
+    variants = {
+        "json": lambda w: json.dumps(w),
+        "json utf-8": lambda w: json.dumps(w, ensure_ascii=False),
+        "compact": build_payload,
+    }
+    totals = {name: [0, 0] for name in variants}  # символы, токены
+    for window in windows:
+        for name, encode in variants.items():
+            payload = encode(window)
+            if client:
+                tokens = (await client.aio.models.count_tokens(model=GEMINI_MODEL, contents=payload)).total_tokens
+            else:
+                tokens = estimate_tokens(payload)
+            totals[name][0] += len(payload)
+            totals[name][1] += tokens
+
+    count = sum(len(w) for w in windows)
+    print(f"Окон: {len(windows)}, сообщений: {count}, токены: {'Gemini count_tokens' if client else 'оценка'}")
+    base = totals["json"][1]
+    for name, (chars, tokens) in totals.items():
+        print(f"{name:<11} {chars:>10} симв. {tokens:>9} ток. {tokens / count:>7.1f} ток./сообщ. {100 * (1 - tokens / base):>6.1f}% экономии")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+#-------------------------------------------------------------------------------
+# Бенчмарк всего пути /sum без сети и ключа: команда -> очередь сводок -> воркеры ->
+# AI (локальная заглушка llm_stub_server) -> Telegram (MockSession из bench_ingest)
+#
+# Запуск: python bench_summary.py [--chats 10] [--history 800] [--count 600] [--workers 2]
+#                                 [--llm-concurrency 4] [--latency-ms 3000] [--jitter-ms 1000]
+#                                 [--error-rate 0] [--hedge-model gemini-2.5-flash-lite]
+#                                 [--redis redis://localhost:6379/15]
+# Заглушка поднимается внутри процесса. Без --redis используется fakeredis,
+# с --redis указанная база ОЧИЩАЕТСЯ (FLUSHDB).
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from bench_ingest import MockSession, make_messages, percentile  # задаёт тестовые TELEGRAM_TOKEN и ключи
+
+import redis.asyncio as redis
+from aiogram.filters import CommandObject
+from aiogram.types import Message, Chat, User
+
+import main
+import history_store
+import llm_backend
+import llm_stub_server
+import summary_queue
+from gemini_cache import PromptCache
+from llm_hedge import Hedger
+from llm_scheduler import LLMScheduler
+from verification_cache import VerificationCache
+
+
+async def start_stub(args) -> web.AppRunner:
+    stub_args = SimpleNamespace(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                                error_status=429, length=args.length, chunks=10)
+    runner = web.AppRunner(llm_stub_server.make_app(stub_args))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    return runner
+
+
+async def run(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    summary_queue.READ_BLOCK_MS = 200
+
+    if args.redis:
+        main.r = redis.Redis.from_url(args.redis, decode_responses=True)
+        main.rb = redis.Redis.from_url(args.redis, decode_responses=False)
+        await main.rb.flushdb()
+    else:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        main.r = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        main.rb = fakeredis.FakeAsyncRedis(server=server, decode_responses=False)
+
+    runner = await start_stub(args)
+    main.llm = llm_backend.StubBackend(f"http://127.0.0.1:{args.port}")
+    main.ai_scheduler = LLMScheduler(args.llm_concurrency)
+    main.ai_hedger = Hedger(main.GEMINI_MODEL, args.hedge_model)
+    main.summary_prompt_cache = PromptCache(None, main.GEMINI_MODEL, "summary", main.r)
+    main.history = history_store.create(args.backend, main.rb)
+    main.write_buffer = None
+    main.verification_cache = VerificationCache(main.r)
+    main.verification_cache.ready = True  # Подписка не нужна: новичков в прогоне нет
+    session = MockSession(args.api_ms)
+    main.bot.session = session
+
+    # История чатов: обычный обработчик входящих сообщений
+    for message in make_messages(args.chats * args.history, args.chats):
+        await main.save_group_message(message)
+
+    latencies = []
+
+    async def timed_job(job: dict):
+        await main.run_summary_job(job)
+        latencies.append(time.time() - job["created"])
+
+    main.summary_jobs = summary_queue.SummaryQueue(main.r, timed_job, main.summary_lock_key,
+                                                   main.SUMMARIZE_LOCK_EXPIRY_SECONDS, on_dead=main.summary_job_dead)
+    await main.summary_jobs.ensure_group()
+    workers = [asyncio.create_task(main.summary_jobs.run(i)) for i in range(args.workers)]
+
+    t0 = time.perf_counter()
+    chat_ids = sorted([chat_id async for chat_id in main.history.chat_ids()])
+    for i, chat_id in enumerate(chat_ids):
+        command = Message(message_id=10_000_000 + i, date=datetime.now(), text=f"/sum {args.count}",
+                          chat=Chat(id=chat_id, type="supergroup", title=f"Чат {i}"),
+                          from_user=User(id=500 + i, is_bot=False, first_name=f"Бенч{i}")).as_(main.bot)
+        await main.summarize(command, CommandObject(prefix="/", command="sum", args=str(args.count)))
+
+    while len(latencies) + main.summary_jobs.failed < len(chat_ids) and sum(await main.summary_jobs.depth()):
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - t0
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await main.llm.close()
+    await runner.cleanup()
+
+    latencies.sort()
+    print(f"Чатов: {len(chat_ids)}, /sum {args.count} сообщений, воркеров: {args.workers}, "
+          f"AI одновременно: {args.llm_concurrency}, заглушка: {args.latency_ms:.0f}+-{args.jitter_ms:.0f} мс, ошибок {args.error_rate:.0%}")
+    print(f"Все сводки за {elapsed:.1f} с, выполнено {main.summary_jobs.done}, упало {main.summary_jobs.failed}")
+    if latencies:
+        print(f"От команды до сводки: p50 {percentile(latencies, 0.5):.1f} с, p95 {percentile(latencies, 0.95):.1f} с, "
+              f"max {latencies[-1]:.1f} с")
+    print(main.ai_scheduler.stats())
+    print(main.ai_hedger.stats())
+    print("Вызовы Telegram API:", ", ".join(f"{k} {v}" for k, v in sorted(session.calls.items())) or "нет")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарк /sum с заглушкой AI")
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--history", type=int, default=800, help="сообщений истории на чат")
+    parser.add_argument("--count", type=int, default=600, help="сообщений в /sum (от 600 - map-reduce)")
+    parser.add_argument("--workers", type=int, default=2, help="воркеров очереди сводок")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=3000)
+    parser.add_argument("--jitter-ms", type=float, default=1000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hedge-model", help="запасная модель для дублирующих запросов (заглушке имя не важно)")
+    parser.add_argument("--length", type=int, default=2500, help="длина сводки от заглушки")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend", default="zset", choices=list(history_store.BACKENDS))
+    parser.add_argument("--api-ms", type=float, default=0, help="искусственная задержка Telegram API")
+    parser.add_argument("--redis", help="URL локального redis-server (база будет очищена)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main_cli()
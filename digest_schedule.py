@@ -0,0 +1,74 @@
+"""Расписание ежедневных дайджестов по чатам.
+
+digest:schedule - хеш chat_id -> время "ЧЧ:ММ" (местное, UTC+TZ_HOURS),
+chat:{id}:digest:{дата} - отметка, что дайджест за эту дату уже запущен или пропущен.
+
+Чтобы чаты с одинаковым временем не обращались к AI одновременно, у каждого
+чата свой сдвиг до JITTER_MINUTES, который меняется день ото дня, но одинаков
+во всех процессах бота. Если бот был выключен и опоздал больше чем на
+LATE_LIMIT_MINUTES, дайджест за этот день пропускается.
+"""
+
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+
+SCHEDULE_KEY = "digest:schedule"
+TZ_HOURS = 10  # часовой пояс расписания (как у логов бота)
+JITTER_MINUTES = 20
+LATE_LIMIT_MINUTES = 180
+DONE_TTL = 2 * 86400
+
+
+def parse_time(text: str) -> str | None:
+    """'21:00' / '9.30' -> 'ЧЧ:ММ', иначе None."""
+    match = re.fullmatch(r"(\d{1,2})[:.](\d{2})", text.strip())
+    if not match or int(match[1]) > 23 or int(match[2]) > 59:
+        return None
+    return f"{int(match[1]):02d}:{match[2]}"
+
+
+def done_key(chat_id: int | str, date: str) -> str:
+    return f"chat:{chat_id}:digest:{date}"
+
+
+async def set_time(r, chat_id: int, hhmm: str):
+    await r.hset(SCHEDULE_KEY, chat_id, hhmm)
+
+
+async def get_time(r, chat_id: int) -> str | None:
+    return await r.hget(SCHEDULE_KEY, chat_id)
+
+
+async def remove(r, chat_id: int):
+    await r.hdel(SCHEDULE_KEY, chat_id)
+
+
+async def schedules(r) -> dict[int, str]:
+    return {int(chat_id): hhmm for chat_id, hhmm in (await r.hgetall(SCHEDULE_KEY)).items()}
+
+
+def due_date(chat_id: int, hhmm: str, now: datetime | None = None) -> str | None:
+    """
+    Местная дата, если дайджест чата пора запускать (время + сдвиг прошло, но не слишком давно).
+    Вчерашний дайджест тоже проверяется: окно опоздания может переходить за полночь.
+    """
+    local = (now or datetime.now(timezone.utc)).astimezone(timezone(timedelta(hours=TZ_HOURS)))
+    hour, minute = map(int, hhmm.split(":"))
+    for day in (local, local - timedelta(days=1)):
+        date = day.strftime("%Y-%m-%d")
+        jitter = zlib.crc32(f"{chat_id}:{date}".encode()) % (JITTER_MINUTES * 60)
+        due = day.replace(hour=hour, minute=minute, second=0, microsecond=0) + timedelta(seconds=jitter)
+        due = min(due, day.replace(hour=23, minute=59, second=0, microsecond=0))  # сдвиг не переносит на завтра
+        if due <= local < due + timedelta(minutes=LATE_LIMIT_MINUTES):
+            return date
+    return None
+
+
+async def is_done(r, chat_id: int, date: str) -> bool:
+    return bool(await r.exists(done_key(chat_id, date)))
+
+
+async def mark_done(r, chat_id: int, date: str) -> bool:
+    """Отмечает дайджест за дату. False, если отметка уже была (успел другой процесс)."""
+    return bool(await r.set(done_key(chat_id, date), 1, ex=DONE_TTL, nx=True))
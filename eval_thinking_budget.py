@@ -0,0 +1,109 @@
+#-------------------------------------------------------------------------------
+# Оценка бюджета размышлений сводки на сохранённых окнах chat:{ID}:last_sum:all
+# Запуск: python eval_thinking_budget.py [--chat ID ...] [--limit 20]
+#                                        [--settings "adaptive;1024;4096;11000"]
+# Настройки: adaptive - кривые SUMMARY_THINKING_CURVE / SUMMARY_LENGTH_CURVE (из .env
+# или по умолчанию), curve=2000:1024,8000:4096 - своя кривая размышлений, число -
+# постоянный бюджет с длиной до MAX_SUM (как было раньше). Разделитель настроек - ';'.
+# Запросы идут в AI-бэкенд из LLM_BACKEND (для прогона без ключа - stub).
+# Без --chat берутся все чаты с сохранёнными окнами. Из Redis бота окна только
+# читаются: всё, что пишет генерация сводки (For_debag, gpt_answ_t, учёт AI,
+# кеш промпта), уходит во временный fakeredis.
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import fakeredis
+import redis.asyncio as redis
+
+import main
+import summary_budget
+from gemini_cache import PromptCache
+from llm_payload import build_payload, estimate_tokens
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def parse_settings(text: str) -> list[tuple[str, dict]]:
+    """'adaptive;4096;curve=...' -> [(название, аргументы get_gpt4_summary)]."""
+    settings = []
+    for item in filter(None, (part.strip() for part in text.split(";"))):
+        if item == "adaptive":
+            settings.append((item, {}))
+        elif item.startswith("curve="):
+            curve = summary_budget.parse_curve(item[len("curve="):])
+            settings.append((item, {"thinking_curve": curve}))
+        else:
+            settings.append((f"fixed {item}", {"thinking_budget": int(item), "target_length": main.MAX_SUM}))
+    return settings
+
+
+async def load_windows(r, chat_ids: list[int], limit: int) -> list[tuple[int, list]]:
+    if not chat_ids:
+        chat_ids = [int(key.split(":")[1]) async for key in r.scan_iter("chat:*:last_sum:all")]
+    windows = []
+    for chat_id in chat_ids:
+        for entry in await r.lrange(f"chat:{chat_id}:last_sum:all", 0, -1):
+            windows.append((chat_id, json.loads(entry)[2]))
+    return windows[:limit]
+
+
+async def run(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    source = redis.Redis(host=main.REDIS_HOST, port=main.REDIS_PORT, decode_responses=True)
+    windows = await load_windows(source, args.chat, args.limit)
+    await source.aclose()
+    main.r = fakeredis.FakeAsyncRedis(decode_responses=True)
+    main.summary_prompt_cache = PromptCache(main.llm.client, main.GEMINI_MODEL, "summary", main.r)
+
+    if not windows:
+        print("В Redis нет сохранённых окон сводок (chat:{ID}:last_sum:all).")
+        return
+    tokens = [estimate_tokens(build_payload(messages)) for _, messages in windows]
+    print(f"Окон: {len(windows)}, сообщений: {sum(len(m) for _, m in windows)}, "
+          f"токенов на окно (оценка): p50 {percentile(tokens, 0.5)}, max {max(tokens)}, бэкенд: {main.LLM_BACKEND}")
+
+    for name, options in parse_settings(args.settings):
+        curve = options.pop("thinking_curve", None)
+        latencies, lengths, budgets, failed = [], [], [], 0
+        for (chat_id, messages), window_tokens in zip(windows, tokens):
+            kwargs = dict(options)
+            if curve:
+                kwargs["thinking_budget"] = summary_budget.interpolate(curve, window_tokens)
+            budgets.append(kwargs.get("thinking_budget") or summary_budget.interpolate(main.SUMMARY_THINKING_CURVE, window_tokens))
+            turl = f"t.me/c/{str(chat_id).removeprefix('-100')}/"
+            started = time.perf_counter()
+            summary = await main.get_gpt4_summary(messages, turl, chat_id=chat_id, **kwargs)
+            if summary is None:
+                failed += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            lengths.append(len(summary))
+        line = f"{name:<28} бюджет ср. {sum(budgets) / len(budgets):>6.0f}"
+        if latencies:
+            line += (f"  время p50 {percentile(latencies, 0.5):>5.1f} с, p95 {percentile(latencies, 0.95):>5.1f} с"
+                     f"  длина ср. {sum(lengths) / len(lengths):>5.0f}, max {max(lengths):>5}")
+        print(line + f"  ошибок {failed}")
+
+    if getattr(main.llm, "close", None):
+        await main.llm.close()
+    await main.r.aclose()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Сравнение бюджетов размышлений сводки на сохранённых окнах")
+    parser.add_argument("--chat", type=int, action="append", default=[], help="чат (можно несколько раз)")
+    parser.add_argument("--limit", type=int, default=20, help="не больше стольких окон")
+    parser.add_argument("--settings", default="adaptive;1024;4096;11000", help="настройки через ';'")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main_cli()
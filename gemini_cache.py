@@ -0,0 +1,111 @@
+"""Кеширование статичного системного промпта на стороне Gemini (context caching).
+
+Большая системная инструкция сводки не пересылается и не обрабатывается
+заново на каждый запрос: она один раз кладётся в cached content, а запросы
+ссылаются на него по имени. Кеш продлевается до истечения, при смене текста
+промпта создаётся новый. Если кеширование недоступно (модель, лимиты,
+слишком короткий промпт), возвращаются обычные inline-параметры, и попытка
+повторяется не раньше чем через RETRY_AFTER секунд.
+
+Имя кеша хранится в Redis, чтобы перезапуски и соседние процессы бота
+переиспользовали его, а не плодили новые. Там же - счётчики для сравнения
+задержки и токенов с кешем и без.
+"""
+
+import hashlib
+import logging
+import time
+
+from google.genai import types as gtypes
+
+CACHE_TTL = 3600  # секунд жизни кеша в Gemini
+REFRESH_BEFORE = 300  # продлевать, когда до истечения осталось меньше
+RETRY_AFTER = 1800  # пауза после неудачного создания кеша
+STATS_KEY = "gemini_cache:stats"
+
+
+class PromptCache:
+    def __init__(self, client, model: str, label: str, redis_client=None):
+        self.client = client  # None - бэкенд без кеша (не Gemini), промпт всегда inline
+        self.model = model
+        self.label = label
+        self.r = redis_client
+        self._name: str | None = None
+        self._hash: str | None = None
+        self._expires = 0.0  # time.time() истечения кеша
+        self._disabled_until = 0.0
+
+    def _redis_key(self, prompt_hash: str) -> str:
+        return f"gemini_cache:{self.label}:{prompt_hash}"
+
+    async def config(self, system_instruction: str, tools: list | None = None, **kwargs) -> gtypes.GenerateContentConfig:
+        """GenerateContentConfig со ссылкой на кеш или, если кеш недоступен, с inline-промптом."""
+        name = await self._ensure(system_instruction, tools)
+        if name:
+            return gtypes.GenerateContentConfig(cached_content=name, **kwargs)
+        return gtypes.GenerateContentConfig(system_instruction=system_instruction, tools=tools, **kwargs)
+
+    async def _ensure(self, system_instruction: str, tools: list | None) -> str | None:
+        now = time.time()
+        if self.client is None or now < self._disabled_until:
+            return None
+        prompt_hash = hashlib.sha1(system_instruction.encode()).hexdigest()[:12]
+        try:
+            if prompt_hash != self._hash:
+                # Промпт изменился (или первый вызов): ищем кеш этой версии у соседей
+                self._name, self._hash, self._expires = None, prompt_hash, 0.0
+                if self.r:
+                    name = await self.r.get(self._redis_key(prompt_hash))
+                    ttl = await self.r.ttl(self._redis_key(prompt_hash)) if name else 0
+                    if name and ttl > REFRESH_BEFORE:
+                        self._name, self._expires = name, now + ttl
+
+            if self._name and self._expires - now < REFRESH_BEFORE:
+                await self.client.aio.caches.update(
+                    name=self._name, config=gtypes.UpdateCachedContentConfig(ttl=f"{CACHE_TTL}s"))
+                self._expires = now + CACHE_TTL
+                await self._remember()
+            elif not self._name:
+                cached = await self.client.aio.caches.create(model=self.model, config=gtypes.CreateCachedContentConfig(
+                    display_name=f"{self.label}-{prompt_hash}",
+                    system_instruction=system_instruction,
+                    tools=tools,
+                    ttl=f"{CACHE_TTL}s",
+                ))
+                self._name, self._expires = cached.name, now + CACHE_TTL
+                await self._remember()
+                logging.info(f"Создан кеш промпта {self.label}: {cached.name}")
+        except Exception as e:
+            logging.warning(f"Кеш промпта {self.label} недоступен, промпт уходит целиком: {e}")
+            await self.invalidate()
+            self._disabled_until = now + RETRY_AFTER
+            return None
+        return self._name
+
+    async def _remember(self):
+        if self.r:
+            await self.r.set(self._redis_key(self._hash), self._name, ex=int(self._expires - time.time()))
+
+    async def invalidate(self):
+        """Забыть кеш (удалён или истёк на стороне Gemini) - следующий вызов создаст новый."""
+        if self.r and self._hash:
+            try:
+                await self.r.delete(self._redis_key(self._hash))
+            except Exception as e:
+                logging.error(f"Не удалось удалить имя кеша промпта из Redis: {e}")
+        self._name, self._hash, self._expires = None, None, 0.0
+
+    async def record(self, response, elapsed: float, cached: bool):
+        """Счётчики запросов, задержки и токенов из кеша."""
+        usage = response.usage_metadata
+        cached_tokens = (usage.cached_content_token_count or 0) if usage else 0
+        prompt_tokens = (usage.prompt_token_count or 0) if usage else 0
+        kind = "cached" if cached else "inline"
+        logging.info(f"{self.label}: {kind}, {elapsed:.1f} с, промпт {prompt_tokens} ток., из кеша {cached_tokens}")
+        if self.r:
+            async with self.r.pipeline() as pipe:
+                pipe.hincrby(STATS_KEY, f"{kind}_calls", 1)
+                pipe.hincrby(STATS_KEY, f"{kind}_ms", int(elapsed * 1000))
+                pipe.hincrby(STATS_KEY, f"{kind}_prompt_tokens", prompt_tokens)
+                pipe.hincrby(STATS_KEY, "cached_tokens", cached_tokens)
+                await pipe.execute()
@@ -0,0 +1,149 @@
+"""Архив истории чата на локальном диске (всё, что старше MAX_HISTORY в Redis).
+
+Для каждого чата - папка {base_dir}/{chat_id}/:
+  * сегменты NNNNNNNNNNNN.seg - только дозапись, состоят из блоков;
+    блок = заголовок (count, first_id, last_id, длина) + zlib-сжатые записи history_codec;
+  * index - разреженный индекс: одна строка на блок
+    "first_id last_id count сегмент смещение".
+
+Чтение идёт поблочно: распаковывается только нужный блок, сегмент целиком
+в память не грузится. Методы синхронные - из asyncio вызывать через asyncio.to_thread.
+"""
+
+import logging
+import os
+import shutil
+import struct
+import threading
+import zlib
+
+from history_codec import decode_message
+
+BLOCK_MESSAGES = 256  # записей в одном сжатом блоке
+SEGMENT_MAX_BYTES = 8 * 1024 * 1024  # после этого размера начинается новый сегмент
+
+_BLOCK_HEADER = struct.Struct('<IqqI')  # count, first_id, last_id, длина сжатых данных
+_RECORD_LEN = struct.Struct('<I')
+
+
+class HistoryArchive:
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._index_cache: dict[str, tuple[int, list[tuple]]] = {}  # chat_id -> (размер index, записи)
+        self._lock = threading.RLock()  # дозапись и кеш индекса - только из одного потока за раз
+
+    def _chat_dir(self, chat_id) -> str:
+        return os.path.join(self.base_dir, str(chat_id))
+
+    def _load_index(self, chat_id) -> list[tuple[int, int, int, str, int]]:
+        """Записи индекса (first_id, last_id, count, сегмент, смещение), кешируются до изменения файла."""
+        path = os.path.join(self._chat_dir(chat_id), "index")
+        with self._lock:  # читатели работают в потоках asyncio.to_thread
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return []
+            cached = self._index_cache.get(str(chat_id))
+            if cached and cached[0] == size:
+                return cached[1]
+
+            entries = []
+            with open(path, encoding='ascii') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 5:
+                        continue  # недописанная строка после сбоя
+                    first_id, last_id, count, segment, offset = parts
+                    entries.append((int(first_id), int(last_id), int(count), segment, int(offset)))
+            self._index_cache[str(chat_id)] = (size, entries)
+            return entries
+
+    def _read_block(self, chat_id, segment: str, offset: int) -> list[bytes]:
+        with open(os.path.join(self._chat_dir(chat_id), segment), 'rb') as f:
+            f.seek(offset)
+            count, _, _, length = _BLOCK_HEADER.unpack(f.read(_BLOCK_HEADER.size))
+            payload = zlib.decompress(f.read(length))
+        records, pos = [], 0
+        for _ in range(count):
+            (size,) = _RECORD_LEN.unpack_from(payload, pos)
+            pos += _RECORD_LEN.size
+            records.append(payload[pos:pos + size])
+            pos += size
+        return records
+
+    def append(self, chat_id, records: list[tuple[int, bytes]]):
+        """Дописывает записи (message_id, запись history_codec) в порядке возрастания ID."""
+        if not records:
+            return
+        with self._lock:
+            chat_dir = self._chat_dir(chat_id)
+            os.makedirs(chat_dir, exist_ok=True)
+            entries = self._load_index(chat_id)
+            if entries:
+                # Повторная выгрузка после сбоя: пропускаем то, что уже в архиве
+                last_archived = entries[-1][1]
+                skipped = [rec[0] for rec in records if rec[0] <= last_archived]
+                if skipped:
+                    logging.warning(f"Архив чата {chat_id}: пропущено {len(skipped)} записей с ID не новее "
+                                    f"{last_archived} (уже в архиве или опоздали): {skipped[:20]}")
+                    records = [rec for rec in records if rec[0] > last_archived]
+                if not records:
+                    return
+
+            segment = entries[-1][3] if entries else None
+            if segment is None or os.path.getsize(os.path.join(chat_dir, segment)) >= SEGMENT_MAX_BYTES:
+                segment = f"{records[0][0]:012d}.seg"
+
+            index_lines = []
+            with open(os.path.join(chat_dir, segment), 'ab') as seg:
+                for i in range(0, len(records), BLOCK_MESSAGES):
+                    block = records[i:i + BLOCK_MESSAGES]
+                    payload = zlib.compress(b''.join(_RECORD_LEN.pack(len(raw)) + raw for _, raw in block))
+                    offset = seg.tell()
+                    seg.write(_BLOCK_HEADER.pack(len(block), block[0][0], block[-1][0], len(payload)))
+                    seg.write(payload)
+                    index_lines.append(f"{block[0][0]} {block[-1][0]} {len(block)} {segment} {offset}\n")
+                seg.flush()
+                os.fsync(seg.fileno())
+
+            # Индекс пишется после данных: читатель не увидит блок, которого ещё нет на диске
+            with open(os.path.join(chat_dir, "index"), 'a', encoding='ascii') as index:
+                index.writelines(index_lines)
+        logging.info(f"В архив чата {chat_id} записано {len(records)} сообщений.")
+
+    def count(self, chat_id) -> int:
+        return sum(entry[2] for entry in self._load_index(chat_id))
+
+    def latest(self, chat_id, count: int, offset: int = 0) -> list[bytes]:
+        """count записей, пропустив offset самых новых в архиве. Хронологический порядок."""
+        result = []
+        skip = offset
+        for first_id, last_id, block_count, segment, seg_offset in reversed(self._load_index(chat_id)):
+            if count <= 0:
+                break
+            if skip >= block_count:
+                skip -= block_count
+                continue
+            records = self._read_block(chat_id, segment, seg_offset)
+            end = len(records) - skip
+            start = max(0, end - count)
+            result[:0] = records[start:end]
+            count -= end - start
+            skip = 0
+        return result
+
+    def get(self, chat_id, message_id: int) -> bytes | None:
+        """Запись по ID через разреженный индекс: распаковывается только один блок."""
+        for first_id, last_id, _, segment, seg_offset in self._load_index(chat_id):
+            if first_id <= message_id <= last_id:
+                for raw in self._read_block(chat_id, segment, seg_offset):
+                    if decode_message(raw)['id'] == message_id:
+                        return raw
+                return None
+        return None
+
+    def drop(self, chat_id):
+        """Удаляет архив чата целиком (бота удалили из чата)."""
+        with self._lock:
+            shutil.rmtree(self._chat_dir(chat_id), ignore_errors=True)
+            self._index_cache.pop(str(chat_id), None)
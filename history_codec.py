@@ -0,0 +1,90 @@
+"""Компактный формат записей истории чата (ключ chat:{id}:history).
+
+Запись = 1 байт версии + msgpack-кортеж полей. Длинные тексты (обычно пересылки)
+дополнительно сжимаются zlib, если это реально уменьшает размер.
+Старые записи в JSON продолжают читаться (dual-read), поэтому миграция не нужна.
+
+v2 хранит вместо имён только user_id, имена лежат в справочнике (user_directory).
+"""
+
+import json
+import zlib
+
+import msgpack
+
+# --- ВЕРСИИ ФОРМАТА ---
+FMT_V1 = 1       # msgpack: [id, reply_to, user_name, full_name, text]
+FMT_V1_ZLIB = 2  # то же самое, но msgpack сжат zlib
+FMT_V2 = 3       # msgpack: [id, reply_to, user_id, text]
+FMT_V2_ZLIB = 4  # то же самое, но msgpack сжат zlib
+
+ZLIB_MIN_SIZE = 400  # байт, начиная с которых пробуем сжатие
+ZLIB_LEVEL = 6
+
+
+def encode_message(data: dict) -> bytes:
+    """
+    Кодирует словарь сообщения в компактную бинарную запись.
+    Записи с user_id пишутся в v2, старые записи с именами (миграция) - в v1.
+    """
+    if 'user_id' in data:
+        version, version_zlib = FMT_V2, FMT_V2_ZLIB
+        author = [data['user_id']]
+    else:
+        version, version_zlib = FMT_V1, FMT_V1_ZLIB
+        author = [data.get('user_name'), data.get('full_name')]
+    packed = msgpack.packb([
+        data['id'],
+        data.get('reply_to') or 0,  # 0 - нет ответа
+        *author,
+        data.get('text', ''),
+    ], use_bin_type=True)
+
+    if len(packed) >= ZLIB_MIN_SIZE:
+        compressed = zlib.compress(packed, ZLIB_LEVEL)
+        if len(compressed) < len(packed):
+            return bytes((version_zlib,)) + compressed
+    return bytes((version,)) + packed
+
+
+def decode_message(raw: bytes | str) -> dict:
+    """
+    Декодирует запись истории в словарь:
+    v2 - {'id', 'reply_to'?, 'user_id', 'text'},
+    v1 и старый JSON - {'id', 'reply_to'?, 'user_name', 'full_name', 'text'}.
+    """
+    if isinstance(raw, str):
+        return json.loads(raw)
+    if not raw:
+        raise ValueError("Пустая запись истории")
+
+    version = raw[0]
+    if version in (FMT_V1, FMT_V2):
+        fields = msgpack.unpackb(raw[1:], raw=False)
+    elif version in (FMT_V1_ZLIB, FMT_V2_ZLIB):
+        fields = msgpack.unpackb(zlib.decompress(raw[1:]), raw=False)
+    else:
+        # Старая запись: JSON-объект, начинается с '{'
+        return json.loads(raw)
+
+    msg_id, reply_to, *author, text = fields
+    message = {'id': msg_id}
+    if reply_to:
+        message['reply_to'] = reply_to
+    if version in (FMT_V2, FMT_V2_ZLIB):
+        message['user_id'] = author[0]
+    else:
+        message['user_name'], message['full_name'] = author
+    message['text'] = text
+    return message
+
+
+def decode_messages(raws: list) -> list[dict]:
+    """Декодирует список записей, пропуская битые."""
+    messages = []
+    for raw in raws:
+        try:
+            messages.append(decode_message(raw))
+        except (ValueError, TypeError, zlib.error):  # ошибки msgpack наследуют ValueError
+            continue
+    return messages
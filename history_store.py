@@ -0,0 +1,357 @@
+"""Хранилище истории чата в Redis с выбираемым бэкендом (HISTORY_BACKEND).
+
+* zset (по умолчанию) - sorted set chat:{id}:history: член - запись history_codec,
+  score - message_id. ID сообщений в чате растут монотонно, поэтому порядок
+  по score совпадает с порядком поступления, а поиск по ID - O(log N)
+  на любой глубине истории (правки, ответы, удаления - один запрос).
+* stream - Redis Stream chat:{id}:history_stream с ID записи "{message_id}-0"
+  и XADD MAXLEN ~. Выборка "новое с последней сводки" - XREVRANGE от курсора,
+  передаются только нужные записи. Записи потока неизменяемы, поэтому правки
+  лежат рядом в хеше chat:{id}:history_edits и накладываются при чтении
+  (правки обрезанных MAXLEN сообщений удаляются из хеша при следующей правке).
+  Поток принимает только ID больше последнего, а сообщения приходят не по
+  порядку (обработчики aiogram параллельны, sum_only.py пишет в те же чаты).
+  Опоздавшие сообщения ложатся в sorted set chat:{id}:history_late и
+  подмешиваются при чтении, повторы (переотправленные апдейты) пропускаются.
+
+Хранилища работают через бинарный клиент Redis (decode_responses=False).
+Если передан archive (HistoryArchive), чтение прозрачно продолжается
+в дисковом архиве, куда spill_to_archive выгружает всё старше max_history.
+"""
+
+import abc
+import asyncio
+import logging
+
+from history_codec import encode_message, decode_message, decode_messages
+
+# Атомарная замена записи: только если сообщение с таким ID уже есть в истории
+_ZSET_REPLACE_LUA = """
+if redis.call('ZREMRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1]) > 0 then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# То же для потока: правка кладётся в хеш правок, если запись есть в потоке,
+# опоздавшее сообщение заменяется прямо в sorted set. Заодно из хеша удаляются
+# правки сообщений, которые XADD MAXLEN уже обрезал (младше первой записи потока)
+_STREAM_REPLACE_LUA = """
+if #redis.call('XRANGE', KEYS[1], ARGV[1], ARGV[1]) > 0 then
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+    local first = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', 1)[1][1]
+    local first_id = tonumber(string.match(first, '^(%d+)'))
+    for _, field in ipairs(redis.call('HKEYS', KEYS[2])) do
+        if tonumber(field) < first_id then redis.call('HDEL', KEYS[2], field) end
+    end
+    return 1
+end
+if redis.call('ZREMRANGEBYSCORE', KEYS[3], ARGV[2], ARGV[2]) > 0 then
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Добавление в поток: повтор ID пропускается (0), ID не больше последнего в потоке
+# уходит в sorted set опоздавших (2), иначе XADD (1). ARGV[3] - MAXLEN, 0 - без обрезки
+_STREAM_ADD_LUA = """
+local entry_id = ARGV[1] .. '-0'
+if #redis.call('XRANGE', KEYS[1], entry_id, entry_id) > 0
+        or #redis.call('ZRANGEBYSCORE', KEYS[2], ARGV[1], ARGV[1]) > 0 then
+    return 0
+end
+local added
+if ARGV[3] == '0' then
+    added = redis.pcall('XADD', KEYS[1], entry_id, 'r', ARGV[2])
+else
+    added = redis.pcall('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], entry_id, 'r', ARGV[2])
+end
+if type(added) == 'table' and added.err then
+    redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+    if ARGV[3] ~= '0' then
+        redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[3]) + 1))
+    end
+    return 2
+end
+return 1
+"""
+
+
+class _HistoryStore(abc.ABC):
+    """Общая часть бэкендов: дочитывание из архива и выгрузка в архив."""
+    name = ""
+    scan_pattern = ""
+
+    def __init__(self, rb):
+        self.rb = rb
+
+    @abc.abstractmethod
+    def key(self, chat_id: int | str) -> str:
+        """Ключ Redis с историей чата."""
+
+    def add_message(self, pipe, chat_id: int, message_data: dict, max_history: int):
+        """Добавляет запись и обрезку истории в уже открытый pipeline."""
+        self.add_messages(pipe, chat_id, [message_data], max_history)
+
+    async def latest(self, chat_id: int, count: int, offset: int = 0, archive=None) -> list[dict]:
+        """Последние count сообщений, пропустив offset самых новых. Хронологический порядок."""
+        raws = await self._latest_raw(chat_id, count, offset)
+        messages = decode_messages(raws)
+
+        if archive is not None and len(raws) < count:
+            # Не хватило Redis - добираем более старые сообщения из архива
+            in_redis = await self.count(chat_id)
+            older = await asyncio.to_thread(archive.latest, chat_id, count - len(raws), max(0, offset - in_redis))
+            messages = decode_messages(older) + messages
+        return messages
+
+    async def get(self, chat_id: int, message_id: int, archive=None) -> dict | None:
+        """Одна запись по ID сообщения или None."""
+        raw = await self._get_raw(chat_id, message_id)
+        if raw is None and archive is not None:
+            raw = await asyncio.to_thread(archive.get, chat_id, message_id)
+        messages = decode_messages([raw] if raw else [])
+        return messages[0] if messages else None
+
+    async def spill_to_archive(self, archive, max_history: int) -> int:
+        """
+        Выгружает в архив самые старые сообщения сверх max_history и удаляет их из Redis.
+        Возвращает число выгруженных сообщений.
+        """
+        spilled = 0
+        async for chat_id in self.chat_ids():
+            excess = await self.count(chat_id) - max_history
+            if excess <= 0:
+                continue
+            records = await self.oldest(chat_id, excess)
+            if not records:
+                continue
+            await asyncio.to_thread(archive.append, chat_id, records)
+            # Удаляем по ID, а не по позиции: новые сообщения могли прийти во время записи
+            await self.remove_upto(chat_id, records[-1][0])
+            spilled += len(records)
+        return spilled
+
+    async def chat_ids(self):
+        async for key in self.rb.scan_iter(self.scan_pattern):
+            if await self.rb.type(key) == self._redis_type:
+                yield key.decode().split(':')[1]
+
+
+class ZSetHistoryStore(_HistoryStore):
+    name = "zset"
+    scan_pattern = "chat:*:history"
+    _redis_type = b'zset'
+
+    def key(self, chat_id: int | str) -> str:
+        return f"chat:{chat_id}:history"
+
+    def add_messages(self, pipe, chat_id: int, messages: list[dict], max_history: int):
+        """Добавляет пачку записей одним ZADD и одну обрезку истории в pipeline."""
+        key = self.key(chat_id)
+        pipe.zadd(key, {encode_message(m): m['id'] for m in messages})
+        pipe.zremrangebyrank(key, 0, -(max_history + 1))
+
+    async def _latest_raw(self, chat_id, count, offset) -> list[bytes]:
+        raws = await self.rb.zrevrange(self.key(chat_id), offset, offset + count - 1)
+        raws.reverse()
+        return raws
+
+    async def _get_raw(self, chat_id, message_id) -> bytes | None:
+        raws = await self.rb.zrangebyscore(self.key(chat_id), message_id, message_id)
+        return raws[0] if raws else None
+
+    async def after(self, chat_id: int, after_id: int, limit: int) -> list[dict]:
+        """Сообщения с ID > after_id (не более limit самых новых). Хронологический порядок."""
+        raws = await self.rb.zrevrangebyscore(self.key(chat_id), '+inf', f"({after_id}", start=0, num=limit)
+        messages = decode_messages(raws)
+        messages.reverse()
+        return messages
+
+    async def replace(self, chat_id: int, message_data: dict) -> bool:
+        """Заменяет запись с тем же ID. Возвращает False, если сообщения нет в истории."""
+        result = await self.rb.eval(_ZSET_REPLACE_LUA, 1, self.key(chat_id), message_data['id'], encode_message(message_data))
+        return bool(result)
+
+    async def delete(self, chat_id: int, message_id: int) -> bool:
+        """Удаляет запись по ID. Возвращает True, если что-то удалено."""
+        return bool(await self.rb.zremrangebyscore(self.key(chat_id), message_id, message_id))
+
+    async def count(self, chat_id) -> int:
+        return await self.rb.zcard(self.key(chat_id))
+
+    async def oldest(self, chat_id, count: int) -> list[tuple[int, bytes]]:
+        """count самых старых записей как (message_id, запись)."""
+        if count <= 0:
+            return []
+        return [(int(score), raw) for raw, score in await self.rb.zrange(self.key(chat_id), 0, count - 1, withscores=True)]
+
+    async def remove_upto(self, chat_id, last_id: int):
+        await self.rb.zremrangebyscore(self.key(chat_id), '-inf', last_id)
+
+    async def write_all(self, chat_id, records: list[tuple[int, bytes]]):
+        """Записывает готовые записи (для миграции между бэкендами)."""
+        await self.rb.zadd(self.key(chat_id), {raw: msg_id for msg_id, raw in records})
+
+
+class StreamHistoryStore(_HistoryStore):
+    name = "stream"
+    scan_pattern = "chat:*:history_stream"
+    _redis_type = b'stream'
+
+    def key(self, chat_id: int | str) -> str:
+        return f"chat:{chat_id}:history_stream"
+
+    def edits_key(self, chat_id: int | str) -> str:
+        return f"chat:{chat_id}:history_edits"
+
+    def late_key(self, chat_id: int | str) -> str:
+        return f"chat:{chat_id}:history_late"
+
+    def add_messages(self, pipe, chat_id: int, messages: list[dict], max_history: int):
+        """XADD с явным ID "{message_id}-0" и приблизительной обрезкой по длине (опоздавшие - в history_late)."""
+        for m in sorted(messages, key=lambda m: m['id']):
+            pipe.eval(_STREAM_ADD_LUA, 2, self.key(chat_id), self.late_key(chat_id),
+                      m['id'], encode_message(m), max_history)
+
+    async def _apply_edits(self, chat_id, records: list[tuple[int, bytes]]) -> list[tuple[int, bytes]]:
+        """Подставляет в (message_id, запись) правки из хеша."""
+        if records and await self.rb.hlen(self.edits_key(chat_id)):
+            edited = await self.rb.hmget(self.edits_key(chat_id), [msg_id for msg_id, _ in records])
+            records = [(msg_id, new or raw) for (msg_id, raw), new in zip(records, edited)]
+        return records
+
+    @staticmethod
+    def _merge(entries, late, reverse: bool = False) -> list[tuple[int, bytes]]:
+        """Записи потока и опоздавшие (raw, score) одним списком (message_id, запись) по ID."""
+        records = [(int(entry_id.split(b'-')[0]), fields[b'r']) for entry_id, fields in entries]
+        records += [(int(score), raw) for raw, score in late]
+        return sorted(records, key=lambda rec: rec[0], reverse=reverse)
+
+    async def _latest_raw(self, chat_id, count, offset) -> list[bytes]:
+        # У потока нет позиционного доступа: берём offset + count с конца и отрезаем лишнее
+        entries = await self.rb.xrevrange(self.key(chat_id), count=offset + count)
+        late = await self.rb.zrevrange(self.late_key(chat_id), 0, offset + count - 1, withscores=True)
+        records = self._merge(entries, late, reverse=True)[offset:offset + count]
+        records.reverse()
+        return [raw for _, raw in await self._apply_edits(chat_id, records)]
+
+    async def _get_raw(self, chat_id, message_id) -> bytes | None:
+        entry_id = f"{message_id}-0"
+        entries = await self.rb.xrange(self.key(chat_id), entry_id, entry_id)
+        late = [] if entries else await self.rb.zrangebyscore(self.late_key(chat_id), message_id, message_id, withscores=True)
+        records = await self._apply_edits(chat_id, self._merge(entries, late))
+        return records[0][1] if records else None
+
+    async def after(self, chat_id: int, after_id: int, limit: int) -> list[dict]:
+        """Сообщения с ID > after_id (не более limit самых новых) - диапазон от курсора."""
+        entries = await self.rb.xrevrange(self.key(chat_id), '+', f"({after_id}-0", count=limit)
+        late = await self.rb.zrevrangebyscore(self.late_key(chat_id), '+inf', f"({after_id}", start=0, num=limit, withscores=True)
+        records = self._merge(entries, late, reverse=True)[:limit]
+        records.reverse()
+        return decode_messages([raw for _, raw in await self._apply_edits(chat_id, records)])
+
+    async def replace(self, chat_id: int, message_data: dict) -> bool:
+        """Сохраняет правку, если сообщение есть в потоке (или среди опоздавших)."""
+        entry_id = f"{message_data['id']}-0"
+        result = await self.rb.eval(_STREAM_REPLACE_LUA, 3, self.key(chat_id), self.edits_key(chat_id), self.late_key(chat_id),
+                                    entry_id, message_data['id'], encode_message(message_data))
+        return bool(result)
+
+    async def delete(self, chat_id: int, message_id: int) -> bool:
+        async with self.rb.pipeline() as pipe:
+            pipe.xdel(self.key(chat_id), f"{message_id}-0")
+            pipe.zremrangebyscore(self.late_key(chat_id), message_id, message_id)
+            pipe.hdel(self.edits_key(chat_id), message_id)
+            deleted, deleted_late, _ = await pipe.execute()
+        return bool(deleted or deleted_late)
+
+    async def count(self, chat_id) -> int:
+        return await self.rb.xlen(self.key(chat_id)) + await self.rb.zcard(self.late_key(chat_id))
+
+    async def oldest(self, chat_id, count: int) -> list[tuple[int, bytes]]:
+        if count <= 0:
+            return []
+        entries = await self.rb.xrange(self.key(chat_id), count=count)
+        late = await self.rb.zrange(self.late_key(chat_id), 0, count - 1, withscores=True)
+        return await self._apply_edits(chat_id, self._merge(entries, late)[:count])
+
+    async def remove_upto(self, chat_id, last_id: int):
+        async with self.rb.pipeline() as pipe:
+            pipe.xtrim(self.key(chat_id), minid=f"{last_id + 1}-0", approximate=False)
+            pipe.zremrangebyscore(self.late_key(chat_id), '-inf', last_id)
+            # Правки выгруженных сообщений уже попали в архив
+            pipe.eval("""
+for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if tonumber(field) <= tonumber(ARGV[1]) then redis.call('HDEL', KEYS[1], field) end
+end
+return 0""", 1, self.edits_key(chat_id), last_id)
+            await pipe.execute()
+
+    async def write_all(self, chat_id, records: list[tuple[int, bytes]]):
+        """Записывает готовые записи (для миграции); ID не новее потока - в history_late."""
+        async with self.rb.pipeline() as pipe:
+            for msg_id, raw in sorted(records):
+                pipe.eval(_STREAM_ADD_LUA, 2, self.key(chat_id), self.late_key(chat_id), msg_id, raw, 0)
+            await pipe.execute()
+
+
+BACKENDS = {store.name: store for store in (ZSetHistoryStore, StreamHistoryStore)}
+
+
+def create(backend: str, rb) -> _HistoryStore:
+    """Создаёт хранилище истории по имени бэкенда (zset или stream)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд истории: {backend}. Доступны: {', '.join(BACKENDS)}")
+    return BACKENDS[backend](rb)
+
+
+async def migrate_backend(source: _HistoryStore, target: _HistoryStore) -> int:
+    """
+    Переносит истории всех чатов из одного бэкенда в другой (правки уже применены)
+    и удаляет исходные ключи. Возвращает число перенесённых чатов.
+    """
+    migrated = 0
+    chat_ids = [chat_id async for chat_id in source.chat_ids()]
+    for chat_id in chat_ids:
+        records = await source.oldest(chat_id, await source.count(chat_id))
+        # Бот мог успеть дописать что-то в целевой бэкенд - не дублируем
+        existing = {msg_id for msg_id, _ in await target.oldest(chat_id, await target.count(chat_id))}
+        records = [rec for rec in records if rec[0] not in existing]
+        if records:
+            await target.write_all(chat_id, records)
+        await source.rb.delete(source.key(chat_id))
+        if isinstance(source, StreamHistoryStore):
+            await source.rb.delete(source.edits_key(chat_id), source.late_key(chat_id))
+        migrated += 1
+        logging.info(f"История чата {chat_id}: {source.name} -> {target.name}, {len(records)} сообщений.")
+    return migrated
+
+
+async def migrate_lists(rb) -> int:
+    """
+    Разовая миграция: переводит истории, сохранённые старыми версиями бота
+    в виде LIST (новые - слева), в sorted set. Заодно перекодирует JSON-записи.
+    Возвращает число сконвертированных чатов.
+    """
+    migrated = 0
+    async for key in rb.scan_iter("chat:*:history"):
+        if await rb.type(key) != b'list':
+            continue
+        mapping = {}
+        for msg in decode_messages(await rb.lrange(key, 0, -1)):
+            mapping[encode_message(msg)] = msg['id']
+        tmp_key = key + b":migrate"
+        async with rb.pipeline(transaction=True) as pipe:
+            pipe.delete(tmp_key)
+            if mapping:
+                pipe.zadd(tmp_key, mapping)
+                pipe.rename(tmp_key, key)
+            else:
+                pipe.delete(key)
+            await pipe.execute()
+        migrated += 1
+        logging.info(f"История {key.decode()} переведена в sorted set ({len(mapping)} сообщений).")
+    return migrated
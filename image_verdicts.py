@@ -0,0 +1,120 @@
+"""Картинки проверки новичков: уменьшение перед AI и кеш вердиктов.
+
+prepare() уменьшает фото до MAX_SIDE по большей стороне и пережимает в JPEG:
+картинка до 384 px обходится Gemini в минимум токенов, а JPEG легче PNG,
+в который SDK кодирует объект PIL. Там же считается перцептивный хеш (pHash).
+
+Спам-боты присылают одни и те же картинки, поэтому вердикт True/False
+запоминается по хешу: повтор (в том числе пережатый или уменьшенный, до
+MAX_DISTANCE различающихся бит) решается без AI.
+
+Похожие хеши ищутся не перебором всего кеша: 64 бита делятся на
+MAX_DISTANCE + 1 полос, и у хешей, различающихся не больше чем на
+MAX_DISTANCE бит, хотя бы одна полоса совпадает. Поэтому кандидаты - только
+хеши из тех же корзин полос, что и у новой картинки.
+
+verify_img:verdicts - хеш pHash -> "1"/"0" (TTL на поле через HEXPIRE, Redis 7.4+),
+verify_img:verdicts:order - sorted set pHash -> время записи (для вытеснения),
+verify_img:band:{полоса}:{значение} - set pHash с таким значением полосы,
+verify_img:stats - счётчики hits (точное совпадение), near_hits, misses.
+"""
+
+import time
+from io import BytesIO
+
+import imagehash
+from PIL import Image
+
+MAX_SIDE = 384
+JPEG_QUALITY = 85
+MAX_DISTANCE = 4  # бит из 64, при которых картинка считается той же
+CACHE_TTL = 30 * 86400
+CACHE_MAX_ENTRIES = 5000
+VERDICTS_KEY = "verify_img:verdicts"
+ORDER_KEY = VERDICTS_KEY + ":order"
+BAND_KEY = "verify_img:band"
+STATS_KEY = "verify_img:stats"
+BANDS = MAX_DISTANCE + 1
+BAND_BITS = [64 // BANDS + (1 if i < 64 % BANDS else 0) for i in range(BANDS)]
+
+# Удаление устаревших (время записи до ARGV[2]) и самых старых записей сверх лимита.
+# Возвращает удалённые pHash - их нужно убрать из корзин полос
+_EVICT_LUA = """
+local evicted = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+local extra = redis.call('ZCARD', KEYS[2]) - #evicted - tonumber(ARGV[1])
+if extra > 0 then
+    for _, phash in ipairs(redis.call('ZRANGE', KEYS[2], #evicted, #evicted + extra - 1)) do
+        table.insert(evicted, phash)
+    end
+end
+for i = 1, #evicted, 500 do
+    local batch = {unpack(evicted, i, math.min(i + 499, #evicted))}
+    redis.call('HDEL', KEYS[1], unpack(batch))
+    redis.call('ZREM', KEYS[2], unpack(batch))
+end
+return evicted
+"""
+
+
+def prepare(image_bytes: bytes) -> tuple[bytes, str]:
+    """(JPEG не больше MAX_SIDE по большей стороне, pHash в hex)."""
+    with Image.open(BytesIO(image_bytes)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((MAX_SIDE, MAX_SIDE))
+        out = BytesIO()
+        image.save(out, format="JPEG", quality=JPEG_QUALITY)
+        return out.getvalue(), str(imagehash.phash(image))
+
+
+def _band_keys(phash: str) -> list[str]:
+    value, keys = int(phash, 16), []
+    for band, bits in enumerate(BAND_BITS):
+        keys.append(f"{BAND_KEY}:{band}:{value & ((1 << bits) - 1):x}")
+        value >>= bits
+    return keys
+
+
+def _distance(hash1: str, hash2: str) -> int:
+    return (int(hash1, 16) ^ int(hash2, 16)).bit_count()
+
+
+async def get(r, phash: str) -> bool | None:
+    """Вердикт для картинки (или похожей) или None. Считает попадания и промахи."""
+    value = await r.hget(VERDICTS_KEY, phash)
+    field = "hits"
+    if value is None:
+        field = "misses"
+        best = MAX_DISTANCE + 1
+        candidates = list(await r.sunion(_band_keys(phash)))
+        verdicts = await r.hmget(VERDICTS_KEY, candidates) if candidates else []
+        for known, verdict in zip(candidates, verdicts):
+            distance = _distance(phash, known)
+            if verdict is not None and distance < best:  # None - поле уже истекло
+                best, value, field = distance, verdict, "near_hits"
+    await r.hincrby(STATS_KEY, field)
+    return None if value is None else value == "1"
+
+
+async def put(r, phash: str, verdict: bool):
+    now = time.time()
+    async with r.pipeline() as pipe:
+        pipe.hset(VERDICTS_KEY, phash, "1" if verdict else "0")
+        pipe.hexpire(VERDICTS_KEY, CACHE_TTL, phash)
+        pipe.zadd(ORDER_KEY, {phash: now})
+        for key in _band_keys(phash):
+            pipe.sadd(key, phash)
+            pipe.expire(key, CACHE_TTL)
+        pipe.eval(_EVICT_LUA, 2, VERDICTS_KEY, ORDER_KEY, CACHE_MAX_ENTRIES, now - CACHE_TTL)
+        evicted = (await pipe.execute())[-1]
+    if evicted:
+        async with r.pipeline(transaction=False) as pipe:
+            for old in evicted:
+                for key in _band_keys(old):
+                    pipe.srem(key, old)
+            await pipe.execute()
+
+
+async def stats(r) -> tuple[int, int, int]:
+    """(точные попадания, похожие, промахи)."""
+    values = await r.hmget(STATS_KEY, ["hits", "near_hits", "misses"])
+    return tuple(int(value or 0) for value in values)
@@ -0,0 +1,130 @@
+"""Заготовленные фразы о бане, чтобы не ждать AI на каждом кике.
+
+kick_pool:{контекст}:{род} - список шаблонов в Redis (общий для процессов бота).
+Контекст - bot (выгнал бот на проверке) или admin (выгнал администратор),
+род - m/f того, кто выгнал. В шаблоне {KTO} - кто выгнал, {KOGO} - кого;
+имена стоят в именительном падеже, поэтому подставляются без склонения.
+
+Шаблоны хранятся обычным текстом, экранирование MarkdownV2 - при подстановке.
+take() забирает шаблон (фразы не повторяются), пополняет пул refill() - в фоне
+по расписанию и когда шаблонов остаётся меньше LOW_WATERMARK. Сами фразы
+генерирует переданная функция generate(context, gender, count, chat_id) -> list[str];
+chat_id - чат, кик в котором запустил пополнение (для учёта запросов к AI), у
+пополнения по расписанию - None.
+"""
+
+import asyncio
+import logging
+import re
+import uuid
+
+CONTEXTS = ("bot", "admin")
+GENDERS = ("m", "f")
+POOL_SIZE = 20  # шаблонов на вариант после пополнения
+LOW_WATERMARK = 5  # меньше - пополнение в фоне сразу после take()
+REFILL_LOCK_KEY = "kick_pool:refill"
+REFILL_LOCK_SECONDS = 600  # дольше полного пополнения: 4 варианта по таймауту AI (90 с) и запас
+MAX_TEMPLATE_LENGTH = 250
+
+# Снимает блокировку, только если она всё ещё наша (могла истечь и достаться другому процессу)
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Имена на -а/-я, которые всё же мужские
+MALE_NAMES = {"никита", "илья", "кузьма", "фома", "лука", "савва", "саша", "миша", "гриша", "паша", "дима",
+              "вова", "витя", "женя", "лёша", "леша", "серёжа", "сережа", "коля", "толя", "петя", "ваня", "костя",
+              "nikita", "ilya", "sasha", "misha", "dima", "kostya", "vanya", "zhenya", "luca", "joshua", "andrea"}
+
+_MD_SPECIAL = re.compile(r"([_*\[\]()~`>#+\-=|{}.!\\])")
+_PLACEHOLDERS = re.compile(r"(\{KTO\}|\{KOGO\})")
+_LIST_MARKER = re.compile(r"^\s*(?:[-•*]|\d+[.)])\s*")
+
+
+def pool_key(context: str, gender: str) -> str:
+    return f"kick_pool:{context}:{gender}"
+
+
+def guess_gender(name: str) -> str:
+    """'f', если первое слово имени похоже на женское имя (на -а/-я), иначе 'm' (по умолчанию)."""
+    words = re.findall(r"[^\W\d_]+", name.lower())
+    if not words:
+        return "m"
+    first = words[0]
+    return "f" if first.endswith(("а", "я", "a")) and first not in MALE_NAMES and len(first) > 2 else "m"
+
+
+def parse_templates(text: str) -> list[str]:
+    """Шаблоны из ответа AI (по одному на строку). Строки без обоих плейсхолдеров отбрасываются."""
+    templates = []
+    for line in (text or "").splitlines():
+        line = _LIST_MARKER.sub("", line).strip().strip('"«»')
+        if line.count("{KTO}") == 1 and line.count("{KOGO}") == 1 and len(line) <= MAX_TEMPLATE_LENGTH:
+            templates.append(line)
+    return templates
+
+
+def render(template: str, kto: str, kogo: str) -> str:
+    """Текст для MarkdownV2: шаблон экранируется, kto и kogo (готовые ссылки) подставляются как есть."""
+    values = {"{KTO}": kto, "{KOGO}": kogo}
+    return "".join(values.get(part) or _MD_SPECIAL.sub(r"\\\1", part) for part in _PLACEHOLDERS.split(template))
+
+
+class KickPool:
+    def __init__(self, r, generate):
+        self.r = r
+        self.generate = generate
+        self._refill_task: asyncio.Task | None = None
+
+        self.hits = 0  # бан взял готовую фразу
+        self.misses = 0  # пул пуст - живой запрос к AI
+
+    async def take(self, context: str, gender: str, chat_id: int | None = None) -> str | None:
+        """Шаблон для варианта или None, если пул пуст. При нехватке запускает пополнение в фоне."""
+        key = pool_key(context, gender)
+        template = await self.r.lpop(key)
+        if template:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if not template or await self.r.llen(key) < LOW_WATERMARK:
+            self.refill_soon(chat_id)
+        return template
+
+    def refill_soon(self, chat_id: int | None = None):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self.refill(chat_id))
+
+    async def refill(self, chat_id: int | None = None) -> int:
+        """Дополняет варианты до POOL_SIZE. Одновременно пополняет только один процесс. Возвращает число новых шаблонов."""
+        token = uuid.uuid4().hex
+        if not await self.r.set(REFILL_LOCK_KEY, token, ex=REFILL_LOCK_SECONDS, nx=True):
+            return 0
+        added = 0
+        try:
+            for context in CONTEXTS:
+                for gender in GENDERS:
+                    key = pool_key(context, gender)
+                    missing = POOL_SIZE - await self.r.llen(key)
+                    if missing <= 0:
+                        continue
+                    try:
+                        templates = await self.generate(context, gender, missing, chat_id)
+                    except Exception as e:
+                        logging.error(f"Пул фраз о бане: не удалось сгенерировать {key}: {e}")
+                        continue
+                    if templates:
+                        await self.r.rpush(key, *templates[:missing])
+                        added += len(templates[:missing])
+        finally:
+            await self.r.eval(_RELEASE_LUA, 1, REFILL_LOCK_KEY, token)
+        if added:
+            logging.info(f"Пул фраз о бане пополнен на {added}")
+        return added
+
+    async def sizes(self) -> dict[str, int]:
+        return {f"{context}:{gender}": await self.r.llen(pool_key(context, gender))
+                for context in CONTEXTS for gender in GENDERS}
@@ -0,0 +1,151 @@
+"""Бэкенды AI для бота и sum_only.py: Gemini, RapidAPI и локальная заглушка.
+
+У всех один интерфейс:
+    await backend.generate(model, contents, config=None) -> ответ с .text, .usage_metadata, .prompt_feedback
+    async for chunk in backend.stream(model, contents, config=None): chunk.text
+config - gtypes.GenerateContentConfig (как у Gemini). Бэкенды без поддержки
+берут из него только system_instruction. Ошибки HTTP-бэкендов - LLMBackendError
+с .code (статус), чтобы llm_scheduler узнавал 429.
+
+Заглушка (llm_stub_server.py) отвечает заготовками с настраиваемой задержкой
+и долей ошибок - весь путь /sum можно нагружать без ключа и сети.
+"""
+
+import json
+import logging
+from types import SimpleNamespace
+
+import aiohttp
+
+BACKENDS = ("gemini", "rapidapi", "stub")
+RAPIDAPI_URL = "https://chatgpt-42.p.rapidapi.com/gpt4o"  # gpt4 gpt4o deepseekai
+STUB_URL = "http://127.0.0.1:8765"
+HTTP_TIMEOUT = 600  # секунд на ответ HTTP-бэкенда
+
+
+class LLMBackendError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _usage(prompt_tokens: int = 0, output_tokens: int = 0):
+    """usage_metadata в духе Gemini для бэкендов, которые его не дают."""
+    return SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                           thoughts_token_count=0, cached_content_token_count=0)
+
+
+def _split_request(contents, config) -> tuple[str, str]:
+    """(системная инструкция, текст запроса) из параметров в формате Gemini. Картинки -> [image]."""
+    system = getattr(config, "system_instruction", None) or ""
+    parts = contents if isinstance(contents, list) else [contents]
+    return str(system), "\n".join(part if isinstance(part, str) else "[image]" for part in parts)
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, client):
+        self.client = client  # genai.Client, нужен и для кеша промптов (PromptCache)
+
+    async def generate(self, model: str, contents, config=None):
+        return await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+    async def stream(self, model: str, contents, config=None):
+        async for chunk in await self.client.aio.models.generate_content_stream(model=model, contents=contents, config=config):
+            yield chunk
+
+
+class _HTTPBackend:
+    client = None  # Кеш промптов Gemini недоступен
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+        return self._session
+
+    async def stream(self, model: str, contents, config=None):
+        # Без потоковой выдачи - одним куском
+        yield await self.generate(model, contents, config)
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+
+class RapidAPIBackend(_HTTPBackend):
+    name = "rapidapi"
+
+    def __init__(self, api_key: str, url: str = RAPIDAPI_URL):
+        super().__init__()
+        self.api_key = api_key
+        self.url = url
+
+    async def generate(self, model: str, contents, config=None):
+        system, text = _split_request(contents, config)
+        headers = {
+            "Content-Type": "application/json",
+            "X-RapidAPI-Key": self.api_key,
+            "X-RapidAPI-Host": self.url.split("/")[2],
+        }
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": text}]
+        async with self.session().post(self.url, headers=headers, json={"messages": messages, "web_access": False}) as response:
+            if response.status != 200:
+                raise LLMBackendError(response.status, await response.text())
+            data = await response.json()
+            return SimpleNamespace(text=data.get("result"), usage_metadata=_usage(), prompt_feedback=None,
+                                   headers=dict(response.headers))
+
+
+class StubBackend(_HTTPBackend):
+    name = "stub"
+
+    def __init__(self, url: str = STUB_URL):
+        super().__init__()
+        self.url = url.rstrip("/")
+
+    async def _post(self, model: str, contents, config, stream: bool):
+        system, text = _split_request(contents, config)
+        payload = {"model": model, "system": system, "contents": text, "stream": stream}
+        response = await self.session().post(f"{self.url}/generate", json=payload)
+        if response.status != 200:
+            body = await response.text()
+            response.release()
+            raise LLMBackendError(response.status, body)
+        return response
+
+    async def generate(self, model: str, contents, config=None):
+        response = await self._post(model, contents, config, False)
+        async with response:
+            data = await response.json()
+        usage = data.get("usage", {})
+        return SimpleNamespace(text=data["text"], prompt_feedback=None,
+                               usage_metadata=_usage(usage.get("prompt_tokens", 0), usage.get("output_tokens", 0)))
+
+    async def stream(self, model: str, contents, config=None):
+        response = await self._post(model, contents, config, True)
+        async with response:
+            async for line in response.content:  # NDJSON: по куску на строку
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise LLMBackendError(data.get("code", 500), data["error"])
+                usage = data.get("usage")
+                yield SimpleNamespace(text=data.get("text", ""), prompt_feedback=None,
+                                      usage_metadata=_usage(usage["prompt_tokens"], usage["output_tokens"]) if usage else None)
+
+
+def create(name: str, gemini_client=None, rapidapi_key: str | None = None, stub_url: str = STUB_URL):
+    """Бэкенд по имени из BACKENDS."""
+    if name == "gemini":
+        return GeminiBackend(gemini_client)
+    if name == "rapidapi":
+        return RapidAPIBackend(rapidapi_key)
+    if name == "stub":
+        logging.warning(f"AI-бэкенд: заглушка {stub_url}")
+        return StubBackend(stub_url)
+    raise ValueError(f"Неизвестный AI-бэкенд {name!r}, доступны: {', '.join(BACKENDS)}")
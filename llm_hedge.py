@@ -0,0 +1,105 @@
+"""Дедлайны и дублирующие (hedged) запросы к AI.
+
+Hedger.run(site, call, deadline) вызывает call(model) для основной модели и
+ждёт ответа не дольше deadline секунд (потом asyncio.TimeoutError - /sum не
+висит минутами с блокировкой чата). Если задана запасная модель, а основная
+отвечает дольше своего p95 для этого места вызова (или упала), тот же запрос
+уходит запасной модели; берётся первый успешный ответ, второй запрос
+отменяется.
+
+p95 считается по последним WINDOW ответам для пары (место вызова, модель).
+Пока ответов меньше MIN_SAMPLES, дублирование начинается после
+COLD_START_FRACTION дедлайна. Отменённый медленный запрос тоже попадает
+в окно (как нижняя оценка времени), иначе p95 занижался бы.
+"""
+
+import asyncio
+import logging
+from collections import Counter, defaultdict, deque
+
+WINDOW = 200
+MIN_SAMPLES = 20
+COLD_START_FRACTION = 0.5
+
+
+def _percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class Hedger:
+    def __init__(self, primary: str, fallback: str | None = None):
+        self.primary = primary
+        self.fallback = fallback  # None - только дедлайны, без дублирования
+        self._latency: dict[tuple, deque] = defaultdict(lambda: deque(maxlen=WINDOW))  # (site, model) -> секунды
+
+        # Статистика: по месту вызова и по (месту, модели)
+        self.calls = Counter()
+        self.hedged = Counter()
+        self.timeouts = Counter()
+        self.wins = Counter()
+
+    def p95(self, site: str, model: str) -> float | None:
+        samples = self._latency[(site, model)]
+        return _percentile(samples, 0.95) if len(samples) >= MIN_SAMPLES else None
+
+    async def run(self, site: str, call, deadline: float):
+        """Результат call(model) от основной или запасной модели, не дольше deadline секунд."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.calls[site] += 1
+        models, starts = {}, {}
+
+        def launch(model: str):
+            task = asyncio.create_task(call(model))
+            models[task], starts[task] = model, loop.time()
+            return task
+
+        pending = {launch(self.primary)}
+        hedge_at = None
+        if self.fallback:
+            hedge_at = started + (self.p95(site, self.primary) or deadline * COLD_START_FRACTION)
+        last_error = None
+        try:
+            while True:
+                wake = started + deadline if hedge_at is None else min(hedge_at, started + deadline)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, wake - loop.time()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        model = models[task]
+                        self._latency[(site, model)].append(loop.time() - starts[task])
+                        self.wins[(site, model)] += 1
+                        return task.result()
+                    last_error = task.exception()
+                    logging.warning(f"AI {site}: ошибка {models[task]}: {last_error}")
+
+                if loop.time() >= started + deadline:
+                    self.timeouts[site] += 1
+                    raise asyncio.TimeoutError(f"AI {site}: нет ответа за {deadline:g} с")
+                if hedge_at is not None and (loop.time() >= hedge_at or not pending):
+                    # Основная модель медлит или упала - дублируем запрос запасной
+                    logging.info(f"AI {site}: {self.primary} дольше {loop.time() - started:.1f} с, запрос к {self.fallback}")
+                    self.hedged[site] += 1
+                    pending.add(launch(self.fallback))
+                    hedge_at = None
+                elif not pending:
+                    raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+                if models[task] == self.primary:
+                    self._latency[(site, self.primary)].append(loop.time() - starts[task])
+
+    def stats(self) -> str:
+        """Строки для /run_info: по местам вызова - дублирование, таймауты, победы и p50/p95 моделей."""
+        lines = []
+        for site, calls in sorted(self.calls.items()):
+            parts = [f"{site}: {calls} запр., дубль {self.hedged[site]}, таймаут {self.timeouts[site]}"]
+            for model in filter(None, (self.primary, self.fallback)):
+                samples = self._latency[(site, model)]
+                if samples:
+                    parts.append(f"{model} побед {self.wins[(site, model)]}, p50 {_percentile(samples, 0.5):.1f} с, "
+                                 f"p95 {_percentile(samples, 0.95):.1f} с")
+            lines.append("; ".join(parts))
+        return "\n".join(lines)
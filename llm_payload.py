@@ -0,0 +1,49 @@
+"""Компактное представление истории чата для запросов к AI.
+
+Вместо JSON с ключами id/reply_to/user_name/full_name/text на каждое сообщение
+(и \\uXXXX вместо кириллицы) - легенда участников один раз и по строке
+на сообщение:
+
+    Участники:
+    u1=Павел @karamba666
+    u2=Valery Gordienko
+    Сообщения (id|ответ на|автор|текст):
+    455000||u2|Это не одиночный, здесь предохранитель есть.
+    455001|454999|u1|В заднем кармане 🌚
+
+Переносы строк в тексте заменяются на " / ", длинные пересылки обрезаются.
+"""
+
+FORWARD_PREFIX = "Переслано от "
+FORWARD_MAX_CHARS = 300  # пересланные посты длиннее этого обрезаются
+LINE_FORMAT_HINT = "id|ответ на|автор|текст"
+
+
+def _flat(text: str) -> str:
+    return " / ".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def build_payload(messages: list[dict]) -> str:
+    """Строит компактный текст для AI из записей истории (с user_name/full_name)."""
+    aliases: dict[tuple, str] = {}
+    legend, lines = [], []
+    for msg in messages:
+        author = (msg.get('full_name'), msg.get('user_name'))
+        alias = aliases.get(author)
+        if alias is None:
+            alias = aliases[author] = f"u{len(aliases) + 1}"
+            full_name, user_name = author
+            legend.append(f"{alias}={full_name}" + (f" @{user_name}" if user_name and user_name != "None" else ""))
+
+        text = msg.get('text', '')
+        if text.startswith(FORWARD_PREFIX) and len(text) > FORWARD_MAX_CHARS:
+            text = text[:FORWARD_MAX_CHARS].rstrip() + "…"
+        lines.append(f"{msg['id']}|{msg.get('reply_to', '')}|{alias}|{_flat(text)}")
+
+    return "Участники:\n" + "\n".join(legend) + f"\nСообщения ({LINE_FORMAT_HINT}):\n" + "\n".join(lines)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка: ASCII ~4 символа на токен, остальное (кириллица, эмодзи) ~2.5."""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return int((len(text) - non_ascii) / 4 + non_ascii / 2.5)
@@ -0,0 +1,124 @@
+"""Общий планировщик запросов к AI: лимит одновременных вызовов, приоритеты, очередь по чатам.
+
+Все вызовы Gemini в процессе идут через LLMScheduler.run. Одновременно
+выполняется не больше max_concurrency запросов, остальные ждут в очереди:
+сначала более важный класс (проверка новичков > сообщения о бане > сводки >
+анекдоты), внутри класса чаты по кругу, чтобы один чат с map-reduce на
+десяток кусков не задерживал остальных.
+
+На 429 / RESOURCE_EXHAUSTED запросы в процессе приостанавливаются
+с экспоненциально растущей паузой, и вызов повторяется. Лимит действует
+на процесс: у отдельных sum_worker.py свои планировщики.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+
+# Классы приоритета, меньше - важнее
+VERIFICATION = 0
+KICK = 1
+SUMMARY = 2
+JOKE = 3
+PRIORITY_NAMES = {VERIFICATION: "verification", KICK: "kick", SUMMARY: "summary", JOKE: "joke"}
+
+MAX_RETRIES = 3  # повторов после 429
+BACKOFF_BASE = 2.0  # секунд паузы после первого 429, дальше удваивается
+BACKOFF_MAX = 60.0
+
+
+def is_rate_limited(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    return code == 429 or "429" in str(error) or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        # priority -> chat_id -> ожидающие (future)
+        self._queues: dict[int, OrderedDict] = {p: OrderedDict() for p in PRIORITY_NAMES}
+        self._paused_until = 0.0
+        self._backoff = 0.0
+
+        # Статистика: по классам - запросов, суммарное и максимальное ожидание (с)
+        self.calls = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_total = {p: 0.0 for p in PRIORITY_NAMES}
+        self.wait_max = {p: 0.0 for p in PRIORITY_NAMES}
+        self.rate_limited = 0
+
+    async def run(self, priority: int, chat_id, factory, label: str = ""):
+        """Выполняет factory() (корутину запроса к AI) в порядке очереди, с повтором на 429."""
+        for attempt in range(MAX_RETRIES + 1):
+            await self._acquire(priority, chat_id)
+            try:
+                delay = self._paused_until - time.monotonic()
+                if delay > 0:  # Пауза после 429 - держим слот, чтобы не пускать остальных
+                    await asyncio.sleep(delay)
+                result = await factory()
+                self._backoff = 0.0
+                return result
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == MAX_RETRIES:
+                    raise
+                self.rate_limited += 1
+                self._backoff = min(BACKOFF_MAX, self._backoff * 2 or BACKOFF_BASE)
+                self._paused_until = max(self._paused_until, time.monotonic() + self._backoff * random.uniform(1, 1.5))
+                logging.warning(f"AI: лимит запросов ({label or PRIORITY_NAMES[priority]}), пауза {self._backoff:.0f} с, попытка {attempt + 1}")
+            finally:
+                self._release()
+
+    async def _acquire(self, priority: int, chat_id):
+        started = time.monotonic()
+        if self.active < self.max_concurrency and not self.waiting():
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._queues[priority].setdefault(chat_id, deque()).append(future)
+            try:
+                await future  # слот передаёт _release
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()  # Слот уже выдан - возвращаем
+                else:
+                    self._forget(priority, chat_id, future)
+                raise
+        waited = time.monotonic() - started
+        self.calls[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    def _release(self):
+        for chats in self._queues.values():
+            while chats:
+                chat_id, waiters = chats.popitem(last=False)
+                future = waiters.popleft()
+                if waiters:
+                    chats[chat_id] = waiters  # Чат - в конец круга
+                if not future.done():
+                    future.set_result(None)  # Слот переходит к ожидающему, active не меняется
+                    return
+        self.active -= 1
+
+    def _forget(self, priority: int, chat_id, future):
+        waiters = self._queues[priority].get(chat_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._queues[priority][chat_id]
+
+    def waiting(self, priority: int | None = None) -> int:
+        """Сколько запросов ждёт в очереди (всего или в классе)."""
+        queues = [self._queues[priority]] if priority is not None else self._queues.values()
+        return sum(len(waiters) for chats in queues for waiters in chats.values())
+
+    def stats(self) -> str:
+        """Строка для /run_info: очередь и ожидание по классам."""
+        lines = [f"AI: выполняется {self.active}/{self.max_concurrency}, в очереди {self.waiting()}, 429: {self.rate_limited}"]
+        for priority, name in PRIORITY_NAMES.items():
+            calls = self.calls[priority]
+            if calls:
+                lines.append(f"{name}: {calls} запр., ожидание ср. {self.wait_total[priority] / calls:.1f} с, макс. {self.wait_max[priority]:.1f} с")
+        return "\n".join(lines)
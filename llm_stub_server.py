@@ -0,0 +1,93 @@
+#-------------------------------------------------------------------------------
+# Локальная заглушка AI для нагрузочных прогонов без ключа и сети (LLM_BACKEND=stub)
+# Запуск: python llm_stub_server.py [--port 8765] [--latency-ms 3000] [--jitter-ms 1000]
+#                                   [--error-rate 0.1] [--error-status 429]
+#                                   [--length 2500] [--chunks 10]
+# Отвечает заготовками: на сводки - текст со ссылками на id из запроса, на проверку
+# картинки - True, на остальное - короткая фраза. Задержка и доля ошибок настраиваются.
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import random
+import re
+
+from aiohttp import web
+
+FILLER = "Участники живо обсуждали планы, шутили и делились новостями района. "
+
+
+def canned_text(system: str, contents: str, length: int) -> str:
+    if "[image]" in contents:  # проверка картинки новичка
+        return "True"
+    ids = re.findall(r"^(\d+)\|", contents, flags=re.MULTILINE)
+    if not ids:
+        return "Заглушка AI: короткий ответ 🙂"
+    link = re.search(r"(t\.me/\S+?/)(?:\s|$|id)", contents + " " + system)
+    base = link.group(1) if link else "t.me/c/0/"
+    rnd = random.Random(len(ids))
+    lines = ["**Сводка от заглушки** 🚲", ""]
+    for message_id in sorted(rnd.sample(ids, min(8, len(ids))), key=int):
+        lines.append(f"• Обсуждали [тему {message_id}]({base}{message_id}), {FILLER.lower()}")
+    text = "\n".join(lines)
+    while len(text) < length:
+        text += "\n" + FILLER
+    return text
+
+
+def make_app(args) -> web.Application:
+    stats = {"requests": 0, "errors": 0}
+
+    async def generate(request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        stats["requests"] += 1
+        delay = max(0.0, (args.latency_ms + random.uniform(-args.jitter_ms, args.jitter_ms)) / 1000)
+        if random.random() < args.error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(delay / 4)
+            return web.json_response({"error": "RESOURCE_EXHAUSTED (stub)"}, status=args.error_status)
+
+        text = canned_text(data.get("system", ""), data.get("contents", ""), args.length)
+        usage = {"prompt_tokens": (len(data.get("system", "")) + len(data.get("contents", ""))) // 3,
+                 "output_tokens": len(text) // 3}
+        if not data.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response({"text": text, "usage": usage})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        step = max(1, len(text) // args.chunks)
+        for start in range(0, len(text), step):
+            await asyncio.sleep(delay / args.chunks)
+            chunk = {"text": text[start:start + step]}
+            if start + step >= len(text):
+                chunk["usage"] = usage
+            await response.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/generate", generate)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Заглушка AI для LLM_BACKEND=stub")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=3000, help="время ответа")
+    parser.add_argument("--jitter-ms", type=float, default=1000, help="разброс времени ответа (+-)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов с ошибкой")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--length", type=int, default=2500, help="длина ответа на сводку, символов")
+    parser.add_argument("--chunks", type=int, default=10, help="кусков в потоковом ответе")
+    args = parser.parse_args()
+    web.run_app(make_app(args), host="127.0.0.1", port=args.port)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -26,8 +26,9 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode, ChatType
 from aiogram.types import ChatMemberAdministrator, ChatMemberOwner, ChatMemberRestricted, ChatMemberLeft, \
 	ChatMemberBanned, ChatMemberMember, ChatPermissions, ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton, \
-	Message, CallbackQuery, BufferedInputFile, BotCommand
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+	Message, CallbackQuery, BufferedInputFile, BotCommand, Chat, User
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, \
+	TelegramServerError
 
 import html  # Для экранирования HTML-символов в именах пользователей
 
@@ -38,6 +39,28 @@ import imagehash
 from google import genai
 from google.genai import types as gtypes
 
+import history_store
+import user_directory
+from write_buffer import WriteBuffer
+from history_archive import HistoryArchive
+from verification_cache import VerificationCache
+import summary_chunks
+import summary_cache
+import image_verdicts
+import ai_usage
+from llm_payload import build_payload, estimate_tokens
+import summary_budget
+import gemini_cache
+from gemini_cache import PromptCache
+from progressive_message import ProgressiveMessage
+import summary_queue
+import digest_schedule
+import kick_pool
+import llm_scheduler
+from llm_scheduler import LLMScheduler
+import llm_backend
+from llm_hedge import Hedger
+
 
 # Настройка логирования с таймзоной UTC+10
 class TzFormatter(logging.Formatter):
@@ -78,24 +101,71 @@ if ADMIN_ID_STR:
 GOOGLE_API_KEY = getenv("GOOGLE_API_KEY")
 GEMINI_MODEL = "gemini-2.5-flash" # Единая модель для всех запросов gemini-2.5-flash, "gemini-flash-latest"
 gclient = genai.Client(api_key=GOOGLE_API_KEY)
+LLM_BACKEND = getenv("LLM_BACKEND", "gemini")  # gemini, rapidapi или stub (llm_stub_server.py для прогонов без сети)
+llm = llm_backend.create(LLM_BACKEND, gemini_client=gclient, rapidapi_key=getenv("RAPIDAPI_KEY"),
+						 stub_url=getenv("LLM_STUB_URL", llm_backend.STUB_URL))
+LLM_CONCURRENCY = int(getenv("LLM_CONCURRENCY", 4))  # одновременных запросов к AI на процесс
+ai_scheduler = LLMScheduler(LLM_CONCURRENCY)  # Очередь запросов к AI с приоритетами
+AI_HEDGE_MODEL = getenv("AI_HEDGE_MODEL")  # Быстрая модель для дублирующих запросов (gemini-2.5-flash-lite), пусто - без них
+ai_hedger = Hedger(GEMINI_MODEL, AI_HEDGE_MODEL or None)
+# Дедлайн ответа AI по местам вызова, секунд (ожидание в очереди ai_scheduler не считается)
+AI_DEADLINES = {"summary": 240, "chunk": 120, "merge": 240, "shorten": 90,
+				"joke": 60, "kick": 30, "kick_pool": 90, "verification": 45}
 
 REDIS_HOST = getenv("REDIS_HOST", "127.0.0.1")
 REDIS_PORT = int(getenv("REDIS_PORT", 6379))
+MIN_REDIS_VERSION = (7, 4)  # HEXPIRE: TTL полей заявок /sum, кешей сводок и картинок проверки
 
 
 # Конфигурация лимитов
 LOCK_FOR_SUMMARIZE = set()
 
-MAX_HISTORY = 10000  # Всего сообщений истории
+MAX_HISTORY = 10000  # Всего сообщений истории в Redis
+# Архив на диске для сообщений старше MAX_HISTORY: папка в .env, по умолчанию выключен (старые сообщения теряются)
+HISTORY_ARCHIVE_DIR = getenv("HISTORY_ARCHIVE_DIR", "")
+HISTORY_SPILL_MINUTES = 5  # как часто выгружать лишнее из Redis в архив
+# Бэкенд истории в Redis: zset (sorted set) или stream (Redis Streams). Смена - через migrate_history.py
+HISTORY_BACKEND = getenv("HISTORY_BACKEND", "zset")
 MAX_TO_GPT = 2000  # Сообщений в гпт
 MIN_TO_GPT = 150
 MAX_SUM = 3900  # сивлолов для ответа суммар
+SUMMARY_OUTPUT_TOKENS = MAX_SUM * 2 // 3  # предел токенов текста ответа (сверх бюджета размышлений), ~2x от MAX_SUM
+SUMMARY_MAX_PARTS = 2  # длинная сводка - до стольких сообщений Telegram
+TRUNCATE_KEEP_RATIO = 0.8  # иначе обрезка по абзацам, если занято не меньше этой доли SUMMARY_MAX_PARTS сообщений, и только потом сокращение через AI
+# Бюджет размышлений и целевая длина сводки по оценке токенов окна, точки "токены:значение" (summary_budget)
+SUMMARY_THINKING_CURVE = summary_budget.parse_curve(getenv("SUMMARY_THINKING_CURVE", summary_budget.THINKING_CURVE))
+SUMMARY_LENGTH_CURVE = summary_budget.parse_curve(getenv("SUMMARY_LENGTH_CURVE", summary_budget.LENGTH_CURVE))
+SUMMARY_STREAMING = True  # сводка появляется по мере генерации (правками сообщения-заглушки)
+SUMMARY_PROMPT_VERSION = 3  # увеличить при изменении промптов сводки, чтобы не отдавать старое из кеша
 DEF_SUM_MES = 200  # дефолтно для суммаризации
+SUMMARY_WORKERS = int(getenv("SUMMARY_WORKERS", 1))  # воркеров очереди сводок в процессе бота (0 - только sum_worker.py)
 SEND_MES = 2  # число запросов в 24ч
 SEND_MES_GROUP = 5  # число запросов в 24ч
 
+# Фоновые конспекты фрагментов по summary_chunks.CHUNK_MESSAGES сообщений: /sum только объединяет готовое
+SUMMARY_CHUNKS = getenv("SUMMARY_CHUNKS", "0") == "1"  # 1 - включено (лишние запросы к AI в активных чатах)
+SUMMARY_CHUNKS_MINUTES = 2  # как часто проверять, набрался ли новый фрагмент
+SUMMARY_CHUNKS_PER_RUN = 3  # не больше стольких конспектов на чат за один проход
+CHUNK_THINKING_BUDGET = 2048  # бюджет размышлений на конспект фрагмента
+MERGE_THINKING_BUDGET = 4096  # бюджет размышлений на объединение конспектов
+
+# Map-reduce для больших /sum: куски конспектируются параллельно, затем один запрос объединяет
+MAP_REDUCE_MIN_MESSAGES = 600  # с какого числа сообщений (без готовых конспектов) включается
+MAP_CHUNK_TOKENS = 12000  # предел оценки токенов на один кусок
+MAP_CONCURRENCY = 4  # одновременных запросов к AI на этапе map
+
 BAYANDIFF = 3 # разница хешей картинок
 
+# Статистика /top_u по дням
+DAILY_STATS_KEEP_DAYS = 40  # дневные корзины старше этого сворачиваются в месяцы и удаляются
+STATS_RANGE_CACHE_SECONDS = 300  # сколько живёт посчитанный ZUNIONSTORE для диапазона
+STATS_RANGE_MAX_KEYS = 400  # предел числа корзин в одном диапазоне
+
+# Буфер отложенной записи сообщений (0 - выключен, каждое сообщение пишется сразу)
+WRITE_BUFFER_MS = int(getenv("WRITE_BUFFER_MS", 0))  # сколько мс копить сообщения
+WRITE_BUFFER_MAX = int(getenv("WRITE_BUFFER_MAX", 100))  # сброс досрочно при стольких сообщениях
+WRITE_BUFFER_CLOSE_TIMEOUT = 5  # секунд на финальный сброс при остановке
+
 # Конфигурация времени (единый стиль)
 TIME_TO_BAN_HOURS = 1  # Время блокировки в часах
 TIME_TO_BAN_SECONDS = 60 * 60 * TIME_TO_BAN_HOURS  # Время блокировки в секундах
@@ -103,7 +173,6 @@ NOTIFY_AFTER_MINUTES = 10  # Через сколько минут напомин
 NOTIFY_AFTER_SECONDS = NOTIFY_AFTER_MINUTES * 60
 CLEANUP_AFTER_MINUTES = 10  # Через сколько минут удалять сообщения проверки
 CLEANUP_AFTER_SECONDS = CLEANUP_AFTER_MINUTES * 60
-EDIT_SEARCH_DEPTH = 200 # Глубина поиска в истории для обновления отредактированных сообщений
 
 # --- КОНСТАНТЫ ---
 SECONDS_IN_DAY = 86400
@@ -112,6 +181,11 @@ ADMIN_CACHE_EXPIRY_SECONDS = 60
 TYPING_ACTION_INTERVAL_SECONDS = 4
 
 
+# С архивом история в Redis обрезается с запасом: излишек забирает фоновая выгрузка
+history_archive = HistoryArchive(HISTORY_ARCHIVE_DIR) if HISTORY_ARCHIVE_DIR else None
+HISTORY_TRIM_LIMIT = MAX_HISTORY * 2 if history_archive else MAX_HISTORY
+
+
 # Инициализация 
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
@@ -120,17 +194,45 @@ dp["started_at"] = datetime.now().strftime("%Y-%m-%d %H:%M")
 
 # Инициализация подключения к Redis
 r = None
+rb = None  # Бинарный клиент (без decode_responses) для чтения истории в компактном формате
+history = None  # Хранилище истории (history_store, бэкенд HISTORY_BACKEND)
+write_buffer = None  # WriteBuffer, если включен WRITE_BUFFER_MS
+verification_cache = None  # Кто сейчас на проверке (VerificationCache)
+summary_prompt_cache = None  # Кеш системного промпта сводки в Gemini (PromptCache)
+summary_jobs = None  # Очередь заданий /sum (SummaryQueue)
+kick_phrases = None  # Заготовленные фразы о бане (kick_pool.KickPool)
 async def init_redis():
-	global r
+	global r, rb, history, write_buffer, verification_cache, summary_prompt_cache, summary_jobs, kick_phrases
 	try:
 		r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)  # Изменено
+		rb = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
+		history = history_store.create(HISTORY_BACKEND, rb)
+		verification_cache = VerificationCache(r)
+		summary_prompt_cache = PromptCache(llm.client, GEMINI_MODEL, "summary", r)
+		summary_jobs = summary_queue.SummaryQueue(r, run_summary_job, summary_lock_key, SUMMARIZE_LOCK_EXPIRY_SECONDS,
+												  on_dead=summary_job_dead)
+		kick_phrases = kick_pool.KickPool(r, generate_kick_templates)
+		if WRITE_BUFFER_MS > 0:
+			write_buffer = WriteBuffer(r, history, HISTORY_TRIM_LIMIT, WRITE_BUFFER_MS, WRITE_BUFFER_MAX)
 		# Проверка соединения.
 		await r.ping()
 		logging.info("Connected to Redis successfully")
+		await check_redis_version()
 	except Exception as e:
 		logging.error(f"Failed to connect to Redis: {e}")
 		# Здесь можно предусмотреть повторные попытки подключения или другие действия
 
+async def check_redis_version():
+	"""Предупреждает, если Redis старше MIN_REDIS_VERSION: пайплайны с HEXPIRE там падают целиком."""
+	try:
+		version = (await r.info("server")).get("redis_version", "0")
+	except Exception as e: # INFO может быть запрещён (ACL, прокси)
+		logging.warning(f"Не удалось узнать версию Redis: {e}")
+		return
+	if tuple(int(part) for part in version.split(".")[:2]) < MIN_REDIS_VERSION:
+		logging.error(f"Redis {version} старше {'.'.join(map(str, MIN_REDIS_VERSION))}: нет HEXPIRE, "
+					  f"заявки на /sum, кеш сводок и кеш картинок проверки работать не будут.")
+
 async def get_admins(chat_id: int, force_refresh: bool = False) -> set:
 	"""
 	Возвращает множество ID администраторов чата.
@@ -191,7 +293,15 @@ async def start(message: Message):
 @dp.message(Command("run_info"))
 async def run_info(message: Message, started_at: str):
 	"""Обработчик команды /run_info для отображения времени запуска бота."""
-	await message.answer(f"Бот запущен {started_at}")
+	waiting, in_work = await summary_jobs.depth()
+	pool = ", ".join(f"{variant} {size}" for variant, size in (await kick_phrases.sizes()).items())
+	img_hits, img_near, img_misses = await image_verdicts.stats(r)
+	img_total = img_hits + img_near + img_misses
+	await message.answer(f"Бот запущен {started_at}\nОчередь сводок: ждут {waiting}, в работе {in_work}\n"
+						 f"Фразы о бане: {pool}; из пула {kick_phrases.hits}, живых запросов {kick_phrases.misses}\n"
+						 f"Кеш картинок проверки: {img_hits} точных + {img_near} похожих из {img_total}"
+						 f" ({(img_hits + img_near) / img_total if img_total else 0:.0%})\n"
+						 f"{ai_scheduler.stats()}\n{ai_hedger.stats()}")
 
 
 # тест комады 
@@ -221,6 +331,39 @@ async def debug_message(message: Message):
 	
 	await message.reply(f"✅ Информация о сообщении <code>{target_message.message_id}</code> выведена в лог консоли.")
 
+# Расход AI по местам вызова и чатам: /ai_stats [дней]
+@dp.message(Command("ai_stats"))
+async def ai_stats(message: Message, command: CommandObject):
+	"""Токены, ошибки и время ответа AI за последние дни (по умолчанию сегодня). Только для администратора."""
+	if message.from_user.id != ADMIN_ID:
+		await message.reply("Эта команда доступна только администратору.")
+		return
+	days = int(command.args) if command.args and command.args.strip().isdigit() else 1
+	days = max(1, min(days, ai_usage.KEEP_DAYS))
+	sites, chats = await ai_usage.summary(r, days)
+
+	lines = [f"<b>AI за {days} дн.</b> (токены: запрос / ответ / размышления)"]
+	for site, c in sorted(sites.items(), key=lambda item: -item[1]["calls"]):
+		lines.append(f"<b>{site}</b>: {c['calls']} запр., ошибок {c['errors']}, "
+					 f"{humanize_value_for_chars(c['prompt'])} / {humanize_value_for_chars(c['output'])} / {humanize_value_for_chars(c['thinking'])}, "
+					 f"p50 {c['p50']:.1f} с, p95 {c['p95']:.1f} с")
+	if not sites:
+		lines.append("Запросов не было.")
+	if chats:
+		lines.append("\n<b>Чаты</b> (топ по токенам):")
+		for chat_id, c in sorted(chats.items(), key=lambda item: -item[1]["tokens"])[:10]:
+			lines.append(f"<code>{chat_id}</code>: {c['calls']} запр., {humanize_value_for_chars(c['tokens'])} ток., "
+						 f"ср. {c['ms'] / c['calls'] / 1000:.1f} с")
+
+	sum_hits, sum_misses = await summary_cache.stats(r)
+	img_hits, img_near, img_misses = await image_verdicts.stats(r)
+	prompt_cache = {k: int(v) for k, v in (await r.hgetall(gemini_cache.STATS_KEY)).items()}
+	lines.append(f"\nКеш сводок: {sum_hits} попаданий, {sum_misses} промахов")
+	lines.append(f"Кеш промпта Gemini: {prompt_cache.get('cached_calls', 0)} запр. с кешем, "
+				 f"{prompt_cache.get('inline_calls', 0)} без, {humanize_value_for_chars(prompt_cache.get('cached_tokens', 0))} ток. из кеша")
+	lines.append(f"Кеш картинок проверки: {img_hits} точных, {img_near} похожих, {img_misses} промахов")
+	await message.answer("\n".join(lines))
+
 # Проверка прав
 @dp.message(Command("right"))
 async def get_perm(message: Message):
@@ -313,9 +456,10 @@ async def summarize(message: Message, command: CommandObject): # <-- Измен
 	req = 'on'
 	if req == 'on':
 		# --- УЛУЧШЕННАЯ БЛОКИРОВКА НА REDIS ---
-		lock_key = f"chat:{chat_id}:sum_lock"
+		lock_key = summary_lock_key(chat_id)
 		# Пытаемся установить блокировку на 5 минут. Если ключ уже есть, вернется False.
-		is_lock_acquired = await r.set(lock_key, 1, ex=300, nx=True)
+		# Снимает её воркер очереди после сводки (и продлевает, пока работает)
+		is_lock_acquired = await r.set(lock_key, 1, ex=SUMMARIZE_LOCK_EXPIRY_SECONDS, nx=True)
 		
 		if not is_lock_acquired:
 			await message.reply("Уже обрабатываю предыдущий запрос на сводку в этом чате. Пожалуйста, подождите.")
@@ -345,16 +489,19 @@ async def summarize(message: Message, command: CommandObject): # <-- Измен
 				num_messages = max(MIN_TO_GPT, min(num_messages, MAX_TO_GPT))
 			if len(numeric_params) >= 2:
 				offset = int(numeric_params[1])
-
-			# Передаем новый флаг в вашу основную функцию
-			await process_summarize(message, num_messages, offset, privat=is_private)
+			job = {"count": num_messages, "start": offset, "privat": is_private}
 
 		except ValueError:
 			await del_msg_delay(await message.answer(f"Некорректное число сообщений. Использую {DEF_SUM_MES}."))
-			await process_summarize(message, DEF_SUM_MES)
-		finally:
-			# Снимаем блокировку, только если мы ее установили
-			await r.delete(lock_key)
+			job = {"count": DEF_SUM_MES, "start": 0, "privat": False}
+
+		# Сводку делает воркер очереди (в этом или отдельном процессе), сообщение с командой - в задании
+		try:
+			await summary_queue.enqueue(r, chat_id, {"message": message.model_dump_json(exclude_none=True), **job})
+		except Exception as e:
+			logging.error(f"Не удалось поставить сводку в очередь: {e}")
+			await r.delete(lock_key) # Снимаем блокировку, задания нет
+			await message.reply("Не удалось запустить сводку. Попробуйте позже.")
 
 	elif req == 'off':
 		if not ADMIN_ID:
@@ -386,6 +533,93 @@ async def summarize(message: Message, command: CommandObject): # <-- Измен
 		await del_msg_delay(await message.answer(f"⚠️ @{user_nm} Ожидайте ответа по запросу {req}."))
 
 
+def summary_lock_key(chat_id: int) -> str:
+	return f"chat:{chat_id}:sum_lock"
+
+
+async def run_summary_job(job: dict):
+	"""Задание из очереди сводок: восстанавливаем сообщение с /sum и делаем сводку."""
+	if job.get("digest"):
+		message = await digest_message(job["chat_id"])
+	else:
+		message = Message.model_validate_json(job["message"]).as_(bot)
+	await process_summarize(message, job["count"], job["start"], privat=job["privat"], digest=job.get("digest", False))
+
+
+async def digest_message(chat_id: int) -> Message:
+	"""Сообщение-заменитель команды для дайджеста по расписанию (от имени бота)."""
+	info = await bot.get_chat(chat_id)
+	chat = Chat(id=info.id, type=info.type, title=info.title, username=info.username)
+	user = User(id=bot.id, is_bot=True, first_name="Дайджест")
+	return Message(message_id=0, date=datetime.now(), chat=chat, from_user=user).as_(bot)
+
+
+async def summary_job_dead(job: dict):
+	"""Задание не выполнилось за все попытки - сообщаем в чат."""
+	await bot.send_message(job["chat_id"], "Не удалось сделать сводку. Попробуйте позже.")
+
+
+# Ежедневный дайджест по расписанию
+@dp.message(Command("digest"))
+async def digest_cmd(message: Message, command: CommandObject):
+	"""/digest 21:00 - каждый день сводка новых сообщений в это время, /digest off - выключить, /digest - текущее."""
+	if message.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
+		await message.answer("Эта команда работает только в групповых чатах!")
+		return
+	chat_id = message.chat.id
+	if message.from_user.id != ADMIN_ID and message.from_user.id not in await get_admins(chat_id):
+		await del_msg_delay(await message.reply("Эта команда доступна только администраторам."))
+		return
+
+	arg = (command.args or "").strip().lower()
+	if not arg:
+		hhmm = await digest_schedule.get_time(r, chat_id)
+		text = f"Дайджест каждый день в {hhmm} (UTC+{digest_schedule.TZ_HOURS})." if hhmm else "Дайджест выключен. Включить: /digest 21:00"
+	elif arg == "off":
+		await digest_schedule.remove(r, chat_id)
+		text = "Дайджест выключен."
+	else:
+		hhmm = digest_schedule.parse_time(arg)
+		if hhmm:
+			await digest_schedule.set_time(r, chat_id, hhmm)
+			text = f"✅ Дайджест каждый день в {hhmm} (UTC+{digest_schedule.TZ_HOURS}), если наберётся {MIN_TO_GPT}+ новых сообщений."
+		else:
+			text = "Формат: /digest 21:00 или /digest off"
+	await del_msg_delay(await message.reply(text), 30)
+
+
+async def count_new_messages(chat_id: int) -> int:
+	"""Сколько сообщений появилось с последней сводки (не больше MIN_TO_GPT - больше и не нужно)."""
+	last_id = int(await r.hget(f"chat:{chat_id}:last_sum", 'id') or 0)
+	if not last_id:
+		return await history.count(chat_id)
+	return len(await history.after(chat_id, last_id, MIN_TO_GPT))
+
+
+async def run_digests():
+	"""Раз в минуту: ставит в очередь сводок дайджесты чатов, у которых подошло время."""
+	try:
+		for chat_id, hhmm in (await digest_schedule.schedules(r)).items():
+			date = digest_schedule.due_date(chat_id, hhmm)
+			if not date or await digest_schedule.is_done(r, chat_id, date):
+				continue
+			new_count = await count_new_messages(chat_id)
+			if new_count < MIN_TO_GPT:
+				await digest_schedule.mark_done(r, chat_id, date) # Сегодня пропускаем
+				logging.info(f"Дайджест чата {chat_id} пропущен: новых сообщений {new_count} < {MIN_TO_GPT}")
+				continue
+			lock_key = summary_lock_key(chat_id)
+			if not await r.set(lock_key, 1, ex=SUMMARIZE_LOCK_EXPIRY_SECONDS, nx=True):
+				continue # Идёт /sum - попробуем через минуту
+			if not await digest_schedule.mark_done(r, chat_id, date): # Успел другой процесс
+				await r.delete(lock_key)
+				continue
+			await summary_queue.enqueue(r, chat_id, {"digest": True, "count": 0, "start": 0, "privat": False})
+			logging.info(f"Дайджест чата {chat_id} поставлен в очередь")
+	except Exception as e:
+		logging.error(f"Ошибка запуска дайджестов: {e}", exc_info=True)
+
+
 # чекаем в бд sum_access
 async def is_user_approved(chat_id: int, user_id: int) -> str:
 	mes = json.loads(await r.hget(f"chat:{chat_id}:sum_access", user_id) or "{}")	
@@ -397,33 +631,19 @@ async def is_user_approved(chat_id: int, user_id: int) -> str:
 		return mes['access']
 	 
 
-# на всякий случий, автосчетчик максимального допустимого числа знаков для ответа
-def auto_gpt_mes_count(value):
-	"""Интерполяция с быстрым ростом при малых значениях.
-	Возвращает примерное количество символов для запроса к GPT в зависимости от числа сообщений.
-	"""
-	if value < 100:
-		return 500
-	elif value > 2000:
-		return 3700
-	else:
-		# Нелинейная интерполяция для более быстрого роста при малых значениях
-		return int(500 + (value - 100) * (3700 - 500) / (2000 - 100) * (0.8 * (1 - (value - 100) / 500) ** 2 + 0.2))
-
 async def _fetch_messages_for_summary(chat_id: int, count: int, start: int) -> tuple[list, int, str | None]:
 	"""
 	Извлекает сообщения из Redis для суммаризации.
 	Возвращает (список сообщений, количество, ID последнего сообщения для ссылки).
 	"""
-	key = f"chat:{chat_id}:history"
 	last_sum_id = None
+	if write_buffer:
+		await write_buffer.flush() # Чтобы в сводку попали и ещё не записанные сообщения
 	
 	if count > 0:
 		# Пользовательский запрос с указанием количества
 		logging.info(f'Запрос на сводку {count} сообщений со смещением {start}')
-		messages_json = await r.lrange(key, start, start + count - 1)
-		messages = [json.loads(m) for m in messages_json]
-		messages.reverse()
+		messages = await history.latest(chat_id, count, start, archive=history_archive)
 	else:
 		# Автоматический запрос (новые сообщения с последней сводки)
 		last_sum_data = await r.hgetall(f"chat:{chat_id}:last_sum")
@@ -432,23 +652,24 @@ async def _fetch_messages_for_summary(chat_id: int, count: int, start: int) -> t
 
 		# Если последней сводки не было, берем DEF_SUM_MES
 		if msg_old_id == 0:
-			messages_json = await r.lrange(key, 0, DEF_SUM_MES - 1)
-			messages = [json.loads(m) for m in messages_json]
-			messages.reverse()
+			messages = await history.latest(chat_id, DEF_SUM_MES)
 		else:
-			messages = []
-			history_chunk = await r.lrange(key, 0, MAX_TO_GPT) 
-			for msg_json in history_chunk:
-				msg = json.loads(msg_json)
-				if msg['id'] > msg_old_id:
-					messages.append(msg)
-				else:
-					break # Нашли границу, прекращаем
-			messages.reverse() # Восстанавливаем хронологический порядок
+			# Только сообщения новее последней сводки, выборка по ID без перебора
+			messages = await history.after(chat_id, msg_old_id, MAX_TO_GPT)
+	messages = await user_directory.attach_names(r, chat_id, messages) # Имена из справочника одним запросом
 	return messages, len(messages), last_sum_id
 
+# Базовая ссылка на сообщения чата
+def chat_link_base(chat) -> str:
+	chat_id_str = str(chat.id)[4:] # Для приватной супергруппы убираем префикс "-100"
+	return f"t.me/{chat.username}/" if chat.username else f"t.me/c/{chat_id_str}/"
+
 # Делаем суммаризацию
-async def process_summarize(message: Message, count=0, start=0, privat: bool = False):
+# Временные ошибки сводки: пробрасываются в очередь заданий, она повторит (summary_queue.MAX_ATTEMPTS)
+SUMMARY_RETRY_ERRORS = (summary_queue.RetryJob, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+						redis.ConnectionError, redis.TimeoutError)
+
+async def process_summarize(message: Message, count=0, start=0, privat: bool = False, digest: bool = False):
 	chat = message.chat
 	chat_id = chat.id
 	user = message.from_user
@@ -459,7 +680,7 @@ async def process_summarize(message: Message, count=0, start=0, privat: bool = F
 	else:
 		target_chat_id = chat.id
 	
-	ttl = await check_daily_limit(chat_id, user.id)
+	ttl = 0 if digest else await check_daily_limit(chat_id, user.id) # Дайджест по расписанию не тратит лимиты
 	if (ttl > 0):
 		await del_msg_delay(await message.answer(f"❌ Достигнут лимит запросов суммаризации!\n Подождите {format_seconds(ttl)}"))
 		return
@@ -470,13 +691,15 @@ async def process_summarize(message: Message, count=0, start=0, privat: bool = F
 		await del_msg_delay(await message.answer("Нет сообщений для суммаризации."))
 		return
 
-	chat_id_str = str(chat_id)[4:]
-	turl = f"t.me/{chat.username}/" if chat.username else f"t.me/c/{chat_id_str}/"
+	turl = chat_link_base(chat)
 	if last_sum_id: 
 		surl = f'Предыдущий свод [тут]({turl}{last_sum_id})' # Используем стандартный Markdown
 	else:
 		surl = ''
 
+	header = f"📝 \#{'Дайджест' if digest else 'Суммаризация'} последних {final_count} сообщений:\n"
+	progress = None # Сообщение-заглушка, которое дописывается по мере генерации
+	sum = None # Первое сообщение отправленной сводки
 	typing_task = None # Инициализируем переменную для задачи
 	try:
 		# 1. Создаем и запускаем фоновую задачу, которая будет слать "typing"
@@ -488,13 +711,37 @@ async def process_summarize(message: Message, count=0, start=0, privat: bool = F
 
 		typing_task = asyncio.create_task(send_typing_periodically())
 
-		logging.info(f"Передача {final_count} сообщений в AI для чата {chat_id}")
-		summary = await get_gpt4_summary(messages, turl)
+		# Готовые конспекты фрагментов из этого диапазона (только для сводки "с прошлого раза")
+		chunks = []
+		if SUMMARY_CHUNKS and count == 0:
+			chunks = await summary_chunks.load_range(r, chat_id, messages[0]['id'], messages[-1]['id'])
+		merged = bool(chunks) or final_count >= MAP_REDUCE_MIN_MESSAGES
+
+		# Та же выборка уже суммаризировалась (другой запрос, /sum -p после сводки в чате).
+		# Заголовок и ссылка добавляются после кеша, поэтому режим - только способ генерации
+		window = (messages[0]['id'], messages[-1]['id'], "merged" if merged else "single", SUMMARY_PROMPT_VERSION)
+		summary = await summary_cache.get(r, chat_id, *window)
+		from_cache = summary is not None
+		if from_cache:
+			logging.info(f"Сводка для чата {chat_id} взята из кеша")
+		else:
+			on_progress = None
+			if SUMMARY_STREAMING:
+				progress = ProgressiveMessage(bot, target_chat_id, header, markdown_to_tg_v2)
+				await progress.start()
+				on_progress = progress.update
+
+			started = time.perf_counter()
+			if merged:
+				summary = await map_reduce_summary(chat_id, messages, turl, chunks, on_progress)
+			else:
+				logging.info(f"Передача {final_count} сообщений в AI для чата {chat_id}")
+				summary = await get_gpt4_summary(messages, turl, on_progress, chat_id=chat_id)
+			logging.info(f"Сводка для чата {chat_id} получена за {time.perf_counter() - started:.1f} с")
 
 		if not summary:
-			logging.error("AI returned an empty or None summary, cannot proceed.")
-			await bot.send_message(target_chat_id, "Не удалось сгенерировать сводку. Попробуйте позже.")
-			return # Выходим, finally выполнится
+			# Ошибки AI уже залогированы: задание повторит очередь, а после всех попыток сообщит в чат
+			raise summary_queue.RetryJob("AI не вернул сводку")
 
 		logging.info(f"Ответ gpt4: получен. Длина {len(summary)}")
 		await r.lpush('gpt_answ_t', json.dumps(summary))
@@ -503,60 +750,73 @@ async def process_summarize(message: Message, count=0, start=0, privat: bool = F
 		if typing_task:
 			typing_task.cancel()
 
-		# --- НОВАЯ ЛОГИКА: ПОВТОРНАЯ СУММАРИЗАЦИЯ, ЕСЛИ ТЕКСТ СЛИШКОМ ДЛИННЫЙ ---
-		if len(summary) > MAX_SUM:
-			logging.warning(f"Сводка слишком длинная ({len(summary)} > {MAX_SUM}). Запускаю повторное сокращение.")
-			
-			# Снова включаем "typing", чтобы пользователь видел, что работа продолжается
-			typing_task = asyncio.create_task(send_typing_periodically())
+		# --- ТЕКСТ СЛИШКОМ ДЛИННЫЙ: обрезка по абзацам, несколько сообщений, и только потом AI ---
+		if len(summary) > MAX_SUM and not from_cache: # В кеше уже итоговый текст
+			logging.warning(f"Сводка слишком длинная ({len(summary)} > {MAX_SUM}).")
+			summary = await fit_summary_length(summary, send_typing_periodically, chat_id)
 
+		if not from_cache:
 			try:
-				# Вызываем новую функцию для сокращения
-				shortened_summary = await shorten_text_with_ai(summary)
-				
-				# Используем сокращенную версию, только если она действительно короче
-				if shortened_summary and len(shortened_summary) < len(summary):
-					logging.info(f"Текст успешно сокращен до {len(shortened_summary)} символов.")
-					summary = shortened_summary
-				else:
-					logging.warning("Не удалось сократить текст или сокращенный текст длиннее оригинала. Используется исходный.")
+				await summary_cache.put(r, chat_id, *window, summary)
 			except Exception as e:
-				logging.error(f"Ошибка при повторном сокращении: {e}")
-				# В случае ошибки просто продолжаем с исходным длинным текстом, Telegram его обрежет.
-			finally:
-				# Убедимся, что задача "typing" будет отменена
-				if typing_task:
-					typing_task.cancel()
+				logging.error(f"Не удалось сохранить сводку в кеш: {e}") # Сводку всё равно отправляем
 		
 		# <--- 4. Используем bot.send_message для отправки в target_chat_id
-		sum_text = f"📝 \#Суммаризация последних {final_count} сообщений:\n{summary}"
+		sum_text = header + summary
 		if surl and not privat: # Добавляем ссылку на пред. свод только если постим в чат
 			sum_text += f"\n{surl}"
 
-		sum = await bot.send_message(
-			chat_id=target_chat_id,
-			text=sum_text,
-			disable_web_page_preview=True,
-			parse_mode="MarkdownV2"
-		)
+		parts = _split_tg_message(sum_text) # Длинная сводка уходит несколькими сообщениями
+		if progress: # Заглушка превращается в итоговую сводку
+			sum = await progress.finish(parts[0])
+		else:
+			sum = await bot.send_message(
+				chat_id=target_chat_id,
+				text=parts[0],
+				disable_web_page_preview=True,
+				parse_mode="MarkdownV2"
+			)
+		for part in parts[1:]:
+			await bot.send_message(target_chat_id, part, disable_web_page_preview=True, parse_mode="MarkdownV2")
 	# <--- 5. Обработка ошибки, если бот не может написать в личку
 	except TelegramForbiddenError:
 		logging.error(f"Не удалось отправить сообщение пользователю {user.id}. Бот заблокирован или чат не начат.")
 		await bot.send_message(target_chat_id, "Не всё так просто, спроси сам знаешь кого ))")
 		return
+	except SUMMARY_RETRY_ERRORS as e:
+		if sum is not None: # Сводка уже в чате, повтор её продублирует
+			logging.error(f"Сводка для чата {chat_id} отправлена не полностью: {e}")
+			return
+		logging.warning(f"Сводка для чата {chat_id} не удалась, задание будет повторено: {e}")
+		if progress and progress.message: # Следующая попытка начнёт с новой заглушки
+			try:
+				await bot.delete_message(target_chat_id, progress.message.message_id)
+			except Exception as delete_e:
+				logging.warning(f"Не удалось удалить заглушку сводки: {delete_e}")
+		raise
 	except Exception as e:
 		if "can't parse entities" in str(e).lower():
 			logging.error(f"Markdown parse error, sending plain text. Error: {e}")
-			await bot.send_message(target_chat_id, sum_text, disable_web_page_preview=True)
+			parts = _split_tg_message(sum_text) # Как и с разметкой: длинная сводка - несколькими сообщениями
+			if progress:
+				await progress.finish(parts[0], parse_mode=None)
+			else:
+				await bot.send_message(target_chat_id, parts[0], disable_web_page_preview=True, parse_mode=None)
+			for part in parts[1:]:
+				await bot.send_message(target_chat_id, part, disable_web_page_preview=True, parse_mode=None)
 			return
 		logging.error(f"Error in process_summarize: {e}", exc_info=True)
-		await bot.send_message(target_chat_id, "Ошибка получения данных от AI или отправки сообщения.")
+		if progress and progress.message:
+			await progress.fail("Ошибка получения данных от AI или отправки сообщения.")
+		else:
+			await bot.send_message(target_chat_id, "Ошибка получения данных от AI или отправки сообщения.")
 		return
 	finally:
 		if typing_task:
 			typing_task.cancel()
 
-	await upd_daily_limit(chat_id, user.id, privat)
+	if not digest:
+		await upd_daily_limit(chat_id, user.id, privat)
 	
 	# Обновляем last_sum только если это не приватный запрос и не кастомный по числу
 	if not privat and count == 0:
@@ -624,7 +884,43 @@ async def upd_daily_limit(chat_id: int, user_id: int, privat:bool):
 		await pipe.execute()
 
 
-async def shorten_text_with_ai(text: str) -> str | None:
+async def fit_summary_length(summary: str, send_typing_periodically, chat_id: int | None = None) -> str:
+	"""Укладывает сводку в лимиты без второго запроса к AI, если получается: несколько сообщений, обрезка, AI."""
+	part_len = TG_MAX_LENGTH - 200 # 200 - запас на заголовок и ссылку
+	parts = _split_tg_message(summary, part_len)
+	if len(parts) <= SUMMARY_MAX_PARTS:
+		logging.info(f"Сводка ({len(summary)} символов) будет отправлена {len(parts)} сообщениями.")
+		return summary
+	# Обрезка до того, что помещается в SUMMARY_MAX_PARTS сообщений
+	budget = SUMMARY_MAX_PARTS * part_len
+	truncated = truncate_markdown_v2(summary, budget)
+	while truncated and len(_split_tg_message(truncated, part_len)) > SUMMARY_MAX_PARTS:
+		truncated = truncate_markdown_v2(truncated, len(truncated) - 1) # Разбивка по строкам теряет место - ещё строку
+	if len(truncated) >= min(len(summary), budget) * TRUNCATE_KEEP_RATIO:
+		cut = summary[len(truncated):].strip()
+		logging.warning(f"Сводка обрезана по границе абзаца/строки: {len(summary)} -> {len(truncated)} символов, "
+						f"отброшено: {cut[:300]!r}{'...' if len(cut) > 300 else ''}")
+		return truncated
+
+	# Крайний случай: сокращение через AI. Снова включаем "typing", работа продолжается
+	logging.warning("Запускаю повторное сокращение через AI.")
+	typing_task = asyncio.create_task(send_typing_periodically())
+	try:
+		shortened_summary = await shorten_text_with_ai(summary, chat_id)
+		# Используем сокращенную версию, только если она действительно короче
+		if shortened_summary and len(shortened_summary) < len(summary):
+			logging.info(f"Текст успешно сокращен до {len(shortened_summary)} символов.")
+			return shortened_summary
+		logging.warning("Не удалось сократить текст или сокращенный текст длиннее оригинала. Используется исходный.")
+	except Exception as e:
+		logging.error(f"Ошибка при повторном сокращении: {e}")
+	finally:
+		typing_task.cancel()
+	# Исходный длинный текст: уйдёт несколькими сообщениями
+	return summary
+
+
+async def shorten_text_with_ai(text: str, chat_id: int | None = None) -> str | None:
 	"""Сокращает уже сгенерированный текст, если он слишком длинный."""
 	logging.info(f"Попытка сократить текст длиной {len(text)} до {MAX_SUM} символов.")
 	prompt = f"""
@@ -640,10 +936,10 @@ async def shorten_text_with_ai(text: str) -> str | None:
 {text}
 """
 	try:
-		response = await gclient.aio.models.generate_content(
-			model=GEMINI_MODEL,
+		response = await ai_request("shorten", llm_scheduler.SUMMARY, chat_id, lambda model: llm.generate(
+			model=model,
 			contents=prompt,
-		)
+		))
 		
 		# Дополнительная проверка, что ответ не пустой
 		if not response.text or not response.text.strip():
@@ -657,10 +953,50 @@ async def shorten_text_with_ai(text: str) -> str | None:
 		logging.error(f"Error in shorten_text_with_ai: {e}", exc_info=True)
 		return text # В случае ошибки возвращаем исходный текст, чтобы не потерять сводку
 
+# Запрос к AI: очередь ai_scheduler, дедлайн места вызова и (с AI_HEDGE_MODEL) дублирующий запрос к быстрой модели.
+# call(model) - корутина запроса к указанной модели
+# Каждая попытка учитывается в ai_usage (токены, время, место вызова, чат) для /ai_stats
+async def ai_request(site: str, priority: int, chat_id, call):
+	async def attempt():
+		started = time.perf_counter()
+		try:
+			response = await ai_hedger.run(site, call, AI_DEADLINES[site])
+		except Exception:
+			await record_ai_usage(site, chat_id, None, time.perf_counter() - started, error=True)
+			raise
+		await record_ai_usage(site, chat_id, response.usage_metadata, time.perf_counter() - started)
+		return response
+	return await ai_scheduler.run(priority, chat_id, attempt, site)
+
+async def record_ai_usage(site: str, chat_id, usage, elapsed: float, error: bool = False):
+	try:
+		await ai_usage.record(r, site, chat_id, usage, elapsed, error)
+	except Exception as e:
+		logging.error(f"Redis error in record_ai_usage: {e}")
+
+# Вызов Gemini для сводок; с on_progress - потоковый, on_progress получает весь накопленный текст.
+# fallback_config - для запасной модели, если config ссылается на кеш промпта основной
+async def _generate(config, contents, on_progress=None, chat_id=None, site="summary", fallback_config=None):
+	async def call(model):
+		model_config = config if model == GEMINI_MODEL else (fallback_config or config)
+		if on_progress is None:
+			return await llm.generate(model=model, config=model_config, contents=contents)
+		text, last = "", None
+		async for chunk in llm.stream(model=model, config=model_config, contents=contents):
+			last = chunk
+			if chunk.text:
+				text += chunk.text
+				if model == GEMINI_MODEL:  # Прогресс показывает только основная модель
+					await on_progress(text)
+		return SimpleNamespace(text=text, usage_metadata=last.usage_metadata if last else None,
+							   prompt_feedback=last.prompt_feedback if last else None)
+	return await ai_request(site, llm_scheduler.SUMMARY, chat_id, call)
+
 # Запрос к ИИ
-async def get_gpt4_summary(text: list, turl: str) -> str | None:
+# thinking_budget и target_length по умолчанию - по кривым SUMMARY_THINKING_CURVE / SUMMARY_LENGTH_CURVE от размера окна
+async def get_gpt4_summary(text: list, turl: str, on_progress=None, chat_id=None,
+						   thinking_budget: int | None = None, target_length: int | None = None) -> str | None:
 	#return f"Jlsdgssdgdfhdh\n"	
-	# MAX_SUM = auto_gpt_mes_count(count)
 
 	# Задаем системную инструкцию при создании модели
 	#первая строка должна быть такой: `--- cut here ---` будет служить для "отрезки лишнего"
@@ -668,37 +1004,30 @@ async def get_gpt4_summary(text: list, turl: str) -> str | None:
 	prompt = f"""
 **Роль:** Ты — AI-ассистент, который создаёт краткие и остроумные пересказы диалогов из Telegram-чатов в формате **MarkdownV2**, готовом для отправки в Telegram.
 
-**Задача:** Проанализируй предоставленный фрагмент чата в формате JSON и создай на его основе пост для Telegram, следуя правилам ниже.
+**Задача:** Проанализируй предоставленный фрагмент чата и создай на его основе пост для Telegram, следуя правилам ниже.
 
 **Форматирование**
 1. Используй **строго** MarkdownV2: `*жирный*`, `_курсив_`, `> цитаты`, списки с `•`.
 
 **Контекст и входные данные:**
-В твоем распоряжении базовая ссылка на чат и json строки :
-1.  {turl} — базовая ссылка на чат.
-2.  json строки: массив сообщений, где каждый объект содержит `id` сообщения, `reply_to` ответ на сообщение (может не быть), `full_name`, `user_name` (может быть `None`) и `text`.
-
-**Пример структуры входных данных:**
-```json
-(
-  "id": 455000,
-  "user_name": "None",
-  "full_name": "Valery Gordienko",
-  "text": "Это не одиночный, здесь предохранитель есть."
-)
-(
-  "id": 455001,
-  "reply_to": 454999,
-  "user_name": "karamba666",
-  "full_name": "Павел",
-  "text": "В заднем кармане 🌚"
-)
-(
-  "id": 455028,
-  "user_name": "AndzhelaA78",
-  "full_name": "Анджела Аргунова",
-  "text": "Доброе утро"
-)```
+В твоем распоряжении базовая ссылка на чат и сообщения:
+1.  Базовая ссылка на чат — в первой строке (`Ссылка на чат: t.me/...`), желаемая длина пересказа — во второй.
+2.  Легенда участников: `u1=Полное имя @user_name` (`@user_name` может не быть).
+3.  Сообщения по одному на строку: `id|ответ на|автор|текст`. `ответ на` — id сообщения, на которое ответили (может быть пустым), `автор` — код из легенды. Переносы строк в тексте заменены на ` / `.
+
+**Пример входных данных:**
+```
+Ссылка на чат: t.me/chatname/
+Желаемая длина пересказа: до 1500 символов.
+Участники:
+u1=Valery Gordienko
+u2=Павел @karamba666
+u3=Анджела Аргунова @AndzhelaA78
+Сообщения (id|ответ на|автор|текст):
+455000||u1|Это не одиночный, здесь предохранитель есть.
+455001|454999|u2|В заднем кармане 🌚
+455028||u3|Доброе утро
+```
 
 **ТРЕБОВАНИЯ К ОТЧЁТУ (СЛУШАЙ ВНИМАТЕЛЬНО!):**
 
@@ -710,16 +1039,16 @@ async def get_gpt4_summary(text: list, turl: str) -> str | None:
 
 3.  **Имена и ссылки на юзеров.**
 
-	  * Используй только имя из поля `full_name` (например, из "Valery Gordienko" делай *Валерий*, из "Анджела Аргунова" — *Анджела*). Следи за правильностью имён, не допускай опечаток (например, пиши "Анджела", а не "Анжела", сверяясь с `full_name`).
-	  * При **первом** упоминании пользователя в сводке сделай его имя кликабельной ссылкой, если у него есть `user_name`. Формат: `[Имя](t.me/user_name)`.
-	  * Если `user_name` равен `None`, имя пишется просто текстом (можно *жирным*), без ссылки. Например, для "Vasili Petrovich" с `user_name: None` ты напишешь просто *Василий*.
+	  * Используй только полное имя из легенды участников (например, из "Valery Gordienko" делай *Валерий*, из "Анджела Аргунова" — *Анджела*). Следи за правильностью имён, не допускай опечаток (например, пиши "Анджела", а не "Анжела", сверяясь с легендой).
+	  * При **первом** упоминании пользователя в сводке сделай его имя кликабельной ссылкой, если в легенде у него есть `@user_name`. Формат: `[Имя](t.me/user_name)`.
+	  * Если `@user_name` нет, имя пишется просто текстом (можно *жирным*), без ссылки. Например, для `u7=Vasili Petrovich` ты напишешь просто *Василий*.
 	  * При **повторных** упоминаниях этого же пользователя в этой же сводке ссылка больше **не нужна**. Имя можно выделить *жирным* для акцента.
 	  * Экранируй спецсимволы в именах, к примеру `Вас_Я` приводи к `ВасЯ` или `Вас-Я`.
 	  * Пример: ...а *Иван* в ... или ... попросили *Романа* сделать ... или ... упомянув *Лену* в ...
 4.  **Ссылки на сообщения.**
 
 	  * Вместо скучных `[id:...]` делай живую ссылку прямо из ключевой фразы в тексте (1-3 слова). Текст ссылки должен быть экранирован от спецсимволов MarkdownV2.
-	  * Формат ссылки: `ключевая фраза`. Переменные `id` бери из входного JSON. Никаких разрывов между `](`.
+	  * Формат ссылки: `ключевая фраза`. Переменные `id` бери из первого поля строки сообщения. Никаких разрывов между `](`.
 	  * Пример: ...опять сидели бы без [горячей воды](t.me/chatname/452339) в ... или ...пустили новый [слух о ремонте](t.me/chatname/452345) дорог...
 
 5.  **Тон — наше всё!** Пиши так, будто рассказываешь другу, что он пропустил. Используй иронию, подколки, эмодзи и восклицательные знаки, чтобы текст был живым и энергичным.
@@ -731,23 +1060,43 @@ async def get_gpt4_summary(text: list, turl: str) -> str | None:
 
 7.  **Пределы.**
 
-	  * **Максимальная длина ответа — {MAX_SUM} символов.** Но стремись к максимальной сжатости без потери смысла. _Less is more_.
+	  * **Максимальная длина ответа — {MAX_SUM} символов**, а ориентир — желаемая длина из входных данных. Стремись к максимальной сжатости без потери смысла. _Less is more_.
 
 **И ОБЯЗАТЕЛЬНО ПОВТОРНО ПРОВЕРЬ перед отправкой:**
 1. Длину пересказа (7й пункт требований)
 2. Корректность и видимость ссылок (4й пункт требований) и правильность экранирования для MarkdownV2."""
+	# Промпт не зависит от чата (ссылка - во входных данных), поэтому его можно держать в кеше Gemini
+	tools = [gtypes.Tool(url_context=gtypes.UrlContext())]
+	payload = build_payload(text)  # Легенда участников и по строке на сообщение
+	window_tokens = estimate_tokens(payload)
+	if thinking_budget is None:
+		thinking_budget = summary_budget.interpolate(SUMMARY_THINKING_CURVE, window_tokens)
+	if target_length is None:
+		target_length = summary_budget.interpolate(SUMMARY_LENGTH_CURVE, window_tokens)
+	thinking = gtypes.ThinkingConfig(thinking_budget=thinking_budget)
+	# Целевая длина - во входных данных, а не в промпте: промпт остаётся одним на все окна и живёт в кеше
+	contents = f"Ссылка на чат: {turl}\nЖелаемая длина пересказа: до {min(target_length, MAX_SUM)} символов.\n" + payload
+	inline_config = gtypes.GenerateContentConfig(tools=tools, thinking_config=thinking, system_instruction=prompt,
+												 max_output_tokens=thinking.thinking_budget + SUMMARY_OUTPUT_TOKENS)
 	try:
-		response = await gclient.aio.models.generate_content(
-			model=GEMINI_MODEL,
-			config=gtypes.GenerateContentConfig(
-				tools=[
-					gtypes.Tool(url_context=gtypes.UrlContext()),
-				],
-				thinking_config=gtypes.ThinkingConfig(thinking_budget=11000),
-				system_instruction=prompt,  # Системная инструкция
-				),
-			contents=json.dumps(text),  # Описание, текст в формате JSON
-			)
+		config = await summary_prompt_cache.config(prompt, tools, thinking_config=thinking,
+												   max_output_tokens=thinking.thinking_budget + SUMMARY_OUTPUT_TOKENS)
+		started = time.perf_counter()
+		try:
+			response = await _generate(config, contents, on_progress, chat_id, fallback_config=inline_config)
+		except Exception as e:
+			if not config.cached_content or 'cache' not in str(e).lower():
+				raise
+			# Кеш истёк или удалён на стороне Gemini - повторяем с промптом целиком
+			logging.warning(f"Кеш промпта сводки не сработал, повтор без него: {e}")
+			await summary_prompt_cache.invalidate()
+			config = inline_config
+			started = time.perf_counter()
+			response = await _generate(config, contents, on_progress, chat_id)
+		try:
+			await summary_prompt_cache.record(response, time.perf_counter() - started, bool(config.cached_content))
+		except Exception as stats_e:
+			logging.error(f"Redis error in get_gpt4_summary (cache stats): {stats_e}")
 
 		# Сохраняем успешный ответ для отладки
 		try:
@@ -781,6 +1130,115 @@ async def get_gpt4_summary(text: list, turl: str) -> str | None:
 			logging.error(f"Redis error in get_gpt4_summary (error log): {redis_e}")
 		return None
 
+# Конспект одного фрагмента для фоновой суммаризации (в обычном Markdown, преобразование - при объединении)
+async def get_chunk_notes(messages: list, turl: str, chat_id=None) -> str | None:
+	prompt = f"""
+**Задача:** Сделай сжатый конспект фрагмента Telegram-чата (легенда участников `u1=Имя @user_name`, затем сообщения `id|ответ на|автор|текст`). Конспект потом объединят с соседними фрагментами в один пост, поэтому нужна не литература, а факты.
+
+**Правила:**
+1. Перечисли темы фрагмента по одной строке: кто (полное имя и `@user_name` из легенды, если есть), что обсуждали, к чему пришли, удачные шутки.
+2. Для каждой темы дай 1-2 ссылки на ключевые сообщения в формате `[ключевая фраза]({turl}id)`.
+3. Флуд и мелкие реплики пропускай. Не больше 1200 символов."""
+	try:
+		config = gtypes.GenerateContentConfig(
+			thinking_config=gtypes.ThinkingConfig(thinking_budget=CHUNK_THINKING_BUDGET),
+			system_instruction=prompt,
+			)
+		response = await _generate(config, build_payload(messages), chat_id=chat_id, site="chunk")
+		return response.text.strip() if response.text else None
+	except Exception as e:
+		logging.error(f"Error in get_chunk_notes: {e}", exc_info=True)
+		return None
+
+# Итоговая сводка из готовых конспектов и хвоста сообщений
+async def get_merged_summary(chunks: list[dict], tail: list, turl: str, on_progress=None, chat_id=None) -> str | None:
+	prompt = f"""
+**Роль:** Ты — AI-ассистент, который создаёт краткие и остроумные пересказы диалогов из Telegram-чатов в формате **MarkdownV2**.
+
+**Входные данные:** конспекты подряд идущих фрагментов чата (с диапазонами id сообщений, ссылки вида `[фраза]({turl}id)` уже расставлены) и, возможно, сообщения, не попавшие в конспекты: легенда участников `u1=Имя @user_name`, затем строки `id|ответ на|автор|текст`.
+
+**Задача:** Объедини всё в один пост, как будто читал весь чат целиком.
+1. **Жирный заголовок и 1-3 эмодзи**, затем сочный пересказ на 3-7 предложений об атмосфере и ключевых темах.
+2. Связанные темы из разных фрагментов сводишь в один блок. Мелочи выкидываешь.
+3. Ссылки на сообщения из конспектов **сохраняй без изменений**, для сообщений без конспекта делай такие же: `[ключевая фраза]({turl}id)`.
+4. Имена — только полные имена участников (Valery Gordienko -> *Валерий*). При первом упоминании имя — ссылка `[Имя](t.me/user_name)`, если `@user_name` известен; дальше — без ссылки.
+5. Тон живой, с иронией и эмодзи, как рассказ другу о том, что он пропустил.
+6. **Максимальная длина ответа — {MAX_SUM} символов.** Проверь длину и корректность ссылок перед ответом."""
+	parts = [f"Конспект сообщений {c['first']}-{c['last']}:\n{c['text']}" for c in chunks]
+	if tail:
+		parts.append("Сообщения, не вошедшие в конспекты:\n" + build_payload(tail))
+	try:
+		config = gtypes.GenerateContentConfig(
+			thinking_config=gtypes.ThinkingConfig(thinking_budget=MERGE_THINKING_BUDGET),
+			max_output_tokens=MERGE_THINKING_BUDGET + SUMMARY_OUTPUT_TOKENS,
+			system_instruction=prompt,
+			)
+		response = await _generate(config, "\n\n".join(parts), on_progress, chat_id, site="merge")
+		if not response.text:
+			return None
+		return markdown_to_tg_v2(response.text)
+	except Exception as e:
+		logging.error(f"Error in get_merged_summary: {e}", exc_info=True)
+		return None
+
+# Map-reduce: недостающие конспекты параллельно (не больше MAP_CONCURRENCY), затем одно объединение
+async def map_reduce_summary(chat_id: int, messages: list, turl: str, chunks: list[dict], on_progress=None) -> str | None:
+	tail = summary_chunks.split_covered(messages, chunks)
+	if len(tail) >= MAP_REDUCE_MIN_MESSAGES:
+		parts = summary_chunks.split_by_tokens(tail, MAP_CHUNK_TOKENS)
+		semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+		async def map_part(part):
+			async with semaphore:
+				return await get_chunk_notes(part, turl, chat_id)
+
+		started = time.perf_counter()
+		notes = await asyncio.gather(*(map_part(part) for part in parts))
+		logging.info(f"Map: {len(parts)} кусков из {len(tail)} сообщений чата {chat_id} за {time.perf_counter() - started:.1f} с")
+		for part, text in zip(parts, notes):
+			if text: # Неудачный кусок уйдёт в объединение как есть
+				chunks.append({"first": part[0]['id'], "last": part[-1]['id'], "count": len(part), "text": text})
+		chunks.sort(key=lambda c: c["first"])
+		tail = summary_chunks.split_covered(tail, chunks)
+
+	started = time.perf_counter()
+	summary = await get_merged_summary(chunks, tail, turl, on_progress, chat_id)
+	logging.info(f"Reduce: {len(chunks)} конспектов и {len(tail)} сообщений чата {chat_id} за {time.perf_counter() - started:.1f} с")
+	return summary
+
+# Фоновые конспекты: каждые CHUNK_MESSAGES новых сообщений превращаются в конспект
+async def summarize_chunks():
+	async for chat_id in history.chat_ids():
+		try:
+			await summarize_chat_chunks(int(chat_id))
+		except Exception as e:
+			logging.error(f"Ошибка фоновых конспектов для чата {chat_id}: {e}", exc_info=True)
+
+async def summarize_chat_chunks(chat_id: int):
+	# Фрагменты начинаются после последнего конспекта или последней сводки - что новее
+	last_sum_id = int(await r.hget(f"chat:{chat_id}:last_sum", 'id') or 0)
+	cursor = max(await summary_chunks.last_id(r, chat_id), last_sum_id)
+	messages = await history.after(chat_id, cursor, MAX_TO_GPT)
+	if len(messages) < summary_chunks.CHUNK_MESSAGES:
+		return
+	# Несколько процессов бота не должны конспектировать одно и то же
+	lock_key = f"chat:{chat_id}:sum_chunks:lock"
+	if not await r.set(lock_key, 1, nx=True, ex=SUMMARIZE_LOCK_EXPIRY_SECONDS):
+		return
+	try:
+		turl = chat_link_base(await bot.get_chat(chat_id))
+		messages = await user_directory.attach_names(r, chat_id, messages)
+		size = summary_chunks.CHUNK_MESSAGES
+		for i in range(0, min(len(messages) // size, SUMMARY_CHUNKS_PER_RUN) * size, size):
+			chunk = messages[i:i + size]
+			notes = await get_chunk_notes(chunk, turl, chat_id)
+			if not notes:
+				break # Попробуем в следующий раз с того же места
+			await summary_chunks.save(r, chat_id, chunk, notes)
+			logging.info(f"Конспект сообщений {chunk[0]['id']}-{chunk[-1]['id']} чата {chat_id} сохранён.")
+	finally:
+		await r.delete(lock_key)
+
 # Обработка подтверждения/отказа запроса
 @dp.callback_query(F.data.startswith("approve:") | F.data.startswith("reject:"))
 async def handle_approval(callback: CallbackQuery):
@@ -864,6 +1322,35 @@ async def whitelist_bayan(message: Message):
 			# Логируем, но не падаем, если не удалось удалить
 			logging.warning(f"Не удалось удалить команду /bw от {message.from_user.id} в чате {message.chat.id}: {e}")
 
+# Удаление сообщения админом
+@dp.message(Command("del"))
+async def delete_message_cmd(message: Message):
+	"""
+	Удаляет сообщение, на которое ответил админ, из чата и из истории для сводок.
+	"""
+	try:
+		if message.from_user.id not in await get_admins(message.chat.id):
+			await del_msg_delay(await message.reply("Эта команда доступна только администраторам."))
+			return
+
+		if not message.reply_to_message:
+			await del_msg_delay(await message.reply("Нужно ответить на сообщение, которое требуется удалить."))
+			return
+
+		target_id = message.reply_to_message.message_id
+		try:
+			await message.reply_to_message.delete()
+		except TelegramBadRequest as e:
+			if "message to delete not found" not in str(e).lower():
+				raise
+		await history.delete(message.chat.id, target_id)
+		logging.info(f"Сообщение {target_id} удалено админом {message.from_user.id} в чате {message.chat.id}.")
+	finally:
+		try:
+			await message.delete()  # Удаляем команду в любом случае
+		except Exception as e:
+			logging.warning(f"Не удалось удалить команду /del от {message.from_user.id} в чате {message.chat.id}: {e}")
+
 ########## Чекаем баяны ########
 async def get_image_hash(file_id: str) -> str | None:
 	"""Получает dHash изображения по file_id. Возвращает None в случае ошибки."""
@@ -988,6 +1475,7 @@ async def check_bayan(message: Message):
 				# --- Исходное сообщение удалено, обновляем базу ---
 				logging.info(f"Исходный баян (msg_id: {original_message_id}) удален. Обновляем запись в Redis.")
 				await r.hdel(key, saved_hash) # Удаляем старый хеш
+				await history.delete(chat_id, original_message_id) # И само сообщение из истории
 				await r.hset(key, new_hash, json.dumps({'id': message_id})) # Добавляем новый
 				bayan = False # Это уже не баян
 			else:
@@ -1013,17 +1501,14 @@ async def send_fun_mes(message: Message):
 	if tema:
 		contents = f"Придумай короткий и очень смешной анекдот для русской души на тему: {tema}"
 	else:
-		key = f"chat:{message.chat.id}:history"
-		txt = await r.lrange(key, 0, 30)
-		txt = [json.loads(message_json)['text'] for message_json in txt]
-		txt.reverse()
+		txt = [msg['text'] for msg in await history.latest(message.chat.id, 31)]
 		contents = f"Придумай короткий и очень смешной анекдот для русской души по мотивам данной переписки: {txt}"	
 
-	# Генерируем контент асинхронно
-	response = await gclient.aio.models.generate_content(
-		model=GEMINI_MODEL,
+	# Генерируем контент асинхронно (анекдоты - в последнюю очередь)
+	response = await ai_request("joke", llm_scheduler.JOKE, message.chat.id, lambda model: llm.generate(
+		model=model,
 		contents=contents,
-	)
+	))
 	await message.answer(response.text or "Всё плохо")
 	await r.set(key1, 'gemini', ex=300)
 
@@ -1072,6 +1557,101 @@ async def generate_pil_image(top_users, title):
 	output.seek(0)  # Перемещаем указатель в начало
 	return output
 
+def parse_stats_period(period: str) -> list[str] | None:
+	"""
+	Разбирает период /top_u в список корзин статистики (суффиксов ключей count_u_*).
+	Поддерживает all_time, ГГГГ-ММ, ГГГГ-ММ-ДД, Nd (последние N дней) и диапазоны A..B
+	из месяцев или дней. Возвращает None, если формат не распознан.
+	"""
+	if period == 'all_time':
+		return ['all_time']
+	if re.match(r"^\d{4}-\d{2}(-\d{2})?$", period):
+		return [period]
+
+	today = datetime.now().date()
+	days_match = re.match(r"^(\d+)d$", period)
+	if days_match:
+		days = int(days_match.group(1))
+		if not 1 <= days <= DAILY_STATS_KEEP_DAYS:
+			return None
+		return [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days - 1, -1, -1)]
+
+	range_match = re.match(r"^(\d{4}-\d{2}(?:-\d{2})?)\.\.(\d{4}-\d{2}(?:-\d{2})?)$", period)
+	if not range_match or len(range_match.group(1)) != len(range_match.group(2)):
+		return None
+	first, last = range_match.groups()
+	buckets = []
+	try:
+		if len(first) == 7: # Месяцы
+			year, month = map(int, first.split('-'))
+			while f"{year:04d}-{month:02d}" <= last and len(buckets) <= STATS_RANGE_MAX_KEYS:
+				buckets.append(f"{year:04d}-{month:02d}")
+				year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+		else: # Дни
+			day = datetime.strptime(first, "%Y-%m-%d").date()
+			last_day = datetime.strptime(last, "%Y-%m-%d").date()
+			while day <= last_day and len(buckets) <= STATS_RANGE_MAX_KEYS:
+				buckets.append(day.strftime("%Y-%m-%d"))
+				day += timedelta(days=1)
+	except ValueError:
+		return None
+	if not buckets or len(buckets) > STATS_RANGE_MAX_KEYS:
+		return None
+	return buckets
+
+def coarsen_stats_period(period: str) -> str:
+	"""
+	Период из дней старше DAILY_STATS_KEEP_DAYS (их корзины уже свёрнуты в месяцы)
+	заменяет целыми месяцами, которые его покрывают. Остальные периоды не меняются.
+	"""
+	buckets = parse_stats_period(period)
+	if not buckets or not re.match(r"^\d{4}-\d{2}-\d{2}$", buckets[0]):
+		return period
+	cutoff = (datetime.now() - timedelta(days=DAILY_STATS_KEEP_DAYS)).strftime("%Y-%m-%d") # как в rollup_daily_stats
+	if buckets[0] >= cutoff:
+		return period
+	first, last = buckets[0][:7], buckets[-1][:7]
+	return first if first == last else f"{first}..{last}"
+
+async def resolve_stats_key(chat_id: int, suffix: str, period: str) -> str:
+	"""
+	Возвращает ключ ZSET статистики (msg/len/byn) за период.
+	Для диапазона корзины объединяются ZUNIONSTORE в короткоживущий ключ-кеш.
+	"""
+	buckets = parse_stats_period(period) or ['all_time']
+	if len(buckets) == 1:
+		return f"chat:{chat_id}:count_u_{suffix}:{buckets[0]}"
+
+	cache_key = f"chat:{chat_id}:count_u_{suffix}:range:{buckets[0]}..{buckets[-1]}"
+	if not await r.exists(cache_key):
+		async with r.pipeline() as pipe:
+			pipe.zunionstore(cache_key, [f"chat:{chat_id}:count_u_{suffix}:{b}" for b in buckets])
+			pipe.expire(cache_key, STATS_RANGE_CACHE_SECONDS)
+			await pipe.execute()
+	return cache_key
+
+async def rollup_daily_stats():
+	"""
+	Сворачивает дневные корзины статистики старше DAILY_STATS_KEEP_DAYS.
+	Месячные ZSET пишутся при приёме сообщений, поэтому обычно корзины просто удаляются;
+	если месячного ключа нет, он собирается из дней перед удалением.
+	"""
+	cutoff = (datetime.now() - timedelta(days=DAILY_STATS_KEEP_DAYS)).strftime("%Y-%m-%d")
+	old_days = {} # ключ месяца -> список дневных ключей
+	async for key in r.scan_iter("chat:*:count_u_*"):
+		prefix, _, bucket = key.rpartition(':')
+		if re.match(r"^\d{4}-\d{2}-\d{2}$", bucket) and bucket < cutoff:
+			old_days.setdefault(f"{prefix}:{bucket[:7]}", []).append(key)
+
+	for month_key, day_keys in old_days.items():
+		async with r.pipeline() as pipe:
+			if not await r.exists(month_key):
+				pipe.zunionstore(month_key, day_keys)
+			pipe.delete(*day_keys)
+			await pipe.execute()
+	if old_days:
+		logging.info(f"Свёрнуто {sum(len(v) for v in old_days.values())} дневных корзин статистики.")
+
 # вывод топа пользователей
 @dp.message(Command("top_u"))
 async def get_top_users(message: Message, command: CommandObject) -> list:
@@ -1094,7 +1674,9 @@ async def get_top_users(message: Message, command: CommandObject) -> list:
 			count = int(arg)
 		elif arg in ['p', 't']:
 			output_type = arg
-		elif re.match(r"^\d{4}-\d{2}$", arg) or arg == 'all':
+		elif arg == 'all':
+			period = 'all_time'
+		elif parse_stats_period(arg) is not None:
 			period = arg
 
 	# --- 2. Обновленный мануал ---
@@ -1110,15 +1692,25 @@ async def get_top_users(message: Message, command: CommandObject) -> list:
 			"  `b` - по баянам\n"
 			"  `e` - по эффективности (спам-рейтинг)\n"
 			"<b>Число:</b> кол-во юзеров в топе (по умолч. 10)\n"
-			"<b>Период:</b> `ГГГГ-ММ` (напр. `2025-07`) или `all` (за всё время, по умолч.)\n"
+			"<b>Период:</b> `ГГГГ-ММ` (напр. `2025-07`), `ГГГГ-ММ-ДД`, `7d` (последние N дней), "
+			"диапазон `2025-01..2025-03` или `2025-07-01..2025-07-15`, `all` (за всё время, по умолч.). "
+			f"Дни хранятся {DAILY_STATS_KEEP_DAYS} дней, более старые - только целыми месяцами\n"
 			"<b>Вывод:</b> `t` - текст (по умолч.), `p` - картинка\n\n"
 			"<b>Примеры:</b>\n"
 			"`/top_u m 5` - топ-5 по сообщениям за всё время\n"
-			"`/top_u e 10 p 2024-06` - спам-топ за июнь картинкой"
+			"`/top_u e 10 p 2024-06` - спам-топ за июнь картинкой\n"
+			"`/top_u m 10 7d` - топ-10 по сообщениям за неделю"
 		)
 		await message.answer(manual, parse_mode='HTML')
 		return
 
+	# Дневных корзин за этот период уже нет - считаем по месяцам и предупреждаем
+	month_period = coarsen_stats_period(period)
+	if month_period != period:
+		await message.answer(f"Статистика по дням хранится {DAILY_STATS_KEEP_DAYS} дней, "
+							 f"поэтому вместо {period} показаны целые месяцы {month_period}.")
+		period = month_period
+
 	# --- 3. Динамическое формирование ключей и заголовков ---
 	period_str = "всё время" if period == 'all_time' else f"период {period}"
 	
@@ -1140,21 +1732,16 @@ async def get_top_users(message: Message, command: CommandObject) -> list:
 	# --- 4. Логика получения данных ---
 	if stat_type in ['m', 'c', 'b']:
 		redis_key_suffix = type_map[stat_type]
-		key = f"chat:{chat_id}:count_u_{redis_key_suffix}:{period}"
+		key = await resolve_stats_key(chat_id, redis_key_suffix, period)
 		
 		top_users_raw = await r.zrevrange(key, 0, count - 1, withscores=True)
+		names = await get_display_names(chat_id, [user_id for user_id, _ in top_users_raw])
 		for user_id_bytes, score in top_users_raw:
-			score = int(score)
-			try:
-				member = await bot.get_chat_member(chat_id, int(user_id_bytes))
-				name = member.user.full_name or "No_Name"
-			except Exception:
-				name = f"ID:{user_id_bytes}" # Пользователь мог покинуть чат
-			result.append((user_id_bytes, score, name))
+			result.append((user_id_bytes, int(score), names[int(user_id_bytes)]))
 
 	elif stat_type == 'e':
-		key_msg = f"chat:{chat_id}:count_u_msg:{period}"
-		key_len = f"chat:{chat_id}:count_u_len:{period}"
+		key_msg = await resolve_stats_key(chat_id, 'msg', period)
+		key_len = await resolve_stats_key(chat_id, 'len', period)
 		
 		user_msg_counts = await r.zrange(key_msg, 0, -1, withscores=True)
 		efficiency_list = []
@@ -1172,13 +1759,9 @@ async def get_top_users(message: Message, command: CommandObject) -> list:
 		efficiency_list.sort(key=lambda x: x[1]) # Сортируем по возрастанию
 		top_efficiency = efficiency_list[:count]
 
+		names = await get_display_names(chat_id, [user_id for user_id, _ in top_efficiency])
 		for user_id, efficiency_score, in top_efficiency:
-			try:
-				member = await bot.get_chat_member(chat_id, int(user_id))
-				name = member.user.full_name or "No_Name"
-			except Exception:
-				name = f"ID:{user_id}"
-			result.append((user_id, efficiency_score, name))
+			result.append((user_id, efficiency_score, names[int(user_id)]))
 
 	if not result:
 		await message.answer(f"Нет данных для статистики за `{period}`. Возможно, в этот период не было активности.")
@@ -1206,6 +1789,26 @@ async def get_top_users(message: Message, command: CommandObject) -> list:
 		
 	
 
+async def get_display_names(chat_id: int, user_ids: list) -> dict[int, str]:
+	"""
+	Имена пользователей из справочника чата одним запросом.
+	В Telegram API идём только за теми, кого в справочнике нет (и дописываем их туда).
+	"""
+	users = await user_directory.lookup(r, chat_id, user_ids)
+	names = {}
+	for user_id in map(int, user_ids):
+		info = users.get(user_id)
+		if info and info.get('full_name'):
+			names[user_id] = info['full_name']
+			continue
+		try:
+			member = await bot.get_chat_member(chat_id, user_id)
+			names[user_id] = member.user.full_name or "No_Name"
+			await user_directory.remember(r, chat_id, user_id, member.user.username, member.user.full_name)
+		except Exception:
+			names[user_id] = f"ID:{user_id}" # Пользователь мог покинуть чат
+	return names
+
 def humanize_value_for_chars(num: int) -> str: # Переименовано
 	"""Преобразует количество символов в человекочитаемый формат."""
 	if num >= 1000000:
@@ -1253,13 +1856,42 @@ def _detect_preescaped(text: str) -> bool: # Эта функция не испо
 # Для разбивки текста на части по лимиту Telegram
 # на будущие
 TG_MAX_LENGTH = 4096
+def truncate_markdown_v2(text: str, max_len: int) -> str:
+    """
+    Обрезает текст MarkdownV2 до max_len по границе абзаца, иначе строки.
+    markdown_to_tg_v2 размечает построчно, поэтому целые строки не ломают разметку и ссылки.
+    """
+    if len(text) <= max_len:
+        return text
+    head = text[:max_len]
+    cut = head.rfind("\n\n")
+    if cut <= 0:
+        cut = head.rfind("\n")
+    return head[:cut].rstrip() if cut > 0 else ""
+
+
+def _split_long_line(line: str, max_len: int) -> list[str]:
+    """Режет строку длиннее max_len по пробелам (иначе по лимиту), не отрывая '\\' экранирования от символа."""
+    pieces = []
+    while len(line) > max_len:
+        cut = line.rfind(" ", 0, max_len)
+        if cut <= 0:
+            cut = max_len
+        while cut > 1 and line[cut - 1] == "\\":
+            cut -= 1
+        pieces.append(line[:cut])
+        line = line[cut:]
+    pieces.append(line)
+    return pieces
+
+
 def _split_tg_message(text: str, max_len: int = TG_MAX_LENGTH) -> list[str]:
-    """Разбивает текст по лимиту Telegram (4096 символов)."""
+    """Разбивает текст по лимиту Telegram (4096 символов): по строкам, а слишком длинные строки - по словам."""
     if len(text) <= max_len:
         return [text]
     parts, current = [], ""
-    for line in text.splitlines(keepends=True):
-        if len(current) + len(line) > max_len:
+    for line in (piece for line in text.splitlines(keepends=True) for piece in _split_long_line(line, max_len)):
+        if len(current) + len(line) > max_len and current:
             parts.append(current.strip())
             current = line
         else:
@@ -1369,8 +2001,35 @@ def get_user_markdown_link(user_or_chat: types.User | types.Chat | None = None,
 
 
 
+async def get_directory_user_link(chat_id: int, user_id: int) -> str:
+    """Markdown-ссылка на пользователя по справочнику чата, без запроса в Telegram, если он там есть."""
+    info = (await user_directory.lookup(r, chat_id, [user_id])).get(user_id)
+    if info and info.get('full_name'):
+        return get_user_markdown_link(user_id=user_id, full_name=info['full_name'])
+    return get_user_markdown_link(await bot.get_chat(user_id))
+
+
 ############# Вход и выход из чата ##########
-async def kick_msg(Kto: str, Kogo: str, chel: bool) -> str:
+# Шаблоны фраз о бане для пула kick_phrases: по одному на строку, с {KTO} и {KOGO}
+async def generate_kick_templates(context: str, gender: str, count: int, chat_id: int | None = None) -> list[str]:
+    who = "бездушный бот-охранник" if context == "bot" else "могущественный админ"
+    verbs = "женского рода (\"выставила\", \"указала\")" if gender == "f" else "мужского рода (\"выставил\", \"указал\")"
+    prompt = f"""
+**Задача:** Придумай {count} разных коротких (до 25 слов) язвительных сообщений для Telegram-чата о том, что {who} выгнал пользователя. Укрась смайлами.
+
+**Правила:**
+1. Вместо имён - плейсхолдеры: `{{KTO}}` - тот, кто выгнал, `{{KOGO}}` - кого выгнали. Каждый ровно один раз в сообщении.
+2. Имена подставятся без склонения, поэтому оба плейсхолдера - только в именительном падеже (как подлежащее или обращение): "{{KOGO}}, на выход! {{KTO}} ..." или "{{KOGO}} - минус один в чате, {{KTO}} ..." - можно, "{{KTO}} выгнал {{KOGO}}" - нельзя.
+3. Глаголы, относящиеся к `{{KTO}}`, - {verbs}. О `{{KOGO}}` пиши без глаголов прошедшего времени, чтобы не ошибиться с родом.
+4. Обычный текст без Markdown и экранирования, по одному сообщению на строку, без нумерации."""
+    response = await ai_request("kick_pool", llm_scheduler.JOKE, chat_id, lambda model: llm.generate(
+        model=model,
+        contents=prompt,
+    ))
+    return kick_pool.parse_templates(response.text)
+
+
+async def kick_msg(Kto: str, Kogo: str, chel: bool, chat_id: int | None = None) -> str:
     # Извлекаем чистые имена из Markdown-ссылок для передачи в AI
     kto_name_match = re.search(r"\s*\[(.*?)\]", Kto)
     kogo_name_match = re.search(r"\s*\[(.*?)\]", Kogo)
@@ -1378,9 +2037,17 @@ async def kick_msg(Kto: str, Kogo: str, chel: bool) -> str:
     kto_name = kto_name_match.group(1) if kto_name_match else Kto
     kogo_name = kogo_name_match.group(1) if kogo_name_match else Kogo
 
+    # Сначала - готовая фраза из пула, живой запрос к AI - только если пул пуст
     try:
-        response = await gclient.aio.models.generate_content(
-        model=GEMINI_MODEL,
+        template = await kick_phrases.take("bot" if chel else "admin", kick_pool.guess_gender(kto_name), chat_id)
+        if template:
+            return kick_pool.render(template, Kto, Kogo)
+    except Exception as e:
+        logging.error(f"Kick phrase pool error: {e}")
+
+    try:
+        response = await ai_request("kick", llm_scheduler.KICK, chat_id, lambda model: llm.generate(
+        model=model,
         contents=f"""
 **Задача:** Сгенерируй ОДНО короткое (до 25 слов) и язвительное сообщение о том, что пользователь '{kogo_name}' был кикнут пользователем '{kto_name}'. И преукрась смайлами.
 
@@ -1405,7 +2072,7 @@ async def kick_msg(Kto: str, Kogo: str, chel: bool) -> str:
 *   Входные: Kto: 'dv_pod', Kogo: 'новичок' -> Ответ: "dv_pod решил, что новичок здесь явно лишний\\!"
 *   Входные: Kto: 'Нейросеть', Kogo: 'Спамер' -> Ответ: "Нейросеть сочла Спамера цифровым мусором и стерла его\\."
 """,
-        )
+        ))
         # Получаем сгенерированный текст
         generated_text = response.text.strip()
 
@@ -1477,6 +2144,9 @@ async def off_member(event: ChatMemberUpdated):
             logging.info(f"Удалено {len(keys_to_delete)} ключей из Redis для чата {chat_id}.")
         else:
             logging.info(f"Не найдено ключей для удаления для чата {chat_id}.")
+        await verification_cache.drop_chat(chat_id)
+        if history_archive:
+            await asyncio.to_thread(history_archive.drop, chat_id)
         return # Завершаем обработку, т.к. бот больше не в чате
 
     member = event.new_chat_member.user
@@ -1514,7 +2184,7 @@ async def off_member(event: ChatMemberUpdated):
         admin_user_link = get_user_markdown_link(event.from_user)
         
         # Генерируем и отправляем сообщение о бане (для ручных банов админами)
-        kick_message_text = await kick_msg(admin_user_link, kicked_user_link, event.from_user.is_bot)
+        kick_message_text = await kick_msg(admin_user_link, kicked_user_link, event.from_user.is_bot, event.chat.id)
         try:
             await event.answer(kick_message_text, parse_mode="MarkdownV2", disable_web_page_preview=True)
         except TelegramBadRequest as e:
@@ -1537,6 +2207,7 @@ async def new_member(event: ChatMemberUpdated):
     chat_Ti = event.chat.title
     user_id = new_member.id    
     logging.info(f"Вход! Новенького в чате {chat_Ti} - {new_member.full_name} ({user_id})")
+    await user_directory.remember(r, chat_id, user_id, new_member.username, new_member.full_name)
 
     if not new_member.is_bot:
         # --- НОВАЯ ЛОГИКА: Регистрация пользователя в списке ожидания ---
@@ -1623,6 +2294,7 @@ async def new_member(event: ChatMemberUpdated):
             "ban_id": None
         }
         await r.hset(f"chat:{chat_id}:new_user_join", new_member.id, json.dumps(check_data))
+        await verification_cache.add(chat_id, new_member.id)
         # Вся логика напоминания и бана теперь только в check_new_members
 
     else:
@@ -1640,22 +2312,39 @@ async def new_member(event: ChatMemberUpdated):
             parse_mode="MarkdownV2"
         )
         
-async def generate_image_description(image: Image.Image) -> bool | None:
+async def generate_image_description(image_bytes: bytes, chat_id: int | None = None) -> bool | None:
     """
     Определяет, есть ли на картинке велосипед.
     Возвращает True, если есть, False, если нет, и None в случае ошибки или нечеткого ответа.
+    Картинка уменьшается перед отправкой, вердикт запоминается по pHash - повторы решаются без AI.
     """
     try:
+        jpeg, phash = image_verdicts.prepare(image_bytes)
+        try:
+            verdict = await image_verdicts.get(r, phash)
+            if verdict is not None:
+                return verdict
+        except Exception as e:
+            logging.error(f"Redis error in generate_image_description (verdict cache): {e}")
+
         # Формируем запрос (можно кастомизировать)
         prompt = "На этой картинке есть велосипед? Ответь одним словом: True или False."
+        image = gtypes.Part.from_bytes(data=jpeg, mime_type="image/jpeg")
 
-        # Генерируем контент асинхронно
-        response = await gclient.aio.models.generate_content(
-            model=GEMINI_MODEL,
+        # Генерируем контент асинхронно (проверка новичков - вне очереди остальных запросов)
+        response = await ai_request("verification", llm_scheduler.VERIFICATION, chat_id, lambda model: llm.generate(
+            model=model,
             contents=[image, prompt]
-        )
+        ))
         response_text = response.text.strip().lower()
-        return response_text == 'true' if response_text in ['true', 'false'] else None
+        if response_text not in ['true', 'false']:
+            return None
+        verdict = response_text == 'true'
+        try:
+            await image_verdicts.put(r, phash, verdict)
+        except Exception as e:
+            logging.error(f"Redis error in generate_image_description (verdict cache): {e}")
+        return verdict
     except Exception as e:
         logging.error(f"Error in generate_image_description: {e}", exc_info=True)
         return None
@@ -1704,6 +2393,7 @@ async def cleanup_verification_data(chat_id: int, user_id: int):
 
         # Сначала удаляем запись из Redis, чтобы предотвратить повторные попытки
         await r.hdel(key, user_id)
+        await verification_cache.remove(chat_id, user_id)
         logging.info(f"Запись для пользователя {user_id} удалена из Redis.")
 
         data = json.loads(data_str)
@@ -1766,7 +2456,7 @@ async def check_new_members():
                     bot_link = get_user_markdown_link(bot_user)
                     # Создаем "утиный" объект пользователя (duck-typing) для передачи в get_user_markdown_link
                     kicked_user_link = get_user_markdown_link(user_id=int(user_id), full_name=user_nm)
-                    kick_message_text = await kick_msg(bot_link, kicked_user_link, True)
+                    kick_message_text = await kick_msg(bot_link, kicked_user_link, True, int(chat_id))
 
                     try:
                         ban_msg = await bot.send_message(
@@ -1800,6 +2490,9 @@ async def check_new_members():
                     if keys_to_delete:
                         await r.delete(*keys_to_delete)
                         logging.info(f"Удалено {len(keys_to_delete)} ключей из Redis для чата {chat_id}.")
+                    await verification_cache.drop_chat(int(chat_id))
+                    if history_archive:
+                        await asyncio.to_thread(history_archive.drop, chat_id)
                     break # Прерываем цикл по пользователям этого чата и переходим к следующему ключу чата
                 else:
                     logging.error(f"Telegram bad request error for user {user_id} in chat {chat_id}: {e}", exc_info=True)
@@ -1850,10 +2543,9 @@ async def _handle_verification_message(message: Message) -> bool:
     chat = message.chat
     chat_id = chat.id
     user_id = message.from_user.id
-    key_u_j = f"chat:{chat_id}:new_user_join"
-
     # --- БЛОК 1: Обработка сообщений от пользователей, проходящих верификацию ---
-    is_user_under_verification = await r.hexists(key_u_j, user_id)
+    # Без запроса к Redis: кеш в памяти, синхронизируется через pub/sub
+    is_user_under_verification = await verification_cache.is_pending(chat_id, user_id)
 
     if is_user_under_verification:
         # ПРАВИЛО 1: Пересланное фото от нового юзера -> немедленный бан.
@@ -1876,17 +2568,15 @@ async def _handle_verification_message(message: Message) -> bool:
                 if message.photo:
                     # Это правильный сценарий, обрабатываем фото.
                     try:
-                        file = await bot.get_file(message.photo[1].file_id)
+                        file = await bot.get_file(message.photo[min(1, len(message.photo) - 1)].file_id)
                         image_bytes = (await bot.download_file(file.file_path)).read()
-                        image = Image.open(BytesIO(image_bytes))
-                        description = await generate_image_description(image)
+                        description = await generate_image_description(image_bytes, chat_id)
 
                         if description is True:
                             member_status = await bot.get_chat_member(chat_id, user_id)
                             if member_status.status not in ("left", "kicked", "banned"):
                                 await user_lock_unlock(user_id, chat_id, st="unlock")
-                                user_obj = await bot.get_chat(chat_id=user_id)
-                                FNAME = get_user_markdown_link(user_obj) # get_user_markdown_link уже экранирует
+                                FNAME = get_user_markdown_link(message.from_user) # get_user_markdown_link уже экранирует
                                 hell_msg = (await r.get(f"chat:{chat_id}:Hello_msg") or f"Поприветствуйте {FNAME}, нового участника! 👋\n").replace('FNAME', FNAME)
                                 await message.answer(hell_msg, parse_mode="MarkdownV2", disable_web_page_preview=True)
                                 await cleanup_verification_data(chat_id, user_id)
@@ -1931,7 +2621,7 @@ async def _handle_verification_message(message: Message) -> bool:
             return True
 
         # Проверяем, что проверка ещё активна
-        if not await r.hexists(key_u_j, verified_user_id):
+        if not await r.hexists(f"chat:{chat_id}:new_user_join", verified_user_id):
             await del_msg_delay(await message.reply("Уже всё, поздно 😏"))
             return True # Сообщение обработано
 
@@ -1943,8 +2633,7 @@ async def _handle_verification_message(message: Message) -> bool:
         text_lower = message.text.lower()
         if "принят" in text_lower:
             await user_lock_unlock(verified_user_id, chat_id, st="unlock")
-            user_obj = await bot.get_chat(chat_id=verified_user_id)
-            FNAME = get_user_markdown_link(user_obj) # get_user_markdown_link уже экранирует
+            FNAME = await get_directory_user_link(chat_id, verified_user_id) # уже экранировано
             hell_msg = (await r.get(f"chat:{chat_id}:Hello_msg") or f"Поприветствуйте {FNAME}, нового участника! 👋\n").replace('FNAME', FNAME)
             await message.answer(hell_msg, parse_mode="MarkdownV2", disable_web_page_preview=True)
             await cleanup_verification_data(chat_id, verified_user_id)
@@ -1953,10 +2642,9 @@ async def _handle_verification_message(message: Message) -> bool:
             reason = f"команда 'бан' от администратора {message.from_user.full_name}"
             await apply_progressive_ban(chat_id, verified_user_id, reason)
             try:
-                banned_user_obj = await bot.get_chat(verified_user_id)
-                banned_user_link = get_user_markdown_link(banned_user_obj)
+                banned_user_link = await get_directory_user_link(chat_id, verified_user_id)
                 admin_user_link = get_user_markdown_link(message.from_user)
-                kick_message_text = await kick_msg(admin_user_link, banned_user_link, False)
+                kick_message_text = await kick_msg(admin_user_link, banned_user_link, False, chat_id)
                 
                 try:
                     ban_msg = await bot.send_message(chat_id, kick_message_text, parse_mode="MarkdownV2", disable_web_page_preview=True)
@@ -1984,34 +2672,19 @@ async def _handle_verification_message(message: Message) -> bool:
 
     return False # Это обычное сообщение, не связанное с верификацией
 
-# Слушать сообщения чата
-@dp.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}), ~F.text.startswith('/')) # Игнорируем команды
-async def save_group_message(message: Message):
-    # --- 1. Обработка верификации и спама от новых пользователей ---
-    if await _handle_verification_message(message):
-        return # Если сообщение было частью верификации, прекращаем обработку
-
-    # --- 2. Обработка обычных сообщений ---
-    logging.debug(f"Processing regular message in chat {message.chat.id}")
+def _build_message_data(message: Message) -> dict | None:
+    """
+    Собирает запись истории из сообщения (id, ответ, автор, текст с пометками медиа/пересылки).
+    Возвращает None, если в сообщении нет текста или подписи.
+    """
     user = message.from_user
-    chat = message.chat
-    chat_nm = chat.title
-    user_name = user.username or "None"
-    full_name = user.full_name or "БезыНя-шка"
     message_data = {}
     mtext = ''
 
-    # База баянов
-    bayan = False
-    if message.photo or message.video:
-        bayan = await check_bayan(message)
-
-    # --- 3. Сборка данных для сохранения ---
     message_data['id'] = message.message_id
     if message.reply_to_message:  # Добавлена проверка на None
         message_data['reply_to'] = message.reply_to_message.message_id
-    message_data['user_name'] = user_name
-    message_data['full_name'] = full_name
+    message_data['user_id'] = user.id # Имена хранятся в справочнике чата (user_directory)
 
     if message.forward_from_chat:
         mtext = f"Переслано от {message.forward_from_chat.title}\n"	
@@ -2031,40 +2704,58 @@ async def save_group_message(message: Message):
                 
         message_data['text'] = mtext + message.caption	
     else:
+        return None
+    return message_data
+
+
+# Слушать сообщения чата
+@dp.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}), ~F.text.startswith('/')) # Игнорируем команды
+async def save_group_message(message: Message):
+    # --- 1. Обработка верификации и спама от новых пользователей ---
+    if await _handle_verification_message(message):
+        return # Если сообщение было частью верификации, прекращаем обработку
+
+    # --- 2. Обработка обычных сообщений ---
+    logging.debug(f"Processing regular message in chat {message.chat.id}")
+    user = message.from_user
+    chat = message.chat
+    chat_nm = chat.title
+
+    # База баянов
+    bayan = False
+    if message.photo or message.video:
+        bayan = await check_bayan(message)
+
+    # --- 3. Сборка данных для сохранения ---
+    message_data = _build_message_data(message)
+    if not message_data:
         return
+    await user_directory.remember(r, chat.id, user.id, user.username, user.full_name or "БезыНя-шка")
     
     # --- 4. Обновление статистики и сохранение в Redis ---
     # Получаем текущий месяц в формате YYYY-MM
-    current_period = datetime.now().strftime("%Y-%m")
+    now = datetime.now()
+    current_period = now.strftime("%Y-%m")
+    current_day = now.strftime("%Y-%m-%d")
     
-    # Ключи для статистики
-    # Общие
-    key_msg_all = f"chat:{chat.id}:count_u_msg:all_time"
-    key_len_all = f"chat:{chat.id}:count_u_len:all_time"
-    key_byn_all = f"chat:{chat.id}:count_u_byn:all_time"
-    # За текущий месяц
-    key_msg_month = f"chat:{chat.id}:count_u_msg:{current_period}"
-    key_len_month = f"chat:{chat.id}:count_u_len:{current_period}"
-    key_byn_month = f"chat:{chat.id}:count_u_byn:{current_period}"
-
-    async with r.pipeline() as pipe:
-        # Обновляем общую статистику
-        pipe.zincrby(key_msg_all, 1, user.id)
-        pipe.zincrby(key_len_all, len(message_data['text']), user.id)
+    # Инкременты статистики (ключ, пользователь, прибавка): за всё время, месяц и день
+    increments = []
+    for period in ("all_time", current_period, current_day):
+        increments.append((f"chat:{chat.id}:count_u_msg:{period}", user.id, 1))
+        increments.append((f"chat:{chat.id}:count_u_len:{period}", user.id, len(message_data['text'])))
         if bayan:
-            pipe.zincrby(key_byn_all, 1, user.id)
+            increments.append((f"chat:{chat.id}:count_u_byn:{period}", user.id, 1))
 
-        # Обновляем статистику за текущий месяц
-        pipe.zincrby(key_msg_month, 1, user.id)
-        pipe.zincrby(key_len_month, len(message_data['text']), user.id)
-        if bayan:
-            pipe.zincrby(key_byn_month, 1, user.id)
-        
-        # Сохранение сообщения в историю
-        pipe.lpush(f"chat:{chat.id}:history", json.dumps(message_data))
-        pipe.ltrim(f"chat:{chat.id}:history", 0, MAX_HISTORY - 1)
-        
-        await pipe.execute()
+    if write_buffer:
+        # Отложенная запись: сообщения за несколько мс уйдут одним pipeline
+        write_buffer.add(chat.id, message_data, increments)
+    else:
+        async with r.pipeline() as pipe:
+            for key, member, amount in increments:
+                pipe.zincrby(key, amount, member)
+            # Сохранение сообщения в историю
+            history.add_message(pipe, chat.id, message_data, HISTORY_TRIM_LIMIT)
+            await pipe.execute()
 
     logging.debug(f"Message {message.message_id} saved and stats updated for period {current_period} in {chat_nm}")
 
@@ -2072,24 +2763,19 @@ async def save_group_message(message: Message):
 async def handle_edited_message(message: Message):
     """Обрабатывает отредактированные сообщения и обновляет их в истории Redis."""
     chat_id, message_id = message.chat.id, message.message_id
-    key = f"chat:{chat_id}:history"
     logging.info(f"Attempting to update edited message {message_id} in chat {chat_id}")
 
-    history_json = await r.lrange(key, 0, EDIT_SEARCH_DEPTH - 1)
-    for i, msg_json in enumerate(history_json):
-        try:
-            msg_data = json.loads(msg_json)
-            if msg_data.get('id') == message_id:
-                new_text = message.text or message.caption
-                if not new_text: return
+    # Запись собирается заново из отредактированного сообщения и заменяет старую по ID,
+    # только если сообщение уже есть в истории (на любой глубине)
+    message_data = _build_message_data(message)
+    if not message_data: return
 
-                msg_data['text'] = new_text
-                
-                await r.lset(key, i, json.dumps(msg_data))
-                logging.info(f"Message {message_id} updated in history at index {i}.")
-                return
-        except (json.JSONDecodeError, TypeError): continue
-    logging.warning(f"Edited message {message_id} not found in history for update.")
+    if write_buffer and write_buffer.update_pending(chat_id, message_data):
+        logging.info(f"Message {message_id} updated in write buffer.")
+    elif await history.replace(chat_id, message_data):
+        logging.info(f"Message {message_id} updated in history.")
+    else:
+        logging.warning(f"Edited message {message_id} not found in history for update.")
 
 async def set_main_menu(bot: Bot):
     """
@@ -2103,6 +2789,7 @@ async def set_main_menu(bot: Bot):
         # BotCommand(command="анекдот", description="😂 Рассказать анекдот"),
         # BotCommand(command="/right", description="🔒 Проверить права (бота или юзера)"),
         BotCommand(command="del", description="🗑️ (Админ) Удалить сообщение"),
+        BotCommand(command="digest", description="🗓️ (Админ) Ежедневный дайджест: /digest 21:00"),
         BotCommand(command="run_info", description="ℹ️ Время запуска бота"),
         BotCommand(command="hello_m", description="✍️ (Админ) Установить приветствие")
     ]
@@ -2111,10 +2798,33 @@ async def set_main_menu(bot: Bot):
     await bot.set_my_commands(main_menu_commands)
 
 
+async def spill_history():
+    """Фоновая выгрузка истории сверх MAX_HISTORY из Redis в дисковый архив."""
+    try:
+        spilled = await history.spill_to_archive(history_archive, MAX_HISTORY)
+        if spilled:
+            logging.info(f"Выгружено в архив {spilled} сообщений.")
+    except Exception as e:
+        logging.error(f"Ошибка выгрузки истории в архив: {e}", exc_info=True)
+
+async def refill_kick_phrases():
+    try:
+        await kick_phrases.refill()
+    except Exception as e:
+        logging.error(f"Ошибка пополнения пула фраз о бане: {e}", exc_info=True)
+
 # Настройка планировщика
 def setup_scheduler():
     scheduler = AsyncIOScheduler()
     scheduler.add_job(check_new_members, 'interval', minutes=1) 
+    scheduler.add_job(rollup_daily_stats, 'cron', hour=4, minute=0) # Дневная статистика -> месяцы
+    scheduler.add_job(run_digests, 'interval', minutes=1, max_instances=1) # Дайджесты по расписанию чатов
+    scheduler.add_job(refill_kick_phrases, 'interval', minutes=10, max_instances=1,
+                      next_run_time=datetime.now() + timedelta(seconds=30)) # Пул фраз о бане (первый раз - после init_redis)
+    if history_archive:
+        scheduler.add_job(spill_history, 'interval', minutes=HISTORY_SPILL_MINUTES)
+    if SUMMARY_CHUNKS:
+        scheduler.add_job(summarize_chunks, 'interval', minutes=SUMMARY_CHUNKS_MINUTES, max_instances=1)
     scheduler.start()
 
 
@@ -2123,8 +2833,16 @@ async def main():
     print("✅ Бот запущен!")
     setup_scheduler() # Настройка планировщика
     await init_redis() # Инициализация Redis
+    await history_store.migrate_lists(rb) # Перевод старых историй (LIST) в sorted set
+    asyncio.create_task(verification_cache.listen()) # Подписка на изменения списка проверяемых
+    for worker_id in range(SUMMARY_WORKERS):
+        asyncio.create_task(summary_jobs.run(worker_id)) # Воркеры очереди сводок
     await set_main_menu(bot) # Устанавливаем меню команд
-    await dp.start_polling(bot) # Обработка сообщений TG
+    try:
+        await dp.start_polling(bot) # Обработка сообщений TG (SIGTERM/SIGINT завершают polling)
+    finally:
+        if write_buffer:
+            await write_buffer.close(WRITE_BUFFER_CLOSE_TIMEOUT) # Дописываем буфер перед выходом
 
 if __name__ == "__main__":
     asyncio.run(main())
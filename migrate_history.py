@@ -0,0 +1,38 @@
+#-------------------------------------------------------------------------------
+# Перенос истории чатов между бэкендами Redis (sorted set <-> Redis Streams)
+# Запуск: python migrate_history.py zset stream
+# Бота лучше остановить на время переноса, после - выставить HISTORY_BACKEND в .env
+#-------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import sys
+from os import getenv
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+import history_store
+
+load_dotenv()
+REDIS_HOST = getenv("REDIS_HOST", "127.0.0.1")
+REDIS_PORT = int(getenv("REDIS_PORT", 6379))
+
+
+async def main():
+    if len(sys.argv) != 3 or sys.argv[1] == sys.argv[2]:
+        print(f"Использование: python migrate_history.py <из> <в>, бэкенды: {', '.join(history_store.BACKENDS)}")
+        sys.exit(1)
+
+    rb = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
+    source = history_store.create(sys.argv[1], rb)
+    target = history_store.create(sys.argv[2], rb)
+    await history_store.migrate_lists(rb)  # совсем старые LIST-истории сначала в sorted set
+    migrated = await history_store.migrate_backend(source, target)
+    print(f"Перенесено чатов: {migrated}. Укажите HISTORY_BACKEND={target.name} в .env")
+    await rb.aclose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Постепенная доставка длинного ответа AI: заглушка, которая дописывается по мере генерации.
+
+Сообщение-заглушка отправляется сразу, затем редактируется не чаще EDIT_INTERVAL
+секунд (лимиты Telegram на правки в группах). В правку идут только целые строки
+уже полученного текста - незакрытая разметка в обрывке строки не ломает MarkdownV2.
+Если промежуточная правка не прошла, ничего страшного: следующая или финальная
+покажет текст целиком.
+"""
+
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+
+EDIT_INTERVAL = 3.0  # секунд между правками одного сообщения
+MIN_GROWTH = 80  # не править, пока текст не подрос хотя бы на столько символов
+TG_LIMIT = 4000  # с запасом до 4096 символов Telegram
+
+
+class ProgressiveMessage:
+    def __init__(self, bot, chat_id: int, header: str, render, placeholder: str = "⏳ Готовлю сводку…"):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.header = header  # уже в MarkdownV2
+        self.render = render  # сырой Markdown ответа -> MarkdownV2
+        self.placeholder = placeholder
+        self.message = None
+        self._last_edit = 0.0
+        self._shown = 0  # длина сырого текста в последней правке
+        self.edits = 0
+
+    async def start(self):
+        self.message = await self.bot.send_message(self.chat_id, self.header + self.placeholder,
+                                                   parse_mode="MarkdownV2", disable_web_page_preview=True)
+        self._last_edit = time.monotonic()
+        return self.message
+
+    async def update(self, raw_text: str):
+        """Показать уже сгенерированную часть (вызывается на каждый кусок потока)."""
+        if self.message is None or time.monotonic() - self._last_edit < EDIT_INTERVAL:
+            return
+        complete = raw_text[:raw_text.rfind("\n") + 1]  # только целые строки
+        if len(complete) - self._shown < MIN_GROWTH:
+            return
+        text = self.header + self.render(complete)
+        if len(text) > TG_LIMIT:
+            return  # Длинное всё равно будет сокращено перед финальной правкой
+        self._last_edit = time.monotonic()
+        try:
+            await self.bot.edit_message_text(text + "\n⏳", chat_id=self.chat_id, message_id=self.message.message_id,
+                                             parse_mode="MarkdownV2", disable_web_page_preview=True)
+            self._shown = len(complete)
+            self.edits += 1
+        except TelegramBadRequest as e:
+            logging.debug(f"Промежуточная правка сводки пропущена: {e}")
+
+    async def finish(self, text: str, parse_mode: str | None = "MarkdownV2"):
+        """Финальный текст. Ошибки разметки пробрасываются вызывающему."""
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message.message_id,
+                                             parse_mode=parse_mode, disable_web_page_preview=True)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+        return self.message
+
+    async def fail(self, text: str):
+        """Заменить заглушку сообщением об ошибке."""
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message.message_id)
+        except TelegramBadRequest as e:
+            logging.warning(f"Не удалось заменить заглушку сводки: {e}")
@@ -8,7 +8,6 @@ import json
 import uuid
 from datetime import datetime
 
-import aiohttp
 #import redis
 
 import redis.asyncio as redis  # Изменено
@@ -26,6 +25,10 @@ from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, C
 
 import debugpy
 
+import history_store
+import user_directory
+import llm_backend
+
 # debugpy.listen(('0.0.0.0', 5678))
 
 # print("Waiting for debugger attach")
@@ -48,8 +51,11 @@ load_dotenv()
 ADMIN_ID = int(getenv("ADMIN_ID", 123456))
 TELEGRAM_TOKEN = getenv("TELEGRAM_TOKEN")
 RAPIDAPI_KEY = getenv("RAPIDAPI_KEY")
+LLM_BACKEND = getenv("SUM_ONLY_LLM_BACKEND", "rapidapi")  # rapidapi или stub (llm_stub_server.py)
+LLM_MODEL = "gpt4o"  # для RapidAPI модель задаётся адресом (llm_backend.RAPIDAPI_URL)
 REDIS_HOST = getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(getenv("REDIS_PORT", 6379))
+HISTORY_BACKEND = getenv("HISTORY_BACKEND", "zset")  # zset или stream, как у основного бота
 
 # Конфигурация лимитов
 LIMIT_SECONDS = 5
@@ -67,6 +73,8 @@ SEND_MES_GROUP = 5  # число запросов в 24ч
 VERIFICATION_REM = 1  # час
 BAN_AFTER_HOURS = 20  # часов до бана
 
+llm = llm_backend.create(LLM_BACKEND, rapidapi_key=RAPIDAPI_KEY, stub_url=getenv("LLM_STUB_URL", llm_backend.STUB_URL))
+
 # Инициализация 
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
@@ -75,10 +83,14 @@ dp["started_at"] = datetime.now().strftime("%Y-%m-%d %H:%M")
 
 # Инициализация подключения к Redis
 r = None
+rb = None  # Бинарный клиент для истории (компактный формат)
+history = None  # Хранилище истории (history_store)
 async def init_redis():
-	global r
+	global r, rb, history
 	try:
 		r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)  # Изменено
+		rb = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
+		history = history_store.create(HISTORY_BACKEND, rb)
 		# Проверка соединения
 		await r.ping()
 		logging.info("Connected to Redis successfully")
@@ -300,10 +312,10 @@ async def process_summarize(message: Message, count=0, start=0):
 		return
 
 	try:
-		key = f"chat:{chat_id}:history"
+		key = history.key(chat_id)
 		logging.info(f"Проверка получения последнего сообщения из: {key}")
-		messages = await r.lrange(key, 0, 0)
-		msg_last = json.loads(messages[0])
+		messages = await history.latest(chat_id, 1)
+		msg_last = messages[0]
 		msg_last_id = msg_last['id']
 	except Exception as e:
 		logging.error(f"Redis history error: {e}")
@@ -312,9 +324,7 @@ async def process_summarize(message: Message, count=0, start=0):
 
 	if count != 0:
 		logging.info(f'свой свод c-{count} s-{start}')
-		messages = await r.lrange(key, start, start + count - 1)
-		messages = [json.loads(message_json) for message_json in messages]
-		messages.reverse()
+		messages = await history.latest(chat_id, count, start)
 	else:
 		msg_old_id = await r.hget(f"chat:{chat_id}:last_sum", 'id')
 		last_sum_id = await r.hget(f"chat:{chat_id}:last_sum", 'msg_id')
@@ -330,18 +340,13 @@ async def process_summarize(message: Message, count=0, start=0):
 			await del_msg_delay(await message.answer(f"Новых сообщений не более {count}, прочитайте сами."))
 			return
 
-		messages = await r.lrange(key, 0, count - 1)
-
-		for message_json in messages:
-			msg = json.loads(message_json)            
-			if msg['id'] > msg_old_id:
-				new_messages = [msg] + new_messages
-			else:
-				break
+		new_messages = await history.after(chat_id, msg_old_id, count)
 
 		messages = new_messages
 		count = len(new_messages)
 
+	messages = await user_directory.attach_names(r, chat_id, messages)
+
 	if not messages:
 		await del_msg_delay(await message.answer("Нет сообщений для суммаризации."))
 		return
@@ -456,33 +461,15 @@ async def get_gpt4_summary(text: str, turl: str) -> str:
 
 	await r.lpush('gpt_answ', json.dumps(rtext)) #[Тема: "подставить сюда краткое описание темы"]
 
-	url="https://chatgpt-42.p.rapidapi.com/gpt4o" #gpt4 gpt4o deepseekai
-	headers={
-		"Content-Type": "application/json",
-		"X-RapidAPI-Key": RAPIDAPI_KEY,
-		"X-RapidAPI-Host": "chatgpt-42.p.rapidapi.com"
-	}
-	payload = {
-		"messages": [
-			{
-				"role": "user",
-				"content": rtext
-			}
-		],
-		"web_access": False #deeppic
-		#"model": "gpt-4o-mini"
-	}
-	
-	async with aiohttp.ClientSession() as session:
-		async with session.post(url, headers=headers, json=payload) as response:		
-			if response.status == 200:				
-				data = await response.json()
-				await r.lpush('gpt_resp_h', json.dumps(dict(response.headers)))
-				results = data.get("result", "Не удалось получить суммаризацию")
-				await r.lpush('gpt_recv', json.dumps(results))				
-				return results
-			else:
-				return f"Ошибка API: {response.status}"
+	try:
+		response = await llm.generate(LLM_MODEL, rtext)
+	except llm_backend.LLMBackendError as e:
+		return f"Ошибка API: {e.code}"
+	if getattr(response, 'headers', None):
+		await r.lpush('gpt_resp_h', json.dumps(response.headers))
+	results = response.text or "Не удалось получить суммаризацию"
+	await r.lpush('gpt_recv', json.dumps(results))
+	return results
 			
 
 # Обработка подтверждения/отказа запроса
@@ -533,7 +520,6 @@ async def save_group_message(message: Message, bot: Bot):
 	chat_nm = chat.title
 	user_name = user.username or "БезыНя-шка"
 	full_name = user.full_name or "Unknown User"
-	key = f"chat:{message.chat.id}:history"
 	message_data = {}
 	mtext=''
 
@@ -567,8 +553,7 @@ async def save_group_message(message: Message, bot: Bot):
 # save in db
 	try:
 		async with r.pipeline() as pipe:
-			await pipe.lpush(key, json.dumps(message_data))
-			await pipe.ltrim(key, 0, MAX_HISTORY - 1)
+			history.add_message(pipe, chat.id, message_data, MAX_HISTORY)
 			await pipe.execute()
 	
 		logging.info(f"Message {message.message_id} saved successfully in {chat_nm}")
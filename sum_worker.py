@@ -0,0 +1,22 @@
+#-------------------------------------------------------------------------------
+# Отдельный процесс-воркер сводок: забирает задания /sum из очереди Redis (summary_queue)
+# Запуск: python sum_worker.py [число_воркеров]
+# Можно запустить несколько процессов; бот тогда можно оставить только ставить задания (SUMMARY_WORKERS=0)
+#-------------------------------------------------------------------------------
+
+import asyncio
+import sys
+
+import main
+
+
+async def run(workers: int):
+    await main.init_redis()
+    try:
+        await asyncio.gather(*(main.summary_jobs.run(worker_id) for worker_id in range(workers)))
+    finally:
+        await main.bot.session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 1))
@@ -0,0 +1,33 @@
+"""Бюджет размышлений и целевая длина сводки по размеру окна.
+
+Маленький /sum на 150 сообщений не требует тех же 11000 токенов размышлений,
+что окно в 2000 сообщений. Оба параметра берутся из кривых "токены:значение",
+заданных точками через запятую, например "2000:1024,8000:4096,40000:11000".
+Между точками - линейная интерполяция, за краями - значение крайней точки.
+
+Размер окна - оценка токенов запроса (llm_payload.estimate_tokens), без
+обращения к API.
+"""
+
+THINKING_CURVE = "2000:1024,8000:4096,20000:8192,40000:11000"  # токены окна -> thinking_budget
+LENGTH_CURVE = "2000:1500,8000:2500,20000:3500,40000:3900"  # токены окна -> целевая длина сводки, символов
+
+
+def parse_curve(text: str) -> list[tuple[int, int]]:
+    """'2000:1024,8000:4096' -> [(2000, 1024), (8000, 4096)], точки по возрастанию."""
+    points = []
+    for item in text.split(","):
+        x, y = item.split(":")
+        points.append((int(x), int(y)))
+    if not points:
+        raise ValueError("Пустая кривая")
+    return sorted(points)
+
+
+def interpolate(curve: list[tuple[int, int]], x: float) -> int:
+    if x <= curve[0][0]:
+        return curve[0][1]
+    for (x0, y0), (x1, y1) in zip(curve, curve[1:]):
+        if x <= x1:
+            return int(y0 + (y1 - y0) * (x - x0) / (x1 - x0))
+    return curve[-1][1]
@@ -0,0 +1,67 @@
+"""Кеш готовых сводок по окну сообщений.
+
+Одно и то же окно (чат, первый и последний ID, режим, версия промпта) не отправляется
+в AI повторно: /sum 300 от двух людей подряд или /sum -p сразу после сводки в чате
+берут готовый текст. Записи живут CACHE_TTL секунд, на чат хранится не больше
+CACHE_MAX_ENTRIES (вытесняются самые старые). Режим - способ генерации (single -
+одним запросом, merged - по конспектам фрагментов): одно окно разными способами
+даёт разный текст, а заголовок и ссылку на прошлую сводку вызывающий код
+добавляет сам.
+
+chat:{id}:sum_cache - хеш окно -> сводка (TTL на поле через HEXPIRE, Redis 7.4+),
+chat:{id}:sum_cache:order - sorted set окно -> время записи (для вытеснения),
+sum_cache:stats - счётчики hits/misses по всем чатам.
+"""
+
+import json
+import time
+
+CACHE_TTL = 6 * 3600  # секунд жизни сводки в кеше
+CACHE_MAX_ENTRIES = 20  # сводок на чат
+STATS_KEY = "sum_cache:stats"
+
+# Вытеснение самых старых записей сверх лимита
+_EVICT_LUA = """
+local evicted = redis.call('ZRANGE', KEYS[2], 0, -(tonumber(ARGV[1]) + 1))
+if #evicted > 0 then
+    redis.call('HDEL', KEYS[1], unpack(evicted))
+    redis.call('ZREM', KEYS[2], unpack(evicted))
+end
+return #evicted
+"""
+
+
+def cache_key(chat_id: int | str) -> str:
+    return f"chat:{chat_id}:sum_cache"
+
+
+def _window(first_id: int, last_id: int, mode: str, version: int) -> str:
+    return f"{first_id}:{last_id}:{mode}:v{version}"
+
+
+async def get(r, chat_id: int, first_id: int, last_id: int, mode: str, version: int) -> str | None:
+    """Готовая сводка для окна или None. Считает попадания и промахи."""
+    value = await r.hget(cache_key(chat_id), _window(first_id, last_id, mode, version))
+    await r.hincrby(STATS_KEY, "hits" if value else "misses")
+    return json.loads(value) if value else None
+
+
+async def put(r, chat_id: int, first_id: int, last_id: int, mode: str, version: int, summary: str):
+    """Сохраняет сводку для окна и вытесняет старые записи чата сверх лимита."""
+    key, order_key = cache_key(chat_id), cache_key(chat_id) + ":order"
+    window = _window(first_id, last_id, mode, version)
+    now = time.time()
+    async with r.pipeline() as pipe:
+        pipe.hset(key, window, json.dumps(summary, ensure_ascii=False))
+        pipe.hexpire(key, CACHE_TTL, window)
+        pipe.zadd(order_key, {window: now})
+        pipe.zremrangebyscore(order_key, '-inf', now - CACHE_TTL)  # поля хеша уже истекли сами
+        pipe.expire(order_key, CACHE_TTL)
+        pipe.eval(_EVICT_LUA, 2, key, order_key, CACHE_MAX_ENTRIES)
+        await pipe.execute()
+
+
+async def stats(r) -> tuple[int, int]:
+    """(попадания, промахи) по всем чатам."""
+    values = await r.hmget(STATS_KEY, ["hits", "misses"])
+    return int(values[0] or 0), int(values[1] or 0)
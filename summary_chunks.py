@@ -0,0 +1,66 @@
+"""Готовые конспекты фрагментов истории для быстрой сводки (/sum).
+
+Фоновая задача конспектирует новые сообщения кусками по CHUNK_MESSAGES,
+а /sum объединяет несколько готовых конспектов и хвост ещё не разобранных
+сообщений вместо одного огромного запроса на 2000 сообщений.
+
+Хранение: chat:{id}:sum_chunks - sorted set, score - ID последнего сообщения
+фрагмента, участник - JSON {"first", "last", "count", "text"}.
+"""
+
+import json
+
+from llm_payload import estimate_tokens
+
+CHUNK_MESSAGES = 200  # сообщений в одном фрагменте
+CHUNKS_KEEP = 12  # сколько последних конспектов хранить на чат (покрывает MAX_TO_GPT)
+LINE_OVERHEAD_TOKENS = 7  # id, ответ и код автора в строке llm_payload (~25 символов ASCII)
+
+
+def chunks_key(chat_id: int | str) -> str:
+    return f"chat:{chat_id}:sum_chunks"
+
+
+async def last_id(r, chat_id: int) -> int:
+    """ID последнего законспектированного сообщения (0, если конспектов нет)."""
+    last = await r.zrevrange(chunks_key(chat_id), 0, 0, withscores=True)
+    return int(last[0][1]) if last else 0
+
+
+async def save(r, chat_id: int, messages: list[dict], text: str):
+    """Сохраняет конспект фрагмента и обрезает старые."""
+    chunk = {"first": messages[0]['id'], "last": messages[-1]['id'], "count": len(messages), "text": text}
+    async with r.pipeline() as pipe:
+        pipe.zadd(chunks_key(chat_id), {json.dumps(chunk, ensure_ascii=False): chunk["last"]})
+        pipe.zremrangebyrank(chunks_key(chat_id), 0, -(CHUNKS_KEEP + 1))
+        await pipe.execute()
+
+
+async def load_range(r, chat_id: int, first_id: int, last_id: int) -> list[dict]:
+    """Конспекты фрагментов, целиком лежащих в [first_id, last_id], в хронологическом порядке."""
+    raws = await r.zrangebyscore(chunks_key(chat_id), first_id, last_id)
+    return [chunk for chunk in map(json.loads, raws) if chunk["first"] >= first_id]
+
+
+def split_covered(messages: list[dict], chunks: list[dict]) -> list[dict]:
+    """Сообщения, не попавшие ни в один из конспектов."""
+    return [m for m in messages if not any(c["first"] <= m['id'] <= c["last"] for c in chunks)]
+
+
+def _message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get('text') or '') + LINE_OVERHEAD_TOKENS
+
+
+def split_by_tokens(messages: list[dict], max_tokens: int) -> list[list[dict]]:
+    """Режет сообщения на подряд идущие куски не больше max_tokens (по оценке) каждый."""
+    parts, current, tokens = [], [], 0
+    for msg in messages:
+        size = _message_tokens(msg)
+        if current and tokens + size > max_tokens:
+            parts.append(current)
+            current, tokens = [], 0
+        current.append(msg)
+        tokens += size
+    if current:
+        parts.append(current)
+    return parts
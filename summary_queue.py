@@ -0,0 +1,195 @@
+"""Очередь заданий на сводку: Redis Stream + группа потребителей.
+
+/sum только ставит задание в очередь, а генерация и отправка выполняются
+воркерами (задачами в процессе бота и/или отдельными процессами sum_worker.py).
+Задание, взятое воркером, остаётся в списке ожидающих подтверждения (PEL) до
+ack. Пока воркер работает, он продлевает задание (XCLAIM) и блокировку чата.
+Если воркер упал или процесс перезапустили, задание простаивает дольше
+VISIBILITY_TIMEOUT и его забирает другой воркер (XAUTOCLAIM). Так же
+повторяется задание, обработчик которого выбросил исключение (временные
+ошибки AI и Telegram - RetryJob). После MAX_ATTEMPTS запусков задание
+уходит в DEAD_STREAM.
+
+В каждом чате одновременно выполняется не больше одного задания
+(chat:{id}:sum_running). Задание занятого чата остаётся в PEL и повторяется
+после таймаута, попытка при этом не засчитывается.
+
+sum_jobs - поток заданий (поле job, JSON),
+sum_jobs:attempts - хеш ID задания -> число запусков,
+sum_jobs:dead - задания, исчерпавшие попытки.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+STREAM = "sum_jobs"
+GROUP = "sum_workers"
+ATTEMPTS_KEY = "sum_jobs:attempts"
+DEAD_STREAM = "sum_jobs:dead"
+DEAD_KEEP = 100  # сколько последних неудачных заданий хранить
+VISIBILITY_TIMEOUT = 120  # секунд без продления, после которых задание забирает другой воркер
+HEARTBEAT_INTERVAL = 30  # секунд между продлениями задания и блокировки чата
+MAX_ATTEMPTS = 3
+READ_BLOCK_MS = 5000
+
+# Снять блокировку, только если она наша
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RetryJob(Exception):
+    """Временная ошибка задания: обработчик выбрасывает её, чтобы задание повторилось."""
+
+
+def running_key(chat_id: int | str) -> str:
+    return f"chat:{chat_id}:sum_running"
+
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def enqueue(r, chat_id: int, job: dict) -> str:
+    """Ставит задание в очередь, возвращает его ID."""
+    payload = json.dumps({"chat_id": chat_id, "created": time.time(), **job}, ensure_ascii=False)
+    return await r.xadd(STREAM, {"job": payload})
+
+
+class SummaryQueue:
+    def __init__(self, redis_client, handler, lock_key=None, lock_expiry: int = 300, on_dead=None, consumer: str | None = None):
+        self.r = redis_client  # клиент с decode_responses=True
+        self.handler = handler  # async handler(job: dict)
+        self.lock_key = lock_key  # chat_id -> ключ блокировки /sum, снимается после задания
+        self.lock_expiry = lock_expiry
+        self.on_dead = on_dead  # async on_dead(job: dict), когда попытки исчерпаны
+        self.consumer = consumer or consumer_name()
+
+        # Статистика для логов
+        self.done = 0
+        self.failed = 0
+        self.reclaimed = 0
+
+    async def ensure_group(self):
+        try:
+            await self.r.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self, worker_id: int = 0):
+        """Цикл воркера: сначала зависшие задания, потом новые."""
+        await self.ensure_group()
+        consumer = f"{self.consumer}-{worker_id}"
+        logging.info(f"Воркер сводок {consumer} запущен")
+        while True:
+            try:
+                entries = await self._claim_stale(consumer)
+                if not entries:
+                    started = time.monotonic()
+                    response = await self.r.xreadgroup(GROUP, consumer, {STREAM: ">"}, count=1, block=READ_BLOCK_MS)
+                    entries = response[0][1] if response else []
+                    if not entries and time.monotonic() - started < READ_BLOCK_MS / 2000:
+                        await asyncio.sleep(READ_BLOCK_MS / 1000)  # BLOCK не сработал (fakeredis, прокси) - не крутимся впустую
+                for entry_id, fields in entries:
+                    await self._process(consumer, entry_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка воркера сводок {consumer}: {e}", exc_info=True)
+                await asyncio.sleep(READ_BLOCK_MS / 1000)
+
+    async def _claim_stale(self, consumer: str) -> list:
+        _, entries, *deleted = await self.r.xautoclaim(STREAM, GROUP, consumer, VISIBILITY_TIMEOUT * 1000, "0-0", count=1)
+        if deleted and deleted[0]:  # Запись удалена из потока, а в PEL осталась
+            await self.r.xack(STREAM, GROUP, *deleted[0])
+        if entries:
+            self.reclaimed += 1
+            logging.warning(f"Забрано зависшее задание сводки {entries[0][0]}")
+        return entries
+
+    async def _process(self, consumer: str, entry_id: str, fields: dict | None):
+        if not fields or "job" not in fields:
+            await self._ack(entry_id)
+            return
+        job = json.loads(fields["job"])
+        chat_id = job["chat_id"]
+
+        # Один выполняющийся /sum на чат; чужое задание чата подождёт в PEL
+        if not await self.r.set(running_key(chat_id), entry_id, ex=VISIBILITY_TIMEOUT, nx=True):
+            if await self.r.get(running_key(chat_id)) != entry_id:
+                logging.info(f"Чат {chat_id} занят другим заданием, {entry_id} отложено")
+                return
+
+        attempts = await self.r.hincrby(ATTEMPTS_KEY, entry_id, 1)
+        if attempts > MAX_ATTEMPTS:
+            logging.error(f"Задание сводки {entry_id} для чата {chat_id} исчерпало попытки")
+            await self._dead(entry_id, job)
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(consumer, entry_id, chat_id))
+        try:
+            await self.handler(job)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Задание сводки {entry_id} (попытка {attempts}) упало: {e}", exc_info=not isinstance(e, RetryJob))
+            if attempts >= MAX_ATTEMPTS:
+                await self._dead(entry_id, job)  # Последняя попытка - не ждём таймаута
+                return
+            # Без ack: задание повторится после VISIBILITY_TIMEOUT
+            await self.r.eval(_RELEASE_LUA, 1, running_key(chat_id), entry_id)
+            return
+        finally:
+            heartbeat.cancel()
+        self.done += 1
+        await self._finish(entry_id, chat_id)
+
+    async def _heartbeat(self, consumer: str, entry_id: str, chat_id: int):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.r.xclaim(STREAM, GROUP, consumer, 0, [entry_id], justid=True)  # сброс времени простоя
+                await self.r.expire(running_key(chat_id), VISIBILITY_TIMEOUT)
+                if self.lock_key:
+                    await self.r.expire(self.lock_key(chat_id), self.lock_expiry)
+            except Exception as e:
+                logging.warning(f"Не удалось продлить задание сводки {entry_id}: {e}")
+
+    async def _finish(self, entry_id: str, chat_id: int):
+        await self._ack(entry_id)
+        await self.r.eval(_RELEASE_LUA, 1, running_key(chat_id), entry_id)
+        if self.lock_key:
+            await self.r.delete(self.lock_key(chat_id))
+
+    async def _ack(self, entry_id: str):
+        async with self.r.pipeline() as pipe:
+            pipe.xack(STREAM, GROUP, entry_id)
+            pipe.xdel(STREAM, entry_id)
+            pipe.hdel(ATTEMPTS_KEY, entry_id)
+            await pipe.execute()
+
+    async def _dead(self, entry_id: str, job: dict):
+        await self.r.xadd(DEAD_STREAM, {"job": json.dumps(job, ensure_ascii=False), "id": entry_id}, maxlen=DEAD_KEEP, approximate=True)
+        await self._finish(entry_id, job["chat_id"])
+        if self.on_dead:
+            try:
+                await self.on_dead(job)
+            except Exception as e:
+                logging.error(f"Ошибка обработки неудачного задания сводки: {e}")
+
+    async def depth(self) -> tuple[int, int]:
+        """(ещё не взятых, взятых и не подтверждённых) заданий."""
+        total = await self.r.xlen(STREAM)  # подтверждённые удаляются из потока
+        try:
+            groups = await self.r.xinfo_groups(STREAM)
+        except Exception:  # Потока ещё нет
+            groups = []
+        pending = next((int(group["pending"]) for group in groups if group["name"] == GROUP), 0)
+        return total - pending, pending
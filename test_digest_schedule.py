@@ -0,0 +1,50 @@
+"""Расписание дайджестов: разбор времени и момент запуска (python -m pytest test_digest_schedule.py)."""
+
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import digest_schedule
+
+LOCAL = timezone(timedelta(hours=digest_schedule.TZ_HOURS))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("21:00", "21:00"), ("9.30", "09:30"), (" 7:05 ", "07:05"), ("00:00", "00:00"),
+    ("24:00", None), ("12:60", None), ("1230", None), ("12:3", None), ("утром", None),
+])
+def test_parse_time(text, expected):
+    assert digest_schedule.parse_time(text) == expected
+
+
+def _jitter(chat_id: int, date: str) -> timedelta:
+    return timedelta(seconds=zlib.crc32(f"{chat_id}:{date}".encode()) % (digest_schedule.JITTER_MINUTES * 60))
+
+
+def test_due_after_time_and_jitter():
+    due = datetime(2026, 5, 1, 21, 0, tzinfo=LOCAL) + _jitter(-100, "2026-05-01")
+    assert digest_schedule.due_date(-100, "21:00", due - timedelta(seconds=1)) is None
+    assert digest_schedule.due_date(-100, "21:00", due) == "2026-05-01"
+    late = due + timedelta(minutes=digest_schedule.LATE_LIMIT_MINUTES)
+    assert digest_schedule.due_date(-100, "21:00", late - timedelta(seconds=1)) == "2026-05-01"
+    assert digest_schedule.due_date(-100, "21:00", late) is None
+
+
+def test_due_uses_local_date():
+    # 15:30 UTC - уже 01:30 следующего дня по местному времени
+    now = datetime(2026, 5, 1, 15, 30, tzinfo=timezone.utc)
+    jitter = _jitter(-100, "2026-05-02")
+    assert digest_schedule.due_date(-100, "01:00", now + jitter) == "2026-05-02"
+
+
+def test_jitter_does_not_cross_midnight():
+    now = datetime(2026, 5, 1, 23, 59, 30, tzinfo=LOCAL)
+    assert all(digest_schedule.due_date(chat_id, "23:55", now) == "2026-05-01" for chat_id in range(50))
+
+
+def test_late_window_crosses_midnight():
+    due = datetime(2026, 5, 1, 23, 0, tzinfo=LOCAL) + _jitter(-100, "2026-05-01")
+    after_midnight = datetime(2026, 5, 2, 1, 0, tzinfo=LOCAL)
+    assert due < after_midnight < due + timedelta(minutes=digest_schedule.LATE_LIMIT_MINUTES)
+    assert digest_schedule.due_date(-100, "23:00", after_midnight) == "2026-05-01"
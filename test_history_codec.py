@@ -0,0 +1,68 @@
+"""Формат записей истории: msgpack, zlib и чтение старого JSON (python -m pytest test_history_codec.py)."""
+
+import json
+
+from history_codec import (FMT_V1, FMT_V1_ZLIB, FMT_V2, FMT_V2_ZLIB, ZLIB_MIN_SIZE, decode_message,
+                           decode_messages, encode_message)
+
+
+def _v1(text: str = "привет", reply_to: int | None = None) -> dict:
+    message = {'id': 42, 'user_name': "user", 'full_name': "Пользователь", 'text': text}
+    if reply_to:
+        message['reply_to'] = reply_to
+    return message
+
+
+def test_v1_round_trip():
+    raw = encode_message(_v1())
+    assert raw[0] == FMT_V1
+    assert decode_message(raw) == _v1()
+
+
+def test_v1_reply_round_trip():
+    message = _v1(reply_to=7)
+    assert decode_message(encode_message(message)) == message
+
+
+def test_v1_zlib_round_trip():
+    message = _v1("длинная пересылка " * 100)
+    raw = encode_message(message)
+    assert raw[0] == FMT_V1_ZLIB
+    assert len(raw) < len(message['text'].encode())
+    assert decode_message(raw) == message
+
+
+def test_short_text_not_compressed():
+    raw = encode_message(_v1("а" * 100))  # повторы сжались бы, но запись короче ZLIB_MIN_SIZE
+    assert len(raw) < ZLIB_MIN_SIZE
+    assert raw[0] == FMT_V1
+
+
+def test_v2_round_trip():
+    message = {'id': 42, 'reply_to': 5, 'user_id': 123456789, 'text': "привет"}
+    raw = encode_message(message)
+    assert raw[0] == FMT_V2
+    assert decode_message(raw) == message
+
+
+def test_v2_zlib_round_trip():
+    message = {'id': 42, 'user_id': 123456789, 'text': "длинная пересылка " * 100}
+    raw = encode_message(message)
+    assert raw[0] == FMT_V2_ZLIB
+    assert decode_message(raw) == message
+
+
+def test_v2_drops_names():
+    message = {'id': 42, 'user_id': 7, 'user_name': "user", 'full_name': "Имя", 'text': "x"}
+    assert decode_message(encode_message(message)) == {'id': 42, 'user_id': 7, 'text': "x"}
+
+
+def test_json_dual_read():
+    message = _v1(reply_to=3)
+    assert decode_message(json.dumps(message, ensure_ascii=False)) == message
+    assert decode_message(json.dumps(message).encode()) == message
+
+
+def test_decode_messages_skips_broken():
+    raws = [encode_message(_v1()), b"", bytes((FMT_V1_ZLIB,)) + b"not zlib", b"{oops", encode_message(_v1("ещё"))]
+    assert [m['text'] for m in decode_messages(raws)] == ["привет", "ещё"]
@@ -0,0 +1,86 @@
+"""Поток истории: сообщения не по порядку и повторы (python -m pytest test_history_store.py)."""
+
+import asyncio
+
+import fakeredis
+
+import history_store
+
+
+def _msg(message_id: int, text: str = "") -> dict:
+    return {'id': message_id, 'text': text or f"сообщение {message_id}", 'user_name': "user",
+            'full_name': "Пользователь", 'reply_to': None}
+
+
+async def _write(store, chat_id, messages, max_history=100):
+    async with store.rb.pipeline() as pipe:
+        store.add_messages(pipe, chat_id, messages, max_history)
+        await pipe.execute()
+
+
+def _ids(messages: list[dict]) -> list[int]:
+    return [m['id'] for m in messages]
+
+
+def test_stream_out_of_order():
+    async def run():
+        store = history_store.create("stream", fakeredis.FakeAsyncRedis())
+        await _write(store, 1, [_msg(10)])
+        await _write(store, 1, [_msg(5)])  # опоздал: младше последнего в потоке
+        await _write(store, 1, [_msg(12), _msg(11)])
+
+        assert _ids(await store.latest(1, 10)) == [5, 10, 11, 12]
+        assert _ids(await store.latest(1, 2, offset=2)) == [5, 10]
+        assert _ids(await store.after(1, 4, 3)) == [10, 11, 12]
+        assert _ids(await store.after(1, 0, 10)) == [5, 10, 11, 12]
+        assert (await store.get(1, 5))['text'] == "сообщение 5"
+        assert await store.count(1) == 4
+        assert [msg_id for msg_id, _ in await store.oldest(1, 2)] == [5, 10]
+
+        assert await store.replace(1, _msg(5, "правка"))
+        assert (await store.get(1, 5))['text'] == "правка"
+        assert await store.delete(1, 5)
+        assert _ids(await store.latest(1, 10)) == [10, 11, 12]
+    asyncio.run(run())
+
+
+def test_stream_duplicate():
+    async def run():
+        store = history_store.create("stream", fakeredis.FakeAsyncRedis())
+        await _write(store, 1, [_msg(10), _msg(11)])
+        await _write(store, 1, [_msg(10, "повтор")])  # переотправленный апдейт
+        await _write(store, 1, [_msg(11)])
+        await _write(store, 1, [_msg(7)])
+        await _write(store, 1, [_msg(7)])
+
+        assert _ids(await store.latest(1, 10)) == [7, 10, 11]
+        assert (await store.get(1, 10))['text'] == "сообщение 10"
+        assert await store.count(1) == 3
+    asyncio.run(run())
+
+
+def test_migrate_into_stream_with_newer_messages():
+    async def run():
+        rb = fakeredis.FakeAsyncRedis()
+        source, target = history_store.create("zset", rb), history_store.create("stream", rb)
+        await _write(source, 1, [_msg(i) for i in range(1, 6)])
+        await _write(target, 1, [_msg(9)])  # бот уже пишет в новый бэкенд
+
+        assert await history_store.migrate_backend(source, target) == 1
+        assert _ids(await target.latest(1, 10)) == [1, 2, 3, 4, 5, 9]
+    asyncio.run(run())
+
+
+def test_stream_edits_pruned_after_trim():
+    async def run():
+        store = history_store.create("stream", fakeredis.FakeAsyncRedis())
+        await _write(store, 1, [_msg(i) for i in range(1, 4)])
+        assert await store.replace(1, _msg(1, "правка"))
+        for i in range(4, 300):  # архив выключен: старое обрезает только MAXLEN
+            await _write(store, 1, [_msg(i)], max_history=100)
+        assert await store.rb.xlen(store.key(1)) < 200
+
+        assert await store.replace(1, _msg(299, "правка"))
+        assert await store.rb.hkeys(store.edits_key(1)) == [b"299"]
+        assert (await store.get(1, 299))['text'] == "правка"
+    asyncio.run(run())
@@ -0,0 +1,45 @@
+"""Кеш вердиктов картинок: поиск похожих по полосам pHash (python -m pytest test_image_verdicts.py)."""
+
+import asyncio
+
+import fakeredis
+
+import image_verdicts
+
+
+def _flip(phash: str, *bits: int) -> str:
+    value = int(phash, 16)
+    for bit in bits:
+        value ^= 1 << bit
+    return f"{value:016x}"
+
+
+def test_near_hash_found_through_bands():
+    async def run():
+        r = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await image_verdicts.put(r, "8f3c1e0a55aa33cc", True)
+        # По биту в четырёх полосах из пяти - пятая совпадает
+        assert await image_verdicts.get(r, _flip("8f3c1e0a55aa33cc", 0, 13, 26, 39)) is True
+        assert await image_verdicts.get(r, _flip("8f3c1e0a55aa33cc", 0, 13, 26, 39, 52)) is None
+        assert await image_verdicts.get(r, "8f3c1e0a55aa33cc") is True
+        assert await image_verdicts.stats(r) == (1, 1, 1)
+    asyncio.run(run())
+
+
+def test_eviction_cleans_bands():
+    async def run():
+        r = fakeredis.FakeAsyncRedis(decode_responses=True)
+        image_verdicts.CACHE_MAX_ENTRIES, limit = 2, image_verdicts.CACHE_MAX_ENTRIES
+        try:
+            for phash in ("0000000000000001", "1000000000000000", "ffffffffffffffff"):
+                await image_verdicts.put(r, phash, phash == "0000000000000001")
+        finally:
+            image_verdicts.CACHE_MAX_ENTRIES = limit
+        assert await r.hkeys(image_verdicts.VERDICTS_KEY) == ["1000000000000000", "ffffffffffffffff"]
+        members = set()
+        for key in image_verdicts._band_keys("0000000000000001"):
+            members |= await r.smembers(key)
+        assert "0000000000000001" not in members
+        # Ближе всего вытесненный 0...01 (True), находится оставшийся 10...0
+        assert await image_verdicts.get(r, "0000000000000003") is False
+    asyncio.run(run())
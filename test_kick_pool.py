@@ -0,0 +1,64 @@
+"""Пул фраз о бане: разбор ответа AI, подстановка, род (python -m pytest test_kick_pool.py)."""
+
+import asyncio
+
+import fakeredis
+import pytest
+
+import kick_pool
+
+
+def test_parse_templates_strips_markers_and_quotes():
+    text = '1. "{KOGO}, на выход! {KTO} доволен 😎"\n- «{KTO} закрыл дверь за {KOGO}»\n• {KOGO} - минус один, {KTO} следит'
+    assert kick_pool.parse_templates(text) == [
+        "{KOGO}, на выход! {KTO} доволен 😎",
+        "{KTO} закрыл дверь за {KOGO}",
+        "{KOGO} - минус один, {KTO} следит",
+    ]
+
+
+@pytest.mark.parametrize("line", [
+    "{KOGO} ушёл",  # нет {KTO}
+    "{KTO} и снова {KTO} против {KOGO}",  # плейсхолдер дважды
+    "{KTO} " + "очень " * 50 + "{KOGO}",  # длиннее MAX_TEMPLATE_LENGTH
+    "",
+])
+def test_parse_templates_drops_bad_lines(line):
+    assert kick_pool.parse_templates(line) == []
+
+
+def test_parse_templates_none():
+    assert kick_pool.parse_templates(None) == []
+
+
+def test_render_escapes_template_not_names():
+    kto, kogo = "[Админ](tg://user?id=1)", "[Спамер\\_1](tg://user?id=2)"
+    text = kick_pool.render("{KOGO}, на выход! {KTO} (модератор) доволен.", kto, kogo)
+    assert text == "[Спамер\\_1](tg://user?id=2), на выход\\! [Админ](tg://user?id=1) \\(модератор\\) доволен\\."
+
+
+@pytest.mark.parametrize("name, gender", [
+    ("Мария Иванова", "f"), ("Anna", "f"), ("Никита", "m"), ("Илья", "m"), ("Иван", "m"),
+    ("dv_pod", "m"), ("Ая", "m"), ("🙂", "m"), ("", "m"),
+])
+def test_guess_gender(name, gender):
+    assert kick_pool.guess_gender(name) == gender
+
+
+def test_take_pops_and_refills_in_background():
+    async def run():
+        r = fakeredis.FakeAsyncRedis(decode_responses=True)
+        requests = []
+
+        async def generate(context, gender, count, chat_id=None):
+            requests.append((context, gender, count, chat_id))
+            return [f"{{KOGO}} x{i} {{KTO}}" for i in range(count)]
+
+        pool = kick_pool.KickPool(r, generate)
+        assert await pool.take("bot", "m", chat_id=-100) is None  # пул пуст - пополнение в фоне
+        await pool._refill_task
+        assert len(requests) == 4 and all(chat_id == -100 for *_, chat_id in requests)
+        assert await pool.take("bot", "m") == "{KOGO} x0 {KTO}"
+        assert (pool.hits, pool.misses) == (1, 1)
+        assert await r.get(kick_pool.REFILL_LOCK_KEY) is None
+    asyncio.run(run())
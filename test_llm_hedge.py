@@ -0,0 +1,81 @@
+"""Дедлайны и дублирование запросов к запасной модели (python -m pytest test_llm_hedge.py)."""
+
+import asyncio
+
+import pytest
+
+import llm_hedge
+from llm_hedge import Hedger
+
+
+def _call(delays: dict, errors: dict | None = None, log: list | None = None):
+    async def call(model):
+        if log is not None:
+            log.append(model)
+        await asyncio.sleep(delays[model])
+        if errors and model in errors:
+            raise errors[model]
+        return model
+    return call
+
+
+def test_fast_primary_is_not_hedged():
+    async def run():
+        hedger = Hedger("main", "spare")
+        log = []
+        assert await hedger.run("summary", _call({"main": 0.01, "spare": 0.01}, log=log), deadline=1.0) == "main"
+        assert log == ["main"]
+        assert hedger.hedged["summary"] == 0
+    asyncio.run(run())
+
+
+def test_slow_primary_hedged_after_cold_start_fraction():
+    async def run():
+        hedger = Hedger("main", "spare")
+        log = []
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await hedger.run("summary", _call({"main": 1.0, "spare": 0.01}, log=log), deadline=0.2)
+        assert result == "spare"
+        assert log == ["main", "spare"]
+        assert loop.time() - started >= 0.2 * llm_hedge.COLD_START_FRACTION
+        assert hedger.hedged["summary"] == 1 and hedger.wins[("summary", "spare")] == 1
+        assert len(hedger._latency[("summary", "main")]) == 1  # отменённый запрос - тоже замер
+    asyncio.run(run())
+
+
+def test_hedge_at_p95_once_warmed_up():
+    async def run():
+        hedger = Hedger("main", "spare")
+        hedger._latency[("summary", "main")].extend([0.02] * llm_hedge.MIN_SAMPLES)
+        assert hedger.p95("summary", "main") == 0.02
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await hedger.run("summary", _call({"main": 1.0, "spare": 0.01}), deadline=2.0) == "spare"
+        assert loop.time() - started < 0.5  # не ждали половину дедлайна
+    asyncio.run(run())
+
+
+def test_failed_primary_hedged_immediately():
+    async def run():
+        hedger = Hedger("main", "spare")
+        call = _call({"main": 0.0, "spare": 0.01}, errors={"main": RuntimeError("503")})
+        assert await hedger.run("summary", call, deadline=10.0) == "spare"
+    asyncio.run(run())
+
+
+def test_deadline_without_fallback():
+    async def run():
+        hedger = Hedger("main")
+        with pytest.raises(asyncio.TimeoutError):
+            await hedger.run("summary", _call({"main": 1.0}), deadline=0.05)
+        assert hedger.timeouts["summary"] == 1
+    asyncio.run(run())
+
+
+def test_error_without_fallback_is_raised():
+    async def run():
+        hedger = Hedger("main")
+        with pytest.raises(RuntimeError):
+            await hedger.run("summary", _call({"main": 0.0}, errors={"main": RuntimeError("500")}), deadline=1.0)
+    asyncio.run(run())
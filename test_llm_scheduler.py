@@ -0,0 +1,130 @@
+"""Планировщик запросов к AI: приоритеты, круг по чатам, пауза после 429 (python -m pytest test_llm_scheduler.py)."""
+
+import asyncio
+
+import pytest
+
+import llm_scheduler
+from llm_scheduler import JOKE, KICK, SUMMARY, VERIFICATION, LLMScheduler
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "BACKOFF_BASE", 0.02)
+    monkeypatch.setattr(llm_scheduler.random, "uniform", lambda a, b: 1.0)
+
+
+def test_is_rate_limited():
+    assert llm_scheduler.is_rate_limited(RateLimited())
+    assert llm_scheduler.is_rate_limited(Exception("429 RESOURCE_EXHAUSTED"))
+    assert not llm_scheduler.is_rate_limited(ValueError("500 internal"))
+
+
+def test_priority_then_chats_round_robin():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        order = []
+
+        def job(name):
+            async def call():
+                order.append(name)
+                if name == "first":
+                    await gate.wait()
+            return call
+
+        first = asyncio.create_task(scheduler.run(SUMMARY, 1, job("first")))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(scheduler.run(priority, chat_id, job(name))) for priority, chat_id, name in (
+            (JOKE, 1, "joke"), (SUMMARY, 1, "sum1-a"), (SUMMARY, 1, "sum1-b"), (SUMMARY, 2, "sum2"),
+            (KICK, 3, "kick"), (VERIFICATION, 4, "verify"),
+        )]
+        await asyncio.sleep(0)
+        assert scheduler.waiting() == 6
+        gate.set()
+        await asyncio.gather(first, *tasks)
+        # Важнее класс; внутри сводок чаты по кругу, а не все запросы чата 1 подряд
+        assert order == ["first", "verify", "kick", "sum1-a", "sum2", "sum1-b", "joke"]
+        assert scheduler.active == 0
+    asyncio.run(run())
+
+
+def test_429_backoff_retries_and_grows(fast_backoff):
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=2)
+        attempts = []
+        loop = asyncio.get_running_loop()
+
+        async def call():
+            attempts.append(loop.time())
+            if len(attempts) < 3:
+                raise RateLimited("429")
+            return "ok"
+
+        assert await scheduler.run(SUMMARY, 1, call) == "ok"
+        pauses = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        assert scheduler.rate_limited == 2
+        assert pauses[0] >= 0.02 and pauses[1] >= 0.04  # пауза удваивается
+        assert scheduler._backoff == 0.0  # успех сбрасывает паузу
+    asyncio.run(run())
+
+
+def test_429_gives_up_after_max_retries(fast_backoff):
+    async def run():
+        scheduler = LLMScheduler()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            raise RateLimited("429")
+
+        with pytest.raises(RateLimited):
+            await scheduler.run(SUMMARY, 1, call)
+        assert len(calls) == llm_scheduler.MAX_RETRIES + 1
+        assert scheduler.active == 0
+    asyncio.run(run())
+
+
+def test_other_errors_are_not_retried():
+    async def run():
+        scheduler = LLMScheduler()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            raise ValueError("bad request")
+
+        with pytest.raises(ValueError):
+            await scheduler.run(SUMMARY, 1, call)
+        assert calls == [1]
+        assert scheduler.active == 0
+    asyncio.run(run())
+
+
+def test_pause_holds_queued_requests(fast_backoff):
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1)
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        async def limited():
+            started.setdefault("limited", loop.time())
+            if scheduler.rate_limited == 0:
+                raise RateLimited("429")
+            return "limited"
+
+        async def other():
+            started["other"] = loop.time()
+            return "other"
+
+        first = asyncio.create_task(scheduler.run(SUMMARY, 1, limited))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(scheduler.run(VERIFICATION, 2, other))
+        assert await asyncio.gather(first, second) == ["limited", "other"]
+        # После 429 следующий запрос ждёт паузу, даже если он важнее
+        assert started["other"] - started["limited"] >= 0.02
+    asyncio.run(run())
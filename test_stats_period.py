@@ -0,0 +1,50 @@
+"""Периоды /top_u: разбор в корзины статистики и замена старых дней месяцами (python -m pytest test_stats_period.py)."""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123:abc")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+import main  # noqa: E402
+
+
+def _day(days_ago: int) -> str:
+    return (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+
+
+@pytest.mark.parametrize("period, buckets", [
+    ("all_time", ["all_time"]),
+    ("2025-07", ["2025-07"]),
+    ("2025-07-15", ["2025-07-15"]),
+    ("2024-11..2025-02", ["2024-11", "2024-12", "2025-01", "2025-02"]),
+    ("2025-02-27..2025-03-02", ["2025-02-27", "2025-02-28", "2025-03-01", "2025-03-02"]),
+])
+def test_parse_stats_period(period, buckets):
+    assert main.parse_stats_period(period) == buckets
+
+
+def test_parse_last_days():
+    assert main.parse_stats_period("3d") == [_day(2), _day(1), _day(0)]
+    assert len(main.parse_stats_period(f"{main.DAILY_STATS_KEEP_DAYS}d")) == main.DAILY_STATS_KEEP_DAYS
+
+
+@pytest.mark.parametrize("period", [
+    "0d", f"{main.DAILY_STATS_KEEP_DAYS + 1}d", "2025-07..2025-07-15", "2025-03..2025-01", "2025-02-30..2025-03-02",
+    "2000-01-01..2025-01-01", "вчера", "m",
+])
+def test_parse_stats_period_rejects(period):
+    assert main.parse_stats_period(period) is None
+
+
+def test_coarsen_keeps_recent_and_monthly_periods():
+    for period in ("all_time", "2025-07", "7d", f"{main.DAILY_STATS_KEEP_DAYS}d", _day(3), f"{_day(10)}..{_day(1)}"):
+        assert main.coarsen_stats_period(period) == period
+
+
+def test_coarsen_old_days_to_months():
+    old = datetime.now() - timedelta(days=main.DAILY_STATS_KEEP_DAYS + 30)
+    assert main.coarsen_stats_period(old.strftime("%Y-%m-%d")) == old.strftime("%Y-%m")
+    assert main.coarsen_stats_period(f"{old:%Y-%m-%d}..{_day(1)}") == f"{old:%Y-%m}..{_day(1)[:7]}"
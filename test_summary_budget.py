@@ -0,0 +1,32 @@
+"""Кривые бюджета размышлений и длины сводки (python -m pytest test_summary_budget.py)."""
+
+import pytest
+
+import summary_budget
+
+
+def test_parse_curve_sorts_points():
+    assert summary_budget.parse_curve("8000:4096,2000:1024") == [(2000, 1024), (8000, 4096)]
+
+
+@pytest.mark.parametrize("text", ["", "2000", "2000:1024,x:1", "2000:1024:5"])
+def test_parse_curve_rejects_garbage(text):
+    with pytest.raises(ValueError):
+        summary_budget.parse_curve(text)
+
+
+def test_interpolate_between_and_beyond_points():
+    curve = summary_budget.parse_curve("2000:1024,8000:4096")
+    assert summary_budget.interpolate(curve, 0) == 1024
+    assert summary_budget.interpolate(curve, 2000) == 1024
+    assert summary_budget.interpolate(curve, 5000) == 2560
+    assert summary_budget.interpolate(curve, 8000) == 4096
+    assert summary_budget.interpolate(curve, 100000) == 4096
+
+
+def test_default_curves_grow_with_window():
+    for text in (summary_budget.THINKING_CURVE, summary_budget.LENGTH_CURVE):
+        curve = summary_budget.parse_curve(text)
+        values = [summary_budget.interpolate(curve, tokens) for tokens in range(0, 50000, 1000)]
+        assert values == sorted(values)
+    assert summary_budget.interpolate(summary_budget.parse_curve(summary_budget.LENGTH_CURVE), 10 ** 6) <= 3900
@@ -0,0 +1,83 @@
+"""Длинная сводка: несколько сообщений, обрезка, сокращение через AI (python -m pytest test_summary_length.py)."""
+
+import asyncio
+import os
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123:abc")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+import main  # noqa: E402
+
+PART_LEN = main.TG_MAX_LENGTH - 200
+
+
+def _paragraphs(count: int, length: int = 1000) -> str:
+    return "\n\n".join(f"{i} " + "я" * (length - 2) for i in range(count))
+
+
+async def _no_typing():
+    await asyncio.sleep(3600)
+
+
+def _fit(summary: str, shortened: str | None = None) -> tuple[str, list[str]]:
+    calls = []
+
+    async def shorten(text, *args, **kwargs):
+        calls.append(text)
+        return shortened
+
+    original, main.shorten_text_with_ai = main.shorten_text_with_ai, shorten
+    try:
+        return asyncio.run(main.fit_summary_length(summary, _no_typing)), calls
+    finally:
+        main.shorten_text_with_ai = original
+
+
+def test_split_hard_splits_long_line():
+    line = " ".join(["слово"] * 2000)
+    parts = main._split_tg_message(line, 1000)
+    assert all(len(part) <= 1000 for part in parts)
+    assert " ".join(parts).split() == line.split()
+
+
+def test_split_keeps_escape_with_char():
+    parts = main._split_tg_message("a" * 9 + "\\." + "b" * 9, 10)
+    assert parts[0] == "a" * 9
+    assert parts[1].startswith("\\.")
+
+
+def test_fits_in_parts_without_ai():
+    summary = _paragraphs(6)  # ~6000 символов - два сообщения
+    result, calls = _fit(summary)
+    assert result == summary
+    assert not calls
+
+
+def test_single_long_line_is_split_not_shortened():
+    summary = " ".join(["слово"] * 1200)  # ~7200 символов одной строкой
+    result, calls = _fit(summary)
+    assert result == summary
+    assert not calls
+
+
+def test_truncates_to_kept_parts():
+    summary = _paragraphs(30, 400)  # ~12000 символов, в два сообщения не влезает
+    result, calls = _fit(summary)
+    assert not calls
+    assert summary.startswith(result)
+    assert len(main._split_tg_message(result, PART_LEN)) <= main.SUMMARY_MAX_PARTS
+    assert len(result) >= main.SUMMARY_MAX_PARTS * PART_LEN * main.TRUNCATE_KEEP_RATIO
+
+
+def test_ai_fallback_when_truncation_loses_too_much():
+    summary = _paragraphs(3, 3000)  # абзацы по 3000: в два сообщения влезают только два
+    result, calls = _fit(summary, shortened="коротко")
+    assert calls == [summary]
+    assert result == "коротко"
+
+
+def test_ai_fallback_failure_keeps_original():
+    summary = _paragraphs(3, 3000)
+    result, calls = _fit(summary, shortened=None)
+    assert calls
+    assert result == summary
@@ -0,0 +1,68 @@
+"""Справочник пользователей чата: chat:{id}:users (user_id -> username, full_name, last_seen).
+
+Записи истории хранят только user_id, имена подтягиваются отсюда одним HMGET.
+Справочник пополняется при приёме сообщений; запись в Redis происходит
+только при смене имени или раз в USER_SEEN_REFRESH секунд, а не на каждое сообщение.
+В памяти помнятся KNOWN_MAX_ENTRIES последних пользователей (LRU).
+"""
+
+import json
+import time
+from collections import OrderedDict
+
+USER_SEEN_REFRESH = 3600  # секунд между обновлениями last_seen одного пользователя
+KNOWN_MAX_ENTRIES = 50000  # пар (чат, пользователь) в памяти; вытесненный просто запишется в Redis ещё раз
+
+# (chat_id, user_id) -> (username, full_name, время последней записи в Redis), от давних к недавним
+_known: OrderedDict[tuple[int, int], tuple[str | None, str | None, float]] = OrderedDict()
+
+
+def users_key(chat_id: int | str) -> str:
+    return f"chat:{chat_id}:users"
+
+
+async def remember(r, chat_id: int, user_id: int, user_name: str | None, full_name: str | None):
+    """Обновляет запись пользователя, если имя изменилось или last_seen устарел."""
+    now = time.time()
+    cached = _known.get((chat_id, user_id))
+    if cached and cached[0] == user_name and cached[1] == full_name and now - cached[2] < USER_SEEN_REFRESH:
+        _known.move_to_end((chat_id, user_id))
+        return
+    await r.hset(users_key(chat_id), user_id, json.dumps({
+        "user_name": user_name,
+        "full_name": full_name,
+        "last_seen": int(now),
+    }, ensure_ascii=False))
+    _known[(chat_id, user_id)] = (user_name, full_name, now)
+    _known.move_to_end((chat_id, user_id))
+    while len(_known) > KNOWN_MAX_ENTRIES:
+        _known.popitem(last=False)
+
+
+async def lookup(r, chat_id: int, user_ids) -> dict[int, dict]:
+    """Возвращает {user_id: запись} для известных пользователей одним HMGET."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    values = await r.hmget(users_key(chat_id), user_ids)
+    return {int(uid): json.loads(value) for uid, value in zip(user_ids, values) if value}
+
+
+async def attach_names(r, chat_id: int, messages: list[dict]) -> list[dict]:
+    """
+    Подставляет user_name/full_name в записи истории, где есть только user_id.
+    Старые записи с именами остаются как есть. Порядок ключей прежний.
+    """
+    users = await lookup(r, chat_id, {m['user_id'] for m in messages if 'user_id' in m})
+    for i, msg in enumerate(messages):
+        if 'user_id' not in msg:
+            continue
+        info = users.get(msg['user_id'], {})
+        joined = {'id': msg['id']}
+        if 'reply_to' in msg:
+            joined['reply_to'] = msg['reply_to']
+        joined['user_name'] = info.get('user_name') or "None"
+        joined['full_name'] = info.get('full_name') or f"ID:{msg['user_id']}"
+        joined['text'] = msg['text']
+        messages[i] = joined
+    return messages
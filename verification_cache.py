@@ -0,0 +1,130 @@
+"""Кеш в памяти: кто из участников сейчас проходит проверку (chat:{id}:new_user_join).
+
+Каждое сообщение группы проверяется на "этот пользователь на верификации?",
+а хеш почти всегда пуст. Кеш отвечает без запроса к Redis. Изменения
+(вход, очистка) публикуются в канал VERIFICATION_CHANNEL, и остальные процессы
+бота обновляют у себя ту же картину. Пока подписка не установлена
+или оборвалась, is_pending честно спрашивает Redis (HEXISTS).
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+
+VERIFICATION_CHANNEL = "verification:changes"
+RESUBSCRIBE_DELAY = 5  # секунд между попытками переподписки после обрыва
+
+
+def join_key(chat_id: int | str) -> str:
+    return f"chat:{chat_id}:new_user_join"
+
+
+def _apply_op(pending: dict[int, set[int]], op: str, chat_id: int, user_id: int):
+    if op == "add":
+        pending[chat_id].add(user_id)
+    elif op == "del":
+        users = pending.get(chat_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del pending[chat_id]
+    elif op == "drop":
+        pending.pop(chat_id, None)
+
+
+class VerificationCache:
+    def __init__(self, redis_client):
+        self.r = redis_client
+        self.instance = uuid.uuid4().hex[:8]  # свои же публикации пропускаем
+        self.ready = False  # True, пока кеш синхронизирован через подписку
+        self._pending: dict[int, set[int]] = defaultdict(set)  # chat_id -> user_id на проверке
+        # Свои изменения во время _reload: свои публикации _apply пропускает, поэтому
+        # они накладываются на новый снимок перед заменой
+        self._journal: list[tuple[str, int, int]] | None = None
+
+        # Статистика для логов и бенчмарков
+        self.hits = 0
+        self.fallbacks = 0
+
+    async def is_pending(self, chat_id: int, user_id: int) -> bool:
+        """Проходит ли пользователь проверку в чате."""
+        if self.ready:
+            self.hits += 1
+            pending = self._pending.get(chat_id)
+            return bool(pending) and user_id in pending
+        self.fallbacks += 1
+        return bool(await self.r.hexists(join_key(chat_id), user_id))
+
+    async def add(self, chat_id: int, user_id: int):
+        """Отмечает пользователя на проверке (после HSET в new_user_join)."""
+        self._local("add", chat_id, user_id)
+        await self._publish("add", chat_id, user_id)
+
+    async def remove(self, chat_id: int, user_id: int):
+        """Снимает отметку (после HDEL из new_user_join)."""
+        self._local("del", chat_id, user_id)
+        await self._publish("del", chat_id, user_id)
+
+    async def drop_chat(self, chat_id: int):
+        """Забывает чат целиком (ключи чата удалены)."""
+        self._local("drop", chat_id, 0)
+        await self._publish("drop", chat_id, 0)
+
+    def _local(self, op: str, chat_id: int, user_id: int):
+        _apply_op(self._pending, op, chat_id, user_id)
+        if self._journal is not None:
+            self._journal.append((op, chat_id, user_id))
+
+    async def _publish(self, op: str, chat_id: int, user_id: int):
+        try:
+            await self.r.publish(VERIFICATION_CHANNEL, f"{self.instance}:{op}:{chat_id}:{user_id}")
+        except Exception as e:
+            # Другие процессы не узнают об изменении - пусть перечитают всё при переподписке
+            logging.error(f"Не удалось опубликовать изменение верификации: {e}")
+
+    def _apply(self, data: str):
+        instance, op, chat_id, user_id = data.split(':')
+        if instance == self.instance:
+            return
+        _apply_op(self._pending, op, int(chat_id), int(user_id))
+
+    async def _reload(self):
+        """Полное чтение состояния из Redis (после (пере)подписки)."""
+        pending = defaultdict(set)
+        self._journal = []
+        try:
+            async for key in self.r.scan_iter(join_key("*")):
+                chat_id = int(key.split(':')[1])
+                for user_id in await self.r.hkeys(key):
+                    pending[chat_id].add(int(user_id))
+            # Чат мог быть прочитан до своего add/del - повторяем их на снимке
+            for op, chat_id, user_id in self._journal:
+                _apply_op(pending, op, chat_id, user_id)
+            self._pending = pending
+        finally:
+            self._journal = None
+        logging.info(f"Кеш верификации загружен: {sum(map(len, pending.values()))} участников в {len(pending)} чатах.")
+
+    async def listen(self):
+        """Фоновая задача: подписка на изменения. Запускается один раз на процесс."""
+        while True:
+            pubsub = self.r.pubsub()
+            try:
+                await pubsub.subscribe(VERIFICATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._apply(message['data'])
+                    elif message['type'] == 'subscribe':
+                        # Подписка (в т.ч. повторная после переподключения клиента) активна:
+                        # всё, что изменится во время чтения, придёт следом
+                        await self._reload()
+                        self.ready = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Подписка на изменения верификации оборвалась: {e}")
+            finally:
+                self.ready = False
+                await pubsub.aclose()
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
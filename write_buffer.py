@@ -0,0 +1,155 @@
+"""Буфер отложенной записи (write-behind) для входящих сообщений.
+
+Сообщения копятся в памяти несколько миллисекунд (или до N штук), инкременты
+статистики одного пользователя складываются, и всё уходит в Redis одним pipeline.
+При остановке бота буфер сбрасывается с ограничением по времени.
+Если Redis недоступен, записи возвращаются в буфер и сброс повторяется
+через RETRY_DELAY секунд. При других ошибках сброс повторяется не больше
+MAX_RETRIES раз подряд, после чего ID несохранённых сообщений пишутся в лог.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+
+from redis.exceptions import ConnectionError as RedisConnectionError, ResponseError, TimeoutError as RedisTimeoutError
+
+RETRY_DELAY = 1.0  # секунд до повтора сброса после ошибки
+MAX_RETRIES = 3  # повторов подряд при ошибках, кроме соединения (они повторяются, пока Redis не вернётся)
+
+
+class WriteBuffer:
+    def __init__(self, redis_client, history, max_history: int, delay_ms: int = 20, max_messages: int = 100):
+        self.r = redis_client
+        self.history = history  # хранилище истории (history_store)
+        self.max_history = max_history
+        self.delay = delay_ms / 1000
+        self.max_messages = max_messages
+
+        self._records: dict[int, list[dict]] = defaultdict(list)  # chat_id -> записи истории
+        self._incr: dict[tuple[str, str], float] = defaultdict(float)  # (ключ ZSET, участник) -> прибавка
+        self._pending = 0
+        self._timer: asyncio.Task | None = None
+        self._flush_task: asyncio.Task | None = None
+        self._inflight: dict[int, list[dict]] = {}  # записи сброса, который сейчас идёт
+        self._inflight_edits: list[tuple[int, dict]] = []  # правки к ним - после записи
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+        self._failures = 0  # неудачных сбросов подряд (кроме ошибок соединения)
+
+        # Статистика для логов и бенчмарков
+        self.flushes = 0
+        self.flushed_messages = 0
+        self.retries = 0
+
+    def add(self, chat_id: int, message_data: dict, increments: list[tuple[str, int | str, float]]):
+        """Ставит сообщение и инкременты ZSET вида (ключ, участник, прибавка) в очередь на запись."""
+        self._records[chat_id].append(message_data)
+        for key, member, amount in increments:
+            self._incr[(key, str(member))] += amount
+        self._pending += 1
+
+        if (self._closed or self._pending >= self.max_messages) and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+        elif self._timer is None:
+            # Идущий сброс новые записи уже не захватит - их заберёт следующий
+            self._timer = asyncio.create_task(self._delayed_flush())
+
+    def update_pending(self, chat_id: int, message_data: dict) -> bool:
+        """Подменяет запись, ещё не ушедшую в Redis (для правок). True, если нашлась."""
+        for i, pending in enumerate(self._records.get(chat_id, ())):
+            if pending['id'] == message_data['id']:
+                self._records[chat_id][i] = message_data
+                return True
+        for i, pending in enumerate(self._inflight.get(chat_id, ())):
+            if pending['id'] == message_data['id']:
+                # Запись уже уходит в Redis: правка применится сразу после сброса
+                self._inflight[chat_id][i] = message_data
+                self._inflight_edits.append((chat_id, message_data))
+                return True
+        return False
+
+    async def _delayed_flush(self, delay: float | None = None):
+        await asyncio.sleep(self.delay if delay is None else delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Записывает всё накопленное одним pipeline."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            records, self._records = self._records, defaultdict(list)
+            incr, self._incr = self._incr, defaultdict(float)
+            count, self._pending = self._pending, 0
+            self._inflight = records
+
+            try:
+                async with self.r.pipeline(transaction=False) as pipe:
+                    for (key, member), amount in incr.items():
+                        pipe.zincrby(key, amount, member)
+                    for chat_id, messages in records.items():
+                        self.history.add_messages(pipe, chat_id, messages, self.max_history)
+                    await pipe.execute()
+            except (RedisConnectionError, RedisTimeoutError, OSError) as e:
+                # Redis недоступен - возвращаем всё в буфер (перед новыми записями) и повторяем
+                self._requeue(records, incr, count)
+                logging.error(f"Ошибка соединения при записи буфера ({count} сообщений), повтор через {RETRY_DELAY} с: {e}")
+                self._retry_soon()
+                return
+            except Exception as e:
+                self._failures += 1
+                if self._failures > MAX_RETRIES:
+                    self._failures = 0
+                    lost = {chat_id: [m['id'] for m in messages] for chat_id, messages in records.items()}
+                    logging.error(f"Буфер записи: {count} сообщений не записаны после {MAX_RETRIES} повторов, "
+                                  f"отброшены (чат -> ID): {lost}; инкрементов статистики: {len(incr)}. Ошибка: {e}",
+                                  exc_info=True)
+                    return
+                # Pipeline без транзакции при ответе-ошибке уже выполнил остальные команды: повтор истории
+                # безопасен (те же записи и ID), а инкременты повторно не отправляем, чтобы не посчитать дважды
+                sent = isinstance(e, ResponseError)
+                self._requeue(records, {} if sent else incr, count)
+                logging.error(f"Ошибка записи буфера ({count} сообщений), повтор {self._failures}/{MAX_RETRIES} "
+                              f"через {RETRY_DELAY} с{', инкременты статистики уже отправлены' if sent else ''}: {e}",
+                              exc_info=True)
+                self._retry_soon()
+                return
+            finally:
+                self._inflight = {}
+                edits, self._inflight_edits = self._inflight_edits, []
+
+            for chat_id, message_data in edits:
+                try:
+                    await self.history.replace(chat_id, message_data)
+                except Exception as e:
+                    logging.error(f"Не удалось применить правку сообщения {message_data['id']} после сброса: {e}")
+
+            self._failures = 0
+            self.flushes += 1
+            self.flushed_messages += count
+            logging.debug(f"Буфер записи: сброшено {count} сообщений из {len(records)} чатов.")
+
+    def _retry_soon(self):
+        self.retries += 1
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._delayed_flush(RETRY_DELAY))
+
+    def _requeue(self, records: dict[int, list[dict]], incr: dict[tuple[str, str], float], count: int):
+        for chat_id, messages in records.items():
+            self._records[chat_id][:0] = messages
+        for key, amount in incr.items():
+            self._incr[key] += amount
+        self._pending += count
+
+    async def close(self, timeout: float = 5.0):
+        """Финальный сброс при остановке. Ждём не дольше timeout секунд."""
+        self._closed = True
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Не успели сбросить буфер записи за {timeout} с, часть сообщений потеряна.")
+        logging.info(f"Буфер записи закрыт: {self.flushed_messages} сообщений за {self.flushes} сбросов.")